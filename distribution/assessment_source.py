@@ -0,0 +1,125 @@
+import json
+from abc import ABCMeta, abstractmethod
+import pandas as pd
+import logging
+logger = logging.getLogger()
+
+try:
+    import orjson
+    loads = orjson.loads  # several times faster than json.loads on the large result documents
+except ImportError:
+    loads = json.loads
+
+PROJECT_ID = 'sme-modeling'
+MODULE = 'droid'
+CHUNK_SIZE = 10000  # number of rows of a local export read at once
+
+
+def extract_indicators(result, indicators, data):
+    """
+    :param result: the parsed result document of one module result, {'risks_data': {indicator: {'data': {...}}, ...}}
+    :param indicators: the indicators we extract
+    :param data: a dictionary of indicator to list, the data of every indicator found in result is appended to it
+    """
+    risks_data = result.get('risks_data') or {}
+    for indicator in indicators:
+        value = (risks_data.get(indicator) or {}).get('data')
+        if value:
+            data[indicator].append(value)
+
+
+class AssessmentSource(metaclass=ABCMeta):
+    """
+    A source of assessment data. read() returns a dictionary of indicator to the list of the 'data' documents of that indicator, for the module
+    results of a tag.
+    """
+    @abstractmethod
+    def read(self, indicators):
+        pass
+
+
+class BigQuerySource(AssessmentSource):
+    def __init__(self, tag, project_id=PROJECT_ID):
+        """
+        :param tag: a string of tag name that we want to get data with.
+        :param project_id: the google cloud project of the query
+        """
+        self.tag = tag
+        self.project_id = project_id
+
+    def read(self, indicators):
+        """
+        :param indicators: the indicators we extract
+        :return: the data of every indicator. All the indicators are extracted by one query, so the table is scanned once
+        """
+        logger.info(f'Reading data from big query, indicators: {indicators}')
+        columns = ',\n'.join(f"json_extract(result, '$.risks_data.{indicator}.data') as {indicator}" for indicator in indicators)
+        query = f"""
+        select {columns}
+        from `sme_modeling.ModuleResult`
+        where '{self.tag}' in unnest(tags)
+        and module = '{MODULE}'
+        """
+
+        data_frame = pd.read_gbq(query, self.project_id, dialect='standard')
+
+        data = {indicator: [] for indicator in indicators}
+        for indicator in indicators:
+            for row in data_frame[indicator].tolist():
+                if row and row != '{}':
+                    data[indicator].append(loads(row))
+
+        logger.info('Big query done')
+        return data
+
+
+class LocalSource(AssessmentSource):
+    def __init__(self, path, tag=None, chunk_size=CHUNK_SIZE):
+        """
+        :param path: path of a local export of ModuleResult, either newline-delimited json (.json, .jsonl, .ndjson) or parquet (.parquet, needs
+        pyarrow). A row is a module result with a 'result' column (a json string or a document) and optional 'module' and 'tags' columns, or
+        directly a result document
+        :param tag: only read the rows with this tag, None to read all the rows. Rows without tags are always read
+        :param chunk_size: number of rows read at once, the export is never loaded at once
+        """
+        self.path = path
+        self.tag = tag
+        self.chunk_size = chunk_size
+
+    def iter_rows(self):
+        """
+        :return: a generator of the rows of the export, as dictionaries
+        """
+        if self.path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(self.path).iter_batches(batch_size=self.chunk_size):
+                yield from batch.to_pylist()
+        else:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        yield loads(line)
+
+    def read(self, indicators):
+        """
+        :param indicators: the indicators we extract
+        :return: the data of every indicator. Every result document is parsed once and all the indicators are extracted from it
+        """
+        logger.info(f'Reading data from {self.path}, indicators: {indicators}')
+        data = {indicator: [] for indicator in indicators}
+        rows = 0
+        for row in self.iter_rows():
+            if 'result' not in row:  # the row is the result document itself
+                extract_indicators(row, indicators, data)
+                continue
+            if row.get('module', MODULE) != MODULE:
+                continue
+            if self.tag is not None and row.get('tags') is not None and self.tag not in row['tags']:
+                continue
+            result = row['result']
+            if isinstance(result, (str, bytes)):
+                result = loads(result) if result else {}
+            extract_indicators(result, indicators, data)
+            rows += 1
+        logger.info(f'Read {rows} module results from {self.path}')
+        return data
@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import numpy as np
+from fitting import fit_candidate, FIT_WORKERS
+from fit_cache import fingerprint
+import logging
+logger = logging.getLogger()
+
+BOOTSTRAP_SAMPLES = 1000  # number of resamples (B)
+CONFIDENCE = 0.95
+BATCH_SIZE = 50  # number of resamples fitted by one task of the process pool
+
+
+def resample(y, samples, rng):
+    """
+    :param y: a numpy array of the sample, of size n
+    :param samples: the number of resamples B
+    :param rng: a numpy Generator
+    :return: a (B, n) matrix, every row is a resample of y drawn with replacement. The indices are drawn at once as one (B, n) matrix.
+    """
+    return y[rng.integers(0, len(y), size=(samples, len(y)))]
+
+
+def closed_form_params(dist_name, resamples, params):
+    """
+    :param dist_name: name of the fitted distribution
+    :param resamples: a (B, n) matrix of resamples
+    :param params: the parameters fitted on the whole sample
+    :return: a (B, number of parameters) matrix of the maximum likelihood parameters of every resample, computed on the whole matrix at once, and
+    the list of the positions of the parameters held fixed instead of estimated. None, None if dist_name has no closed form. lognorm is
+    conditional on the loc fitted on the whole sample, so loc is fixed.
+    """
+    if dist_name == 'norm':
+        return np.column_stack([resamples.mean(axis=1), resamples.std(axis=1)]), []
+    if dist_name == 'expon':
+        loc = resamples.min(axis=1)
+        return np.column_stack([loc, resamples.mean(axis=1) - loc]), []
+    if dist_name == 'lognorm':
+        loc = params[-2]
+        if resamples.min() <= loc:
+            return None, None
+        logs = np.log(resamples - loc)
+        return np.column_stack([logs.std(axis=1), np.full(len(resamples), loc), np.exp(logs.mean(axis=1))]), [len(params) - 2]
+    return None, None
+
+
+def fit_batch(dist_name, resamples, params):
+    """
+    :param dist_name: name of the fitted distribution
+    :param resamples: a (batch, n) matrix of resamples
+    :param params: the parameters fitted on the whole sample, the starting point of every fit
+    :return: a (batch, number of parameters) matrix of the parameters of every resample, nan for the resamples that could not be fitted
+    """
+    result = np.full((len(resamples), len(params)), np.nan)
+    for i, sample in enumerate(resamples):
+        try:
+            result[i] = fit_candidate(dist_name, sample, params)
+        except Exception as e:
+            logger.warning(f'Failed to fit {dist_name} to a resample: {e}')
+    return result
+
+
+def interval_key(sorted_y, dist_name, params, samples, confidence):
+    """
+    :param sorted_y: a sorted numpy array of the sample
+    :return: the key of the confidence interval in a FitCache: the fingerprint of the sample and the distribution, with the parameters, the
+    number of resamples and the confidence level
+    """
+    return f'{fingerprint(sorted_y, [dist_name])}:{json.dumps([list(params), samples, confidence])}'
+
+
+def bootstrap_ci(y, dist_name, params, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE, workers=FIT_WORKERS, seed=None, cache=None):
+    """
+    :param y: a list (or numpy array) of numbers
+    :param dist_name: name of the distribution fitted to y
+    :param params: the parameters fitted to y
+    :param samples: the number of resamples
+    :param confidence: the confidence level of the intervals
+    :param workers: number of processes fitting the resamples, for the distributions without a closed form
+    :param seed: seed of the resampling, None for a random seed
+    :param cache: a FitCache. If the same parameters were bootstrapped on the same sample before, the cached interval is returned without
+    resampling, so a run whose fit comes from the cache does not refit the resamples either
+    :return: the percentile confidence interval of every parameter. A parameter held fixed over the resamples has no interval, its bounds are
+    None
+
+    example:
+    input: durations, 'expon', (15.0, 92.3)
+    output: {'confidence': 0.95, 'samples': 1000, 'lower': [15.0, 88.9], 'upper': [15.0, 95.8]}
+    """
+    y = np.asarray(y, dtype=float)
+    params = tuple(params)
+    key = None
+    if cache is not None:
+        key = interval_key(np.sort(y), dist_name, params, samples, confidence)
+        interval = cache.get_interval(key)
+        if interval is not None:
+            logger.info(f'Reuse the cached confidence interval of {dist_name}')
+            return interval
+
+    resamples = resample(y, samples, np.random.default_rng(seed))
+
+    estimates, fixed = closed_form_params(dist_name, resamples, params)
+    if estimates is None:
+        fixed = []
+        batches = [resamples[i:i + BATCH_SIZE] for i in range(0, samples, BATCH_SIZE)]
+        logger.info(f'Fitting {dist_name} to {samples} resamples of {len(y)} values')
+        if workers <= 1:
+            estimates = np.vstack([fit_batch(dist_name, batch, params) for batch in batches])
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                estimates = np.vstack(list(executor.map(fit_batch, [dist_name] * len(batches), batches, [params] * len(batches))))
+
+    alpha = 1 - confidence
+    lower, upper = np.nanpercentile(estimates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    lower = [None if i in fixed else value for i, value in enumerate(lower.tolist())]
+    upper = [None if i in fixed else value for i, value in enumerate(upper.tolist())]
+    interval = {'confidence': confidence, 'samples': samples, 'lower': lower, 'upper': upper}
+    if cache is not None:
+        cache.put_interval(key, interval)
+    return interval
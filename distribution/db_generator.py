@@ -1,6 +1,14 @@
 import pandas as pd
 import sqlite3 as db
+import calendar
+import hashlib
+import json
 import os
+from datetime import datetime
+import sys
+import logging
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%Y%m%d %H:%M:%S')
+logger = logging.getLogger()
 
 
 DUR_THRES = 15  # Duration threshold
@@ -8,34 +16,67 @@ SCRAPE_PATH = '../scrape/data/'  # Path of all the scraped data
 
 COLUMN_ORDER = ['issue', 'provider_type', 'provider', 'service', 'location', 'duration', 'affect_rate', 'impact', 'cause', 'intensity', 'time']
 
+CATALOG_COLUMNS = ['issue', 'provider_type', 'provider', 'duration', 'affect_rate', 'impact', 'cause', 'intensity', 'time']
+
 EVENT_CATALOG_TABLE = 'event_catalog'
 
-NEW_EVENT_TABLE = 'new_event'
+SERVICE_TABLE = 'event_service'  # one row per (issue, service)
+
+LOCATION_TABLE = 'event_location'  # one row per (issue, location)
+
+INGESTED_FILE_TABLE = 'ingested_file'  # content hash of every scrape file already ingested
+
+STALE_TABLES = ['temp_event', 'new_event']  # staging tables of schema version 1, dropped by create_schema
+
+SCHEMA_VERSION = 2  # 1: service and location as comma-joined strings and time as text. 2: child tables and integer epoch time
+
+TIME_FORMAT = '%Y-%m-%d %H:%M'  # format of the time the scrapers write, in UTC
+
+FULL_REFRESH = False  # if True, ingest every scrape file even if its content hash did not change
 
 
 def read_scrape_data(path=SCRAPE_PATH):
     """
     :param path: Path of all the json file, notice that under this directory there should be only json files.
-    :return: A dataframe containing all the data
+    :return: A dataframe containing all the data that last at least DUR_THRES minutes
     """
     json_files = [pos_json for pos_json in os.listdir(path)]
 
-    frames = []  # list to put all the data frame together
+    frames = []  # list to put all the data frame together, each of them already filtered
     for json_file in json_files:
-        frames.append(pd.read_json(os.path.join(path, json_file), 'records'))
+        frames.append(read_scrape_file(os.path.join(path, json_file)))
     frames = pd.concat(frames, sort=True)
-    frames = frames[frames['duration'] >= DUR_THRES]
     return frames
 
 
-def list_to_string(scrape_data):
+def read_scrape_file(path):
+    """
+    :param path: Path of one scraped json file
+    :return: A dataframe of the events of the file that last at least DUR_THRES minutes, with the columns in COLUMN_ORDER. The events are filtered
+    before the dataframe is built, so the short ones are never copied into it.
+    """
+    with open(path, 'r') as f:
+        events = [event for event in json.load(f) if (event.get('duration') or 0) >= DUR_THRES]
+    return pd.DataFrame(events, columns=COLUMN_ORDER)
+
+
+def file_hash(path):
+    """
+    :param path: Path of a file
+    :return: The sha1 of the file content
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def list_to_string(scrape_data, list_cols=('provider_type', 'service', 'location')):
     """
     :param scrape_data: Here data means the dataframe that read_scrape_data() returns
+    :param list_cols: the columns to convert
     :return: a new dataframe that all the lists are converted into strings, separating elements with ','. We do this because sqlite3 does not support
     array
     """
     new_data = scrape_data
-    list_cols = ['provider_type', 'service', 'location']
     for col in list_cols:
         new_col = []
         for cell in scrape_data[col]:
@@ -47,60 +88,238 @@ def list_to_string(scrape_data):
     return new_data
 
 
+def string_to_list(cell):
+    """
+    :param cell: a list, a string of elements separated with ',' or a missing value
+    :return: a list of the non-empty elements
+
+    example:
+    input: 'dal05, sjc01, sea01'
+    output: ['dal05', 'sjc01', 'sea01']
+    """
+    if isinstance(cell, list):
+        elements = cell
+    elif isinstance(cell, str):
+        elements = cell.split(',')
+    else:
+        return []
+    return [str(element).strip() for element in elements if element is not None and str(element).strip()]
+
+
+def to_epoch(time_text):
+    """
+    :param time_text: a start time in TIME_FORMAT (UTC), or a missing value
+    :return: the number of seconds since 1970-01-01 UTC, or None
+
+    example:
+    input: '2019-06-02 23:15'
+    output: 1559517300
+    """
+    if not isinstance(time_text, str) or not time_text:
+        return None
+    return calendar.timegm(datetime.strptime(time_text, TIME_FORMAT).timetuple())
+
+
 def sql_command_create_table(table_name):
     """
     :param table_name: A string of the table name that we want to create
-    :return: A string of sql command that we can execute
+    :return: A string of sql command that we can execute. Services and locations are stored in the child tables, time is an integer epoch (UTC).
     """
     sql_command = f"""CREATE TABLE IF NOT EXISTS {table_name}(
                        issue text PRIMARY KEY,
                        provider_type text,
                        provider text,
-                       service text,
-                       location text,
                        duration integer,
                        affect_rate real,
                        impact text,
                        cause text,
                        intensity text,
-                       time text
+                       time integer
                        )"""
     return sql_command
 
 
-def sql_command_insert_to_table(to_table_name, from_table_name):
+def sql_command_create_child_table(table_name, column):
     """
-    :param to_table_name: The name of the table that receive everything. Should contain historical data and should NEVER BE OVERWRITTEN UPON
-    :param from_table_name: The name of the table that we use to save the data of a new scraping round
-    :return: A string of sql command that we will execute
+    :param table_name: A string of the table name that we want to create
+    :param column: The name of the value column, like 'service' or 'location'
+    :return: A string of sql command that creates a table with one row per (issue, value)
     """
-    sql_command = f"""INSERT INTO {to_table_name}
-                    SELECT * 
-                    FROM {from_table_name}
-                    WHERE NOT EXISTS (
-                        SELECT issue FROM {to_table_name}
-                        WHERE {to_table_name}.issue = {from_table_name}.issue
-                    )"""
+    sql_command = f"""CREATE TABLE IF NOT EXISTS {table_name}(
+                       issue text REFERENCES {EVENT_CATALOG_TABLE}(issue),
+                       {column} text,
+                       PRIMARY KEY(issue, {column})
+                       )"""
     return sql_command
 
 
-if __name__ == "__main__":
-    df = read_scrape_data(SCRAPE_PATH)
-    df = list_to_string(df)  # convert all the list data in dataframe to strings
-    conn = db.connect('db/event_catalog.db')
+def sql_commands_create_index():
+    """
+    :return: A list of sql commands that create the query indexes of the event catalog and its child tables
+    """
+    return [f'CREATE INDEX IF NOT EXISTS {EVENT_CATALOG_TABLE}_provider_time ON {EVENT_CATALOG_TABLE}(provider, time)',
+            f'CREATE INDEX IF NOT EXISTS {EVENT_CATALOG_TABLE}_duration ON {EVENT_CATALOG_TABLE}(duration)',
+            f'CREATE INDEX IF NOT EXISTS {EVENT_CATALOG_TABLE}_impact ON {EVENT_CATALOG_TABLE}(impact)',
+            f'CREATE INDEX IF NOT EXISTS {SERVICE_TABLE}_service ON {SERVICE_TABLE}(service)',
+            f'CREATE INDEX IF NOT EXISTS {LOCATION_TABLE}_location ON {LOCATION_TABLE}(location)']
+
+
+def insert_events(conn, frame):
+    """
+    :param conn: The connection to the event catalog db, the caller is in charge of the transaction
+    :param frame: A dataframe with the columns in COLUMN_ORDER. provider_type should be a string, service and location can be lists or strings
+    :return: The number of events inserted. Events whose issue is already in the event catalog are left untouched, including their services and
+    locations.
+    """
+    frame = frame.astype(object).where(frame.notna(), None)  # NaN to NULL
+    frame['issue'] = frame['issue'].map(str)  # the issue column is text, an integer issue would not match the same issue in the table
+    frame = frame.drop_duplicates('issue')
+
+    issues = frame['issue'].tolist()
+    existing = set()
+    for i in range(0, len(issues), 500):  # stay under the sqlite variable limit
+        chunk = issues[i:i + 500]
+        existing.update(issue for (issue,) in conn.execute(f"SELECT issue FROM {EVENT_CATALOG_TABLE} WHERE issue IN ({','.join('?' * len(chunk))})",
+                                                            chunk))
+    frame = frame[~frame['issue'].isin(existing)]
+
+    events = [(row.issue, row.provider_type, row.provider, row.duration, row.affect_rate, row.impact, row.cause, row.intensity, to_epoch(row.time))
+              for row in frame.itertuples(index=False)]
+    services = [(row.issue, service) for row in frame.itertuples(index=False) for service in string_to_list(row.service)]
+    locations = [(row.issue, location) for row in frame.itertuples(index=False) for location in string_to_list(row.location)]
+
+    conn.executemany(sql_command_upsert_to_table(EVENT_CATALOG_TABLE), events)
+    conn.executemany(f'INSERT INTO {SERVICE_TABLE}(issue, service) VALUES (?, ?) ON CONFLICT DO NOTHING', services)
+    conn.executemany(f'INSERT INTO {LOCATION_TABLE}(issue, location) VALUES (?, ?) ON CONFLICT DO NOTHING', locations)
+    return len(events)
+
+
+def scrape_lists(path=SCRAPE_PATH):
+    """
+    :param path: Path of all the json file, notice that under this directory there should be only json files.
+    :return: A dictionary of issue to the (service, location) of the event in the scrape files, as the scrapers wrote them (lists are kept whole,
+    so 'Auckland, New Zealand' stays one location)
+    """
+    lists = {}
+    if not os.path.isdir(path):
+        return lists
+    for json_file in sorted(os.listdir(path)):
+        with open(os.path.join(path, json_file), 'r') as f:
+            for event in json.load(f):
+                lists[str(event['issue'])] = event.get('service'), event.get('location')
+    return lists
+
+
+def migrated_list(stored, scraped):
+    """
+    :param stored: a service or location cell of schema version 1, the elements joined with ', '
+    :param scraped: the same cell in the scrape files, as the scraper wrote it, or None if the event is not in the scrape files
+    :return: the scraped list if it is non-empty and joins to the stored value (so an element containing ',' stays whole), otherwise the stored
+    value, to be split on ','. The event catalog keeps the values it was built with, a scrape file rewritten since then does not change them.
+
+    example:
+    input: 'Auckland, New Zealand', ['Auckland, New Zealand']
+    output: ['Auckland, New Zealand']
+    """
+    if isinstance(scraped, list) and scraped and ', '.join(str(element) for element in scraped) == stored:
+        return scraped
+    return stored
+
+
+def create_schema(conn, path=SCRAPE_PATH):
+    """
+    :param conn: The connection to the event catalog db
+    :param path: Path of the scrape files, they tell how to split the services and locations of the migrated events
+    :return: Turn on WAL journaling (so that scrapes can write while distribution jobs read), create the tables and indexes if not exist, and
+    migrate an event catalog of schema version 1 to SCHEMA_VERSION in one transaction. Version 1 joined the services and locations with ', ', the
+    child rows are the stored values split back, see migrated_list. The migrated events keep their stored values, the scrape files only tell
+    where a ',' is part of an element.
+    """
+    conn.execute('PRAGMA journal_mode=WAL')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({EVENT_CATALOG_TABLE})')]
+
+    with conn:
+        conn.execute('BEGIN')
+        migrate = version < SCHEMA_VERSION and 'service' in columns
+        if migrate:
+            conn.execute(f'ALTER TABLE {EVENT_CATALOG_TABLE} RENAME TO {EVENT_CATALOG_TABLE}_v1')
+
+        conn.execute(sql_command_create_table(EVENT_CATALOG_TABLE))
+        conn.execute(sql_command_create_child_table(SERVICE_TABLE, 'service'))
+        conn.execute(sql_command_create_child_table(LOCATION_TABLE, 'location'))
+        for sql_command in sql_commands_create_index():
+            conn.execute(sql_command)
+
+        if migrate:
+            old_events = pd.read_sql(f'SELECT {", ".join(COLUMN_ORDER)} FROM {EVENT_CATALOG_TABLE}_v1', conn)
+            old_events['issue'] = old_events['issue'].map(str)
+            lists = scrape_lists(path)
+            for col, index in (('service', 0), ('location', 1)):
+                old_events[col] = [migrated_list(cell, lists[issue][index] if issue in lists else None)
+                                   for issue, cell in zip(old_events['issue'], old_events[col])]
+            logger.info(f'Migrated {insert_events(conn, old_events)} events to schema version {SCHEMA_VERSION}')
+            conn.execute(f'DROP TABLE {EVENT_CATALOG_TABLE}_v1')
+        for table in STALE_TABLES:
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+
+def sql_command_create_ingested_file_table(table_name):
+    """
+    :param table_name: A string of the table name that we want to create
+    :return: A string of sql command that creates the table recording the content hash of every ingested scrape file
+    """
+    sql_command = f"""CREATE TABLE IF NOT EXISTS {table_name}(
+                       path text PRIMARY KEY,
+                       sha1 text
+                       )"""
+    return sql_command
+
+
+def sql_command_upsert_to_table(to_table_name):
+    """
+    :param to_table_name: The name of the table that receive the new events. Events whose issue is already in the table are left untouched
+    :return: A string of parameterized sql command that inserts one row of CATALOG_COLUMNS, to be used with executemany
+    """
+    sql_command = f"""INSERT INTO {to_table_name} ({', '.join(CATALOG_COLUMNS)})
+                    VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})
+                    ON CONFLICT(issue) DO NOTHING"""
+    return sql_command
+
+
+def ingest_scrape_data(conn, path=SCRAPE_PATH, full_refresh=FULL_REFRESH):
+    """
+    :param conn: The connection to the event catalog db
+    :param path: Path of all the json file, notice that under this directory there should be only json files.
+    :param full_refresh: If True, ingest every file, otherwise skip the files whose content hash is the same as the last time they were ingested
+    :return: Insert the events of the new or changed files into the event catalog, in one transaction together with their new content hash. The
+    cost of a run depends on the files that changed, not on the size of the history. The event catalog is the source of truth: the scrape files
+    only add the events it does not have yet, and it keeps the events a scrape file no longer lists (the IBM and Azure feeds only list the recent
+    incidents), so a catalog built from the scrape files alone can only hold fewer events.
+    """
     c = conn.cursor()
+    c.execute(sql_command_create_ingested_file_table(INGESTED_FILE_TABLE))
+    ingested = dict(c.execute(f'SELECT path, sha1 FROM {INGESTED_FILE_TABLE}').fetchall())
 
-    # Create two tables if not exist, event_catalog is for later use, temp_event is to store the updated json file
-    c.execute(sql_command_create_table(EVENT_CATALOG_TABLE))
-    c.execute(sql_command_create_table(NEW_EVENT_TABLE))
-    conn.commit()
+    with conn:
+        for json_file in sorted(os.listdir(path)):
+            digest = file_hash(os.path.join(path, json_file))
+            if not full_refresh and ingested.get(json_file) == digest:
+                logger.info(f'Skip unchanged file {json_file}')
+                continue
 
-    # specify column name and order
-    df = df[COLUMN_ORDER]
+            frame = list_to_string(read_scrape_file(os.path.join(path, json_file)), ['provider_type'])
+            logger.info(f'Ingested {json_file}: {insert_events(conn, frame)} new events out of {len(frame)}')
+            c.execute(f'INSERT OR REPLACE INTO {INGESTED_FILE_TABLE}(path, sha1) VALUES (?, ?)', (json_file, digest))
+
+
+if __name__ == "__main__":
+    conn = db.connect('db/event_catalog.db')
 
-    # store updated json file to the temp_event table
-    df.to_sql(NEW_EVENT_TABLE, conn, if_exists='replace', index=False)
+    # Create the tables if not exist (or migrate them), event_catalog stores all the historical data
+    create_schema(conn, SCRAPE_PATH)
 
-    # compare two table, insert non-existed value from temp_event to event_catalog
-    c.execute(sql_command_insert_to_table(EVENT_CATALOG_TABLE, NEW_EVENT_TABLE))
-    conn.commit()
+    # insert the events of the new or changed scrape files, the ones already in event_catalog are skipped
+    ingest_scrape_data(conn, SCRAPE_PATH)
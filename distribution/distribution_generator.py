@@ -1,11 +1,23 @@
 import pandas as pd
 import sqlite3 as db
+import calendar
 import json
 from collections import Counter, defaultdict
 import numpy as np
 import scipy.stats as st
 import matplotlib.pyplot as plt
 import sys
+import os
+import re
+from functools import lru_cache
+from provider_catalog import load_provider_catalog
+from fitting import fit_distributions, FIT_TIMEOUT, FIT_WORKERS
+from fit_cache import FitCache, FIT_CACHE_PATH
+from bootstrap import bootstrap_ci, BOOTSTRAP_SAMPLES, CONFIDENCE
+from empirical import EmpiricalDistribution, EMPIRICAL_PVALUE_THRESHOLD
+from db_generator import string_to_list
+from assessment_source import BigQuerySource, LocalSource
+from concurrent.futures import ProcessPoolExecutor
 import logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%Y%m%d %H:%M:%S')
 logger = logging.getLogger()
@@ -14,8 +26,18 @@ with open('input/provider_name_keyword.json', 'r') as f_keyword:
     CONV = json.load(f_keyword)
 
 DURATION_THRESHOLD = 15  # Duration threshold
-DB_PATH = 'dB/event_catalog.db'  # Path of db file
+DB_PATH = 'db/event_catalog.db'  # Path of db file
+EVENT_COLUMNS = ['issue', 'provider_type', 'provider', 'duration', 'affect_rate', 'impact', 'cause', 'intensity', 'time']
+CONV_CACHE_SIZE = 2 ** 16  # number of (name, indicator) pairs memoized by conv_name
+MATCHERS = {}  # indicator: the compiled keyword matcher of keyword_matcher
+CHILD_TABLES = {'service': 'event_service', 'location': 'event_location'}  # columns stored one row per value in a child table
 TAG = 'services-linton2'
+ASSESSMENT_PATH = 'input/assessment.ndjson'  # local export of ModuleResult, if it exists it is read instead of big query
+
+STRATA_LEVELS = ['provider_type', 'provider']  # from the coarsest to the finest, 'service' can be added as the finest level
+MIN_STRATUM_SIZE = 30  # a stratum with fewer values uses the distribution of its parent stratum
+CONTINUOUS_VARIABLES = ['duration', 'affect_rate']
+CATEGORICAL_VARIABLES = ['impact']
 
 INDICATORS = ["INFRASTRUCTURE_SERVICE_HOSTING",
               "INFRASTRUCTURE_SERVICE_EMAIL",
@@ -30,6 +52,7 @@ class Distribution:
                            "advance": ["norm", "lognorm", "expon", "pareto", "exponweib", "weibull_max", "weibull_min", "genextreme"]}
         self.dist_results = []
         self.params = {}
+        self.ranking = []
 
         self.distribution_name = ""
         self.pvalue = 0
@@ -37,26 +60,33 @@ class Distribution:
 
         self.is_fitted = False
 
-    def fit(self, y, dist_type):
+    def fit(self, y, dist_type, timeout=FIT_TIMEOUT, workers=FIT_WORKERS, cache=None, variable=None, empirical_threshold=None):
         """
         This function receive a list of number (y) and a switch (dist_type) between 'simple' and 'advance', which is used to select which set of
-        distributions this function will try to fit (y) to. Finally, it returns the best fit (distribution_name) and the distribution parameters
+        distributions this function will try to fit (y) to. The distributions are fitted in parallel by fitting.fit_distributions, the ranking
+        table (AIC, BIC and KS p-value of every distribution) is kept in self.ranking. If a FitCache (cache) is given, a sample that was already
+        fitted is not fitted again, and with the name of the variable (variable) the new fits start from the last fit of the variable. If the KS
+        p-value of the best fit is below empirical_threshold, none of the distributions fits well and the best fit is 'empirical', whose parameters
+        are the quantile table of y (see empirical.EmpiricalDistribution). Finally, it returns the best fit (distribution_name) and the distribution
+        parameters
         """
-        self.dist_results = []
-        self.params = {}
-        for dist_name in self.dist_names[dist_type]:
-            dist = getattr(st, dist_name)
-            param = dist.fit(y)
-            self.params[dist_name] = param
-            # Applying the Kolmogorov-Smirnov test
-            _, p = st.kstest(y, dist_name, args=param)
-            self.dist_results.append((dist_name, p))
-
-        # select the best fitted distribution
-        sel_dist, p = (max(self.dist_results, key=lambda item: item[1]))
-        # store the name of the best fit and its p value
-        self.distribution_name = sel_dist
-        self.pvalue = p
+        self.ranking = fit_distributions(y, self.dist_names[dist_type], timeout=timeout, workers=workers, cache=cache,
+                                         variable=variable)
+        fitted = [row for row in self.ranking if row['status'] == 'ok']
+        if not fitted:
+            raise RuntimeError(f'None of the {dist_type} distributions could be fitted')
+
+        self.params = {row['distribution']: tuple(row['parameters']) for row in fitted}
+        self.dist_results = [(row['distribution'], row['pvalue']) for row in fitted]
+
+        # the ranking is sorted, the best fitted distribution is the first one. store the name of the best fit and its p value
+        self.distribution_name = fitted[0]['distribution']
+        self.pvalue = fitted[0]['pvalue']
+
+        if empirical_threshold is not None and self.pvalue < empirical_threshold:
+            logger.info(f'The best fit {self.distribution_name} has a p value of {self.pvalue}, use the empirical distribution instead')
+            self.distribution_name = 'empirical'
+            self.params['empirical'] = EmpiricalDistribution.fit(y).to_dict()
 
         self.is_fitted = True
         return self.distribution_name, self.params[self.distribution_name]
@@ -66,39 +96,126 @@ class Distribution:
         This function only works after the object calls the distribution.fit function. It will plot the pdf of the best fitted distribution.
         """
         param = self.params[self.distribution_name]
+        if self.distribution_name == 'empirical':  # plot the cdf of the quantile table
+            plt.plot(param['quantiles'], param['probabilities'], 'r-', lw=5, alpha=0.6)
+            plt.show()
+            return
         dist = getattr(st, self.distribution_name)
         x = np.linspace(dist.ppf(0.01, *param[:-2], loc=param[-2], scale=param[-1]), dist.ppf(0.99, *param[:-2], loc=param[-2], scale=param[-1]), 100)
         plt.plot(x, dist.pdf(x, *param[:-2], loc=param[-2], scale=param[-1]), 'r-', lw=5, alpha=0.6)
         plt.show()
 
 
-def read_data(path=DB_PATH):
+def build_event_query(columns=None, min_duration=DURATION_THRESHOLD, providers=None, start_time=None, end_time=None, impacts=None):
+    """
+    :param columns: a list of the columns we need, default to all the columns of event_catalog. 'service' and 'location' are read from their child
+    tables and joined with ', '
+    :param min_duration: keep the events that last at least min_duration minutes, None for no limit
+    :param providers: a list of providers to keep, None for all
+    :param start_time: keep the events that start at or after start_time (datetime in UTC or epoch seconds), None for no limit
+    :param end_time: keep the events that start before end_time (datetime in UTC or epoch seconds), None for no limit
+    :param impacts: a list of impacts to keep (like ['outage']), None for all
+    :return: a parameterized sql query and its parameters. The predicates are on indexed columns, so only the matching rows and the requested
+    columns are read from the db.
+
+    example:
+    input: columns=['duration'], providers=['GCP']
+    output: 'SELECT duration FROM event_catalog WHERE duration >= ? AND provider IN (?)', [15, 'GCP']
+    """
+    columns = columns or EVENT_COLUMNS
+    selects = []
+    for column in columns:
+        if column in CHILD_TABLES:
+            selects.append(f"(SELECT group_concat({column}, ', ') FROM {CHILD_TABLES[column]} "
+                           f"WHERE {CHILD_TABLES[column]}.issue = event_catalog.issue) AS {column}")
+        elif column in EVENT_COLUMNS:
+            selects.append(column)
+        else:
+            raise ValueError(f'Unknown column {column}')
+
+    predicates = []
+    params = []
+    if min_duration is not None:
+        predicates.append('duration >= ?')
+        params.append(min_duration)
+    if providers is not None:
+        predicates.append(f'provider IN ({", ".join("?" * len(providers))})')
+        params.extend(providers)
+    if start_time is not None:
+        predicates.append('time >= ?')
+        params.append(start_time if isinstance(start_time, (int, float)) else calendar.timegm(start_time.timetuple()))
+    if end_time is not None:
+        predicates.append('time < ?')
+        params.append(end_time if isinstance(end_time, (int, float)) else calendar.timegm(end_time.timetuple()))
+    if impacts is not None:
+        predicates.append(f'impact IN ({", ".join("?" * len(impacts))})')
+        params.extend(impacts)
+
+    query = f'SELECT {", ".join(selects)} FROM event_catalog'
+    if predicates:
+        query += f' WHERE {" AND ".join(predicates)}'
+    return query, params
+
+
+def read_data(path=DB_PATH, columns=None, min_duration=DURATION_THRESHOLD, providers=None, start_time=None, end_time=None, impacts=None):
     """
-    This function takes a path of the .db file (DB_PATH) and read in the db file, filter out all items with duration less than a threshold and return
-    a dataframe
+    This function takes a path of the .db file (DB_PATH) and read in the db file the items that match the filters (by default, the items with
+    duration of at least a threshold) and return a dataframe of the requested columns. The filters are done by sqlite, see build_event_query.
     """
+    query, params = build_event_query(columns=columns, min_duration=min_duration, providers=providers, start_time=start_time, end_time=end_time,
+                                      impacts=impacts)
     conn = db.connect(path)
-    data = pd.read_sql("select * from event_catalog", conn)
-    data = data[data['duration'] >= DURATION_THRESHOLD]  # filter out all rows with duration less than 15 minutes
+    data = pd.read_sql(query, conn, params=params)
+    conn.close()
     return data
 
 
+def keyword_matcher(indic):
+    """
+    :param indic: a string of indicator which represents the provider type.
+    :return: a compiled regex that finds, at every position of a name, the first keyword of CONV[indic] starting there, and a dictionary of
+    keyword to (priority, known provider name). The priority is the order in which conv_name used to try the keywords, so the lowest priority
+    among all the matches is the keyword the loop would have returned.
+    """
+    if indic not in MATCHERS:
+        keywords = {}
+        for service, names in CONV[indic].items():
+            for name in names:
+                keywords.setdefault(name, (len(keywords), service))
+        # a lookahead finds the overlapping matches too, the alternatives are tried in the order of their priority
+        pattern = re.compile(f'(?=({"|".join(re.escape(keyword) for keyword in keywords)}))') if keywords else None
+        MATCHERS[indic] = pattern, keywords
+    return MATCHERS[indic]
+
+
+@lru_cache(maxsize=CONV_CACHE_SIZE)
 def conv_name(target_name, indic):
     """
     :param target_name: a string of a service provider name
     :param indic: a string of indicator which represents the provider type.
     :return: if the provider name contains some keyword of a known provider in the indicated provider type, the function return the known provider's
-    name. If provider name contains no keyword, return itself.
+    name. If provider name contains no keyword, return itself. The results are memoized, the same names come back in every assessment.
 
     example
     input: "Amazon Cloud Platform", "INFRASTRUCTURE_SERVICE_HOSTING"
     output: "AWS"
     """
-    for service, names in CONV[indic].items():
-        for name in names:
-            if name in target_name.lower():
-                return service
-    return target_name
+    pattern, keywords = keyword_matcher(indic)
+    if pattern is None:
+        return target_name
+    matches = [keywords[match.group(1)] for match in pattern.finditer(target_name.lower())]
+    return min(matches)[1] if matches else target_name
+
+
+def conv_names(target_names, indic):
+    """
+    :param target_names: a list (or pandas Series) of service provider names
+    :param indic: a string of indicator which represents the provider type.
+    :return: a list of the known provider names, see conv_name. Every distinct name is converted once.
+    """
+    target_names = pd.Series(target_names, dtype=object)
+    converted = {name: conv_name(name, indic) for name in target_names.unique()}
+    return target_names.map(converted).tolist()
 
 
 def read_gbq_data(tag):
@@ -106,35 +223,20 @@ def read_gbq_data(tag):
     :param tag: a string of tag name that we want to get data with.
     :return: After doing gbq, the function parse the data into dictionary and returns it
     """
-    data = {ind: [] for ind in INDICATORS}
-    projectid = 'sme-modeling'
-
-    for indicator in INDICATORS:
-        logger.info(f'Reading data from big query, indicator: {indicator}')
-        query = f"""
-        select json_extract(result, '$.risks_data.{indicator}.data') as res
-        from `sme_modeling.ModuleResult`
-        where '{tag}' in unnest(tags)
-        and module = 'droid'
-        and result like '%{indicator}%'
-        """
-
-        data_frame = pd.read_gbq(query, projectid, dialect='standard')
+    return BigQuerySource(tag).read(INDICATORS)
 
-        for row in data_frame['res'].tolist():
-            if row and row != '{}':
-                data[indicator].append(json.loads(row))
-
-    logger.info('Big query done')
-    return data
 
-
-def generate_continuous_dist(data, variable_of_interest, dist_type='simple', plot_flag='False'):
+def generate_continuous_dist(data, variable_of_interest, dist_type='simple', plot_flag='False', cache=None, bootstrap=0, empirical_threshold=None):
     """
     :param data: a data frame which contains our variable of interest
     :param variable_of_interest: a string of variable name that we care about and want to get distribution of
     :param dist_type: a string that switch between 'simple' and 'advance', deciding which set of distributions the fit function will try.
     :param plot_flag: a boolean to decide whether to plot the pdf or not
+    :param cache: a FitCache, the fit is reused when the data did not change (or barely drifted) since the last run
+    :param bootstrap: the number of bootstrap resamples, 0 for no confidence interval. With resamples, the percentile confidence interval of the
+    parameters is written next to them, it is kept in the cache with the fit
+    :param empirical_threshold: if the KS p-value of the best fit is below it, write the quantile table of the data instead, None (the default) to
+    always write the best fit, as before
     :return: If the variable_of_interest name cannot be found in the dataframe, return nothing and end the function. Otherwise the function with
     generates a json file showing the best fitted distribution name and parameters.
     """
@@ -145,10 +247,13 @@ def generate_continuous_dist(data, variable_of_interest, dist_type='simple', plo
     dst = Distribution()
 
     sequence = data[variable_of_interest].dropna().tolist()
-    name, parameters = dst.fit(sequence, dist_type=dist_type)
+    name, parameters = dst.fit(sequence, dist_type=dist_type, cache=cache, variable=variable_of_interest, empirical_threshold=empirical_threshold)
     if plot_flag:
         dst.plot_distribution()
-    result = {"distribution": name, "parameters": parameters}
+    result = {"distribution": name, "parameters": parameters,
+              "ranking": [{key: row.get(key) for key in ['distribution', 'aic', 'bic', 'pvalue', 'status']} for row in dst.ranking]}
+    if bootstrap and name != 'empirical':
+        result["confidence_interval"] = bootstrap_ci(sequence, name, parameters, samples=bootstrap, confidence=CONFIDENCE, cache=cache)
 
     with open(f'output/{variable_of_interest}_distribution.json', 'w') as f:
         json.dump(result, f)
@@ -167,6 +272,100 @@ def generate_categorical_dist(data, variable_of_interest):
         json.dump(result, f)
 
 
+def fit_stratum(path, variable_of_interest, sequence, dist_type, cache_path, empirical_threshold=None):
+    """
+    :param path: the values of the levels of the stratum, like ('PaaS', 'GCP'). The root stratum (all the events) is ()
+    :param variable_of_interest: a string of variable name
+    :param sequence: a list of the values of the variable in the stratum
+    :param dist_type: a string that switch between 'simple' and 'advance'
+    :param cache_path: path of the FitCache, None for no cache
+    :param empirical_threshold: see Distribution.fit
+    :return: the path, the variable and the best fitted distribution of the stratum. It runs in a worker process of generate_stratified_dist, so the
+    candidates are fitted one by one.
+    """
+    dst = Distribution()
+    cache = FitCache(cache_path) if cache_path else None
+    name, parameters = dst.fit(sequence, dist_type=dist_type, workers=1, cache=cache, variable=f'{variable_of_interest}:{"/".join(path)}',
+                               empirical_threshold=empirical_threshold)
+    parameters = parameters if name == 'empirical' else list(parameters)
+    return path, variable_of_interest, {"distribution": name, "parameters": parameters, "pvalue": dst.pvalue, "sample_size": len(sequence)}
+
+
+def generate_stratified_dist(data, levels=STRATA_LEVELS, min_samples=MIN_STRATUM_SIZE, dist_type='simple', cache_path=FIT_CACHE_PATH,
+                             workers=FIT_WORKERS, empirical_threshold=None):
+    """
+    :param data: a data frame which contains the levels, CONTINUOUS_VARIABLES and CATEGORICAL_VARIABLES
+    :param levels: the columns we stratify by, from the coarsest to the finest. A cell with several values (like 'SaaS, Email') belongs to the
+    stratum of each value
+    :param min_samples: the minimum number of values to fit a stratum, a smaller stratum copies the distribution of its parent stratum
+    :param dist_type: a string that switch between 'simple' and 'advance'
+    :param cache_path: path of the FitCache, None for no cache
+    :param workers: number of processes, the strata are fitted in parallel
+    :param empirical_threshold: see Distribution.fit
+    :return: The data is grouped once per level and all the strata are fitted at the same time. The function saves one json file with a tree of
+    strata, every stratum has the distribution of every variable and its child strata.
+
+    example:
+    output: {"levels": ["provider_type", "provider"], "min_samples": 30,
+             "distribution": {"sample_size": 2969, "duration": {"distribution": "lognorm", ...}, "impact": {"outage": 0.1, ...},
+                              "strata": {"PaaS": {"sample_size": 123, ..., "strata": {"GCP": {...}, "Azure": {...}}}, ...}}}
+    """
+    exploded = data.copy()
+    for level in levels:
+        exploded[level] = exploded[level].map(string_to_list)
+        exploded = exploded.explode(level).dropna(subset=[level])
+
+    # collect the values of every stratum, one group-by per level
+    strata = {}
+    for depth in range(len(levels) + 1):
+        groups = [((), data)] if depth == 0 else exploded.groupby(levels[:depth], sort=True)
+        for key, group in groups:
+            path = key if isinstance(key, tuple) else (key,)
+            strata[path] = {"sample_size": len(group),
+                            "continuous": {variable: group[variable].dropna().tolist() for variable in CONTINUOUS_VARIABLES},
+                            "categorical": {variable: group[variable].dropna().value_counts(normalize=True).to_dict()
+                                            for variable in CATEGORICAL_VARIABLES},
+                            "categorical_size": {variable: int(group[variable].notna().sum()) for variable in CATEGORICAL_VARIABLES}}
+
+    # the root is always fitted, the other strata only when they are large enough
+    tasks = [(path, variable, sequence, dist_type, cache_path, empirical_threshold) for path, stratum in strata.items()
+             for variable, sequence in stratum["continuous"].items() if sequence and (not path or len(sequence) >= min_samples)]
+    logger.info(f'Fitting {len(tasks)} variables of {len(strata)} strata')
+    if workers <= 1:
+        fits = [fit_stratum(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fits = list(executor.map(fit_stratum, *zip(*tasks)))
+    fitted = {(path, variable): result for path, variable, result in fits}
+
+    # build the tree from the root, a stratum that is too small for a variable falls back to its parent
+    nodes = {}
+    for path in sorted(strata, key=len):
+        stratum = strata[path]
+        parent = nodes.get(path[:-1]) if path else None
+        node = {"sample_size": stratum["sample_size"]}
+        for variable in CONTINUOUS_VARIABLES:
+            if (path, variable) in fitted:
+                node[variable] = fitted[(path, variable)]
+            elif parent is not None and parent.get(variable) is not None:
+                node[variable] = dict(parent[variable], fallback=True)  # sample_size stays the one of the parent, the sample it was fitted on
+            else:
+                node[variable] = None
+        for variable in CATEGORICAL_VARIABLES:
+            if not path or stratum["categorical_size"][variable] >= min_samples:
+                node[variable] = stratum["categorical"][variable]
+            else:
+                node[variable] = parent[variable]
+        node["strata"] = {}
+        if parent is not None:
+            parent["strata"][path[-1]] = node
+        nodes[path] = node
+
+    result = {"levels": levels, "min_samples": min_samples, "distribution": nodes[()]}
+    with open('output/stratified_distribution.json', 'w') as f:
+        json.dump(result, f)
+
+
 def provider_counter(ass_data):
     """
     :param ass_data: a dictionary of the assessment data that we get from GBQ
@@ -181,30 +380,28 @@ def provider_counter(ass_data):
             if 'detected_services' not in row:
                 logger.warning(f'Data format error in {row}')
                 continue
-            for detected_service in row['detected_services']:
-                service_list.append(conv_name(detected_service, indicator))
+            service_list.extend(row['detected_services'])
 
-        counters[indicator] = Counter(service_list)
+        counters[indicator] = Counter(conv_names(service_list, indicator))  # the whole column is converted at once
 
     return counters
 
 
-def generate_type_dist(provider_catalog, tag):
+def generate_type_dist(provider_catalog, tag, source=None):
     """
-    :param provider_catalog: The provider catalog that contains providers that we care about
+    :param provider_catalog: The ProviderCatalog that contains providers that we care about
     :param tag: tag is a string that specify the assessment data that we will retrieve
-    :return: We read in assessment data from GBQ, from this data, we calculate the distribution between different provider types. Then we filter out
-    providers that we don't care about, calculte the distribution inside each provider type, save it to a json file.
+    :param source: the AssessmentSource we read the assessment data from, default to GBQ
+    :return: We read in assessment data from the source, from this data, we calculate the distribution between different provider types. Then we
+    filter out providers that we don't care about, calculte the distribution inside each provider type, save it to a json file.
     """
 
-    ass_data = read_gbq_data(tag=tag)  # pull assessment data and store it in the dictionary called 'ass_data'
+    source = source or BigQuerySource(tag)
+    ass_data = source.read(INDICATORS)  # pull assessment data and store it in the dictionary called 'ass_data'
 
     ass_counters = provider_counter(ass_data=ass_data)
 
-    providers = defaultdict(list)
-
-    for _, row in provider_catalog.iterrows():
-        providers[row['type']].append(row['provider'])  # For each type, create a list of providers that we care about (on the provider google sheet)
+    providers = provider_catalog.providers_by_type()  # For each type, a list of providers that we care about (on the provider google sheet)
 
     filtered_ass_counters = {indicator: {} for indicator in INDICATORS}
     # only keep providers that we care about
@@ -234,13 +431,13 @@ def generate_type_dist(provider_catalog, tag):
 def generate_location_dist(provider_catalog, company_location_distribution):
     """
 
-    :param provider_catalog: Providers that we care about
+    :param provider_catalog: The ProviderCatalog of providers that we care about
     :param company_location_distribution: Location distribution for each company. This file is generated by cidr_to_geocode in util
     :return: After doing a coupling between provider and company, save the location distribution to json file.
     """
     result = defaultdict(dict)
 
-    for _, row in provider_catalog.iterrows():
+    for row in provider_catalog.rows:
         # For each provider, we use their company_location_distribution as this provider's location_distribution
         row_provider = row['provider']
         row_company = row['company']
@@ -255,13 +452,21 @@ def generate_location_dist(provider_catalog, company_location_distribution):
 
 
 if __name__ == '__main__':
-    df = read_data(DB_PATH)  # read in scraping data
-    generate_continuous_dist(data=df, variable_of_interest='duration', dist_type='simple', plot_flag=False)
-    generate_continuous_dist(data=df, variable_of_interest='affect_rate', dist_type='simple', plot_flag=False)
+    df = read_data(DB_PATH, columns=['duration', 'affect_rate', 'impact'])  # read in scraping data, only the columns we fit
+    fit_cache = FitCache(FIT_CACHE_PATH)  # fit results of the previous runs
+    generate_continuous_dist(data=df, variable_of_interest='duration', dist_type='simple', plot_flag=False, cache=fit_cache,
+                             bootstrap=BOOTSTRAP_SAMPLES, empirical_threshold=EMPIRICAL_PVALUE_THRESHOLD)
+    generate_continuous_dist(data=df, variable_of_interest='affect_rate', dist_type='simple', plot_flag=False, cache=fit_cache,
+                             bootstrap=BOOTSTRAP_SAMPLES, empirical_threshold=EMPIRICAL_PVALUE_THRESHOLD)
     generate_categorical_dist(data=df, variable_of_interest='impact')
 
-    provider_catalog_data = pd.read_csv('input/provider_catalog.csv')  # read in provider catalog data
-    generate_type_dist(provider_catalog=provider_catalog_data, tag=TAG)
+    df_strata = read_data(DB_PATH, columns=STRATA_LEVELS + CONTINUOUS_VARIABLES + CATEGORICAL_VARIABLES)
+    generate_stratified_dist(data=df_strata, levels=STRATA_LEVELS, min_samples=MIN_STRATUM_SIZE, dist_type='simple', cache_path=FIT_CACHE_PATH,
+                             empirical_threshold=EMPIRICAL_PVALUE_THRESHOLD)
+
+    provider_catalog_data = load_provider_catalog('input/provider_catalog.csv')  # read in provider catalog data, parsed once for the whole run
+    assessment_source = LocalSource(ASSESSMENT_PATH, tag=TAG) if os.path.exists(ASSESSMENT_PATH) else BigQuerySource(TAG)
+    generate_type_dist(provider_catalog=provider_catalog_data, tag=TAG, source=assessment_source)
 
     with open('input/company_location_distribution.json', 'r') as f_comp_loc_dist:
         company_location_distribution_data = json.load(f_comp_loc_dist)
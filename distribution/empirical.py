@@ -0,0 +1,73 @@
+import numpy as np
+
+EMPIRICAL_PVALUE_THRESHOLD = 0.01  # below this KS p-value of the best fit, we use the empirical distribution instead
+QUANTILE_POINTS = 101  # number of evenly spaced probabilities of the quantile table
+TAIL_POINTS = 8  # number of extra probabilities between 0.99 and 0.9999, so that the heavy tail is not flattened
+
+
+def quantile_grid(points=QUANTILE_POINTS, tail_points=TAIL_POINTS):
+    """
+    :return: the sorted probabilities of the quantile table, evenly spaced from 0 to 1 and denser in the upper tail
+
+    example:
+    input: 5, 2
+    output: [0.0, 0.25, 0.5, 0.75, 0.99, 0.9999, 1.0]
+    """
+    return np.unique(np.concatenate([np.linspace(0, 1, points), 1 - np.geomspace(1e-2, 1e-4, tail_points)]))
+
+
+class EmpiricalDistribution:
+    def __init__(self, probabilities, quantiles):
+        """
+        :param probabilities: a sorted list of probabilities from 0 to 1
+        :param quantiles: the quantile of the sample at every probability. Between two points the inverse cdf is linear, so sampling is one
+        np.interp call
+        """
+        self.probabilities = np.asarray(probabilities, dtype=float)
+        self.quantiles = np.asarray(quantiles, dtype=float)
+
+    @classmethod
+    def fit(cls, y, probabilities=None):
+        """
+        :param y: a list (or numpy array) of numbers
+        :param probabilities: the probabilities of the quantile table, default to quantile_grid()
+        :return: an EmpiricalDistribution of y
+        """
+        probabilities = quantile_grid() if probabilities is None else probabilities
+        return cls(probabilities, np.quantile(np.asarray(y, dtype=float), probabilities))
+
+    @classmethod
+    def from_dict(cls, table):
+        """
+        :param table: a dictionary written by to_dict
+        """
+        return cls(table['probabilities'], table['quantiles'])
+
+    def to_dict(self):
+        """
+        :return: the quantile table as a json serializable dictionary, the "parameters" of an "empirical" distribution in *_distribution.json
+        """
+        return {'probabilities': self.probabilities.tolist(), 'quantiles': self.quantiles.tolist()}
+
+    def ppf(self, u):
+        """
+        :param u: a probability or a numpy array of probabilities
+        :return: the inverse cdf at u
+        """
+        return np.interp(u, self.probabilities, self.quantiles)
+
+    def cdf(self, x):
+        """
+        :param x: a value or a numpy array of values
+        :return: the cdf at x
+        """
+        return np.interp(x, self.quantiles, self.probabilities)
+
+    def rvs(self, size, rng=None):
+        """
+        :param size: the number (or the shape) of values to draw
+        :param rng: a numpy Generator, None for a new one
+        :return: a numpy array of values drawn from the distribution
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        return self.ppf(rng.random(size))
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+import scipy
+import logging
+logger = logging.getLogger()
+
+FIT_CACHE_PATH = 'cache/fit_cache.db'
+MAX_ENTRIES = 256  # number of fit results we keep, the least recently used ones are evicted first
+
+
+def fingerprint(sorted_y, dist_names):
+    """
+    :param sorted_y: a sorted numpy array of the sample
+    :param dist_names: the names of the candidate distributions
+    :return: the sha256 of the sample, the candidate distributions and the scipy version. Another scipy version can give other parameters, so
+    its fits are not reused.
+    """
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(sorted_y, dtype=np.float64).tobytes())
+    digest.update(json.dumps(list(dist_names)).encode())
+    digest.update(scipy.__version__.encode())
+    return digest.hexdigest()
+
+
+class FitCache:
+    def __init__(self, path=FIT_CACHE_PATH, max_entries=MAX_ENTRIES):
+        """
+        :param path: path of the sqlite file that stores the fit results, it is created if not exist
+        :param max_entries: maximum number of fit results we keep
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS fit_result(
+                             key text PRIMARY KEY,
+                             ranking text,
+                             used_at real
+                             )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS fit_state(
+                             variable text,
+                             distribution text,
+                             parameters text,
+                             ks_statistic real,
+                             sample_size integer,
+                             updated_at real,
+                             PRIMARY KEY(variable, distribution)
+                             )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS bootstrap_result(
+                             key text PRIMARY KEY,
+                             interval text,
+                             used_at real
+                             )""")
+        self.conn.commit()
+
+    def get(self, key):
+        """
+        :param key: a fingerprint of the sample and the candidate distributions
+        :return: the cached ranking table (see fitting.fit_distributions), or None
+        """
+        row = self.conn.execute('SELECT ranking FROM fit_result WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE fit_result SET used_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, ranking):
+        """
+        :param key: a fingerprint of the sample and the candidate distributions
+        :param ranking: the ranking table to store. The least recently used results are evicted to keep at most max_entries
+        """
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO fit_result(key, ranking, used_at) VALUES (?, ?, ?)', (key, json.dumps(ranking), time.time()))
+            self.conn.execute('DELETE FROM fit_result WHERE key NOT IN (SELECT key FROM fit_result ORDER BY used_at DESC LIMIT ?)',
+                              (self.max_entries,))
+
+    def get_state(self, variable):
+        """
+        :param variable: the name of the variable, like 'duration'
+        :return: a dictionary of distribution name to the last fit of variable: {'parameters': [...], 'ks_statistic': ..., 'sample_size': ...}
+        """
+        rows = self.conn.execute('SELECT distribution, parameters, ks_statistic, sample_size FROM fit_state WHERE variable = ?', (variable,))
+        return {distribution: {'parameters': json.loads(parameters), 'ks_statistic': ks_statistic, 'sample_size': sample_size}
+                for distribution, parameters, ks_statistic, sample_size in rows}
+
+    def put_state(self, variable, ranking, sample_size):
+        """
+        :param variable: the name of the variable, like 'duration'
+        :param ranking: the ranking table of the last fit of variable, the distributions that failed are not stored
+        :param sample_size: the number of values that were fitted
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO fit_state(variable, distribution, parameters, ks_statistic, sample_size, updated_at) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(variable, row['distribution'], json.dumps(row['parameters']), row['ks_statistic'], sample_size, now)
+                                   for row in ranking if row['status'] == 'ok'])
+
+    def get_interval(self, key):
+        """
+        :param key: a fingerprint of the sample, the fitted distribution and its parameters, see bootstrap.interval_key
+        :return: the cached confidence interval (see bootstrap.bootstrap_ci), or None
+        """
+        row = self.conn.execute('SELECT interval FROM bootstrap_result WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE bootstrap_result SET used_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put_interval(self, key, interval):
+        """
+        :param key: a fingerprint of the sample, the fitted distribution and its parameters, see bootstrap.interval_key
+        :param interval: the confidence interval to store. The least recently used intervals are evicted to keep at most max_entries
+        """
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO bootstrap_result(key, interval, used_at) VALUES (?, ?, ?)',
+                              (key, json.dumps(interval), time.time()))
+            self.conn.execute('DELETE FROM bootstrap_result WHERE key NOT IN (SELECT key FROM bootstrap_result ORDER BY used_at DESC LIMIT ?)',
+                              (self.max_entries,))
@@ -0,0 +1,167 @@
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+import scipy.stats as st
+from fit_cache import fingerprint
+import logging
+logger = logging.getLogger()
+
+FIT_TIMEOUT = 120  # seconds we wait for one distribution to be fitted, the slow ones are exponweib and genextreme
+FIT_WORKERS = os.cpu_count() or 1  # number of processes fitting the candidate distributions, 1 to fit them one by one in this process
+DRIFT_THRESHOLD = 0.01  # if the KS statistic of the previous best fit moved less than this on the new sample, we do not refit
+
+
+def fit_candidate(dist_name, y, start=None):
+    """
+    :param dist_name: name of a scipy.stats continuous distribution, like 'lognorm'
+    :param y: a numpy array of the sample
+    :param start: the parameters of a previous fit, used as the starting point of the optimizer (warm start). None to start from scratch
+    :return: the maximum likelihood parameters of the distribution, shape parameters first, then loc and scale
+    """
+    dist = getattr(st, dist_name)
+    if start is None:
+        return tuple(float(param) for param in dist.fit(y))
+    # the shape guesses are positional, loc and scale guesses are keywords
+    return tuple(float(param) for param in dist.fit(y, *start[:-2], loc=start[-2], scale=start[-1]))
+
+
+def ks_test(sorted_y, dist_name, params):
+    """
+    :param sorted_y: a sorted numpy array of the sample. It is sorted once and shared by all the candidates
+    :param dist_name: name of a scipy.stats continuous distribution
+    :param params: the parameters of the distribution
+    :return: the two-sided Kolmogorov-Smirnov statistic and its p-value, the same as st.kstest(sorted_y, dist_name, args=params)
+    """
+    n = len(sorted_y)
+    cdf = getattr(st, dist_name).cdf(sorted_y, *params)
+    d_plus = (np.arange(1, n + 1) / n - cdf).max()
+    d_minus = (cdf - np.arange(n) / n).max()
+    statistic = float(max(d_plus, d_minus))
+    return statistic, float(st.kstwo.sf(statistic, n))
+
+
+def score_candidate(sorted_y, dist_name, params):
+    """
+    :param sorted_y: a sorted numpy array of the sample
+    :param dist_name: name of a scipy.stats continuous distribution
+    :param params: the fitted parameters of the distribution
+    :return: a row of the ranking table: the log likelihood, AIC, BIC, KS statistic and p-value of the fit
+    """
+    n = len(sorted_y)
+    log_likelihood = float(getattr(st, dist_name).logpdf(sorted_y, *params).sum())
+    statistic, pvalue = ks_test(sorted_y, dist_name, params)
+    return {'distribution': dist_name,
+            'parameters': list(params),
+            'log_likelihood': log_likelihood,
+            'aic': 2 * len(params) - 2 * log_likelihood,
+            'bic': len(params) * math.log(n) - 2 * log_likelihood,
+            'ks_statistic': statistic,
+            'pvalue': pvalue,
+            'status': 'ok'}
+
+
+def rank(rows):
+    """
+    :param rows: rows of the ranking table, see score_candidate
+    :return: the rows sorted from the best fit to the worst: highest KS p-value first, then lowest AIC. The candidates that failed or timed out
+    are at the end.
+    """
+    def key(row):
+        if row['status'] != 'ok':
+            return 1, 0, 0
+        aic = row['aic'] if math.isfinite(row['aic']) else math.inf
+        return 0, -row['pvalue'], aic
+    return sorted(rows, key=key)
+
+
+def drift(sorted_y, state):
+    """
+    :param sorted_y: a sorted numpy array of the new sample
+    :param state: the previous fits of the variable, see FitCache.get_state
+    :return: how much the KS statistic of the previous best fit changed on the new sample. It only costs one cdf evaluation, so it tells cheaply
+    whether the new events changed the shape of the sample.
+    """
+    dist_name, best = min(state.items(), key=lambda item: item[1]['ks_statistic'])
+    statistic, _ = ks_test(sorted_y, dist_name, best['parameters'])
+    return abs(statistic - best['ks_statistic'])
+
+
+def fit_distributions(y, dist_names, timeout=FIT_TIMEOUT, workers=FIT_WORKERS, cache=None, variable=None, drift_threshold=DRIFT_THRESHOLD):
+    """
+    :param y: a list (or numpy array) of numbers
+    :param dist_names: names of the scipy.stats distributions we try to fit y to
+    :param timeout: seconds we wait for each distribution. A fit that does not finish in time is reported with status 'timeout'
+    :param workers: number of processes, the candidates are fitted in parallel. With 1 worker they are fitted in this process without timeout
+    :param cache: a FitCache. If the same sample was fitted to the same distributions before, the cached ranking is returned without fitting
+    :param variable: the name of the variable, like 'duration'. With a cache, the last fit of every distribution is kept for the variable: if the
+    sample drifted less than drift_threshold since then, the previous parameters are scored on the new sample without fitting, otherwise they are
+    the starting point of the new fits
+    :param drift_threshold: see drift
+    :return: the ranking table, a list of rows (see score_candidate) from the best fit to the worst
+
+    example:
+    input: durations, ['norm', 'expon']
+    output: [{'distribution': 'expon', 'parameters': [15.0, 92.3], 'aic': 5310.2, 'bic': 5320.1, 'pvalue': 0.03, ...},
+             {'distribution': 'norm', ...}]
+    """
+    sorted_y = np.sort(np.asarray(y, dtype=float))
+    if not len(sorted_y):
+        raise ValueError('Cannot fit distributions to an empty sample')
+
+    key = None
+    if cache is not None:
+        key = fingerprint(sorted_y, dist_names)
+        ranking = cache.get(key)
+        if ranking is not None:
+            logger.info(f'Reuse the cached fit of {len(sorted_y)} values')
+            return ranking
+
+    state = cache.get_state(variable) if cache is not None and variable is not None else {}
+    starts = {dist_name: state[dist_name]['parameters'] for dist_name in dist_names if dist_name in state}
+
+    fitted = {}
+    reused = len(starts) == len(dist_names) and drift(sorted_y, state) < drift_threshold
+    if reused:
+        logger.info(f'{variable} did not drift since the last fit of {state[dist_names[0]]["sample_size"]} values, reuse its parameters')
+        fitted = {dist_name: tuple(starts[dist_name]) for dist_name in dist_names}
+    elif workers <= 1 or len(dist_names) <= 1:
+        for dist_name in dist_names:
+            try:
+                fitted[dist_name] = fit_candidate(dist_name, sorted_y, starts.get(dist_name))
+            except Exception as e:
+                logger.warning(f'Failed to fit {dist_name}: {e}')
+                fitted[dist_name] = 'error'
+    else:
+        processes = min(workers, len(dist_names))
+        pool = multiprocessing.Pool(processes)
+        try:
+            # the candidates run at the same time, so the deadline counts from the start, with timeout seconds for every round of processes
+            deadline = time.monotonic() + timeout * math.ceil(len(dist_names) / processes)
+            futures = {dist_name: pool.apply_async(fit_candidate, (dist_name, sorted_y, starts.get(dist_name))) for dist_name in dist_names}
+            for dist_name, future in futures.items():
+                try:
+                    fitted[dist_name] = future.get(max(deadline - time.monotonic(), 0))
+                except multiprocessing.TimeoutError:
+                    logger.warning(f'Fitting {dist_name} took more than {timeout} seconds, skipped')
+                    fitted[dist_name] = 'timeout'
+                except Exception as e:
+                    logger.warning(f'Failed to fit {dist_name}: {e}')
+                    fitted[dist_name] = 'error'
+        finally:
+            pool.terminate()  # kill the fits that timed out
+
+    rows = []
+    for dist_name, params in fitted.items():
+        if isinstance(params, str):
+            rows.append({'distribution': dist_name, 'parameters': None, 'status': params})
+        else:
+            rows.append(score_candidate(sorted_y, dist_name, params))
+    ranking = rank(rows)
+
+    if cache is not None and all(row['status'] != 'timeout' for row in ranking):  # a timeout depends on the machine, try again next time
+        cache.put(key, ranking)
+        if variable is not None and not reused:  # keep the state of the last real fit, so that small drifts cannot add up unnoticed
+            cache.put_state(variable, ranking, len(sorted_y))
+    return ranking
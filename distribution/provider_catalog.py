@@ -0,0 +1,79 @@
+import csv
+import hashlib
+import io
+import json
+import os
+from collections import defaultdict
+
+PROVIDER_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input', 'provider_catalog.csv')
+
+CATALOG_CACHE = {}  # absolute path -> ProviderCatalog, so that the catalog is parsed once per run
+
+
+class ProviderCatalog:
+    def __init__(self, rows, mtime, digest):
+        """
+        :param rows: a list of dictionaries, one for each row of the provider catalog csv
+        :param mtime: modification time (ns) of the csv when it was parsed
+        :param digest: sha1 of the csv content when it was parsed
+        """
+        self.rows = rows
+        self.mtime = mtime
+        self.digest = digest
+        self.geocode_index = {}  # (absolute path, mtime) of a geocode table -> {company: [geocode]}
+
+    def providers_by_type(self):
+        """
+        :return: a dictionary of provider type to the list of providers of that type
+        """
+        result = defaultdict(list)
+        for row in self.rows:
+            result[row['type']].append(row['provider'])
+        return result
+
+    def company_geocodes(self, geocode_path):
+        """
+        :param geocode_path: path of a json dictionary of place name (lower case) to geocode, like util/distribution/input/geocode.json
+        :return: a dictionary of company to the list of geocodes of the places in its location column. Like the catalog, the location strings are
+        only split and converted again when the geocode table is modified (mtime).
+
+        example:
+        output: {'Microsoft': ['US_IA', 'US_VA', ..., 'AE'], ...}
+        """
+        geocode_path = os.path.abspath(geocode_path)
+        key = geocode_path, os.stat(geocode_path).st_mtime_ns
+        if key not in self.geocode_index:
+            with open(geocode_path, 'r') as f:
+                geocode = json.load(f)
+            result = defaultdict(dict)  # the inner dictionary keeps the order of the places and drops duplicates
+            for row in self.rows:
+                for place in row['location'].replace('.', ',').split(','):
+                    result[row['company']][geocode[place.strip()]] = 0
+            self.geocode_index = {cached: index for cached, index in self.geocode_index.items() if cached[0] != geocode_path}  # older versions
+            self.geocode_index[key] = {company: list(geocodes) for company, geocodes in result.items()}
+
+        return self.geocode_index[key]
+
+
+def load_provider_catalog(path=PROVIDER_CATALOG_PATH):
+    """
+    :param path: path of the provider catalog csv
+    :return: a ProviderCatalog object. The parsed catalog is cached, it is only parsed again when the file is modified (mtime) and its content
+    (sha1) actually changed.
+    """
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    cached = CATALOG_CACHE.get(path)
+    if cached and cached.mtime == mtime:
+        return cached
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if cached and cached.digest == digest:
+        cached.mtime = mtime
+        return cached
+
+    rows = [row for row in csv.DictReader(io.StringIO(content.decode('utf-8-sig')))]
+    CATALOG_CACHE[path] = ProviderCatalog(rows, mtime, digest)
+    return CATALOG_CACHE[path]
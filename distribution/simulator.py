@@ -0,0 +1,222 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.stats as st
+from empirical import EmpiricalDistribution
+import logging
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%Y%m%d %H:%M:%S')
+logger = logging.getLogger()
+
+OUTPUT_DIR = 'output'  # directory of the *_distribution.json files written by distribution_generator
+CHUNK_SIZE = 1_000_000  # number of events sampled at once, the memory of one chunk is about 30 bytes per event
+SIM_WORKERS = os.cpu_count() or 1
+UNKNOWN = 'UNKNOWN'  # label of the events whose parent has an empty conditional table, like the providers that have no location distribution
+BENCHMARK_EVENTS = 10 ** 7
+
+
+class ConditionalSampler:
+    def __init__(self, tables, labels, unknown=UNKNOWN):
+        """
+        :param tables: a list of {label: probability} dictionaries, one per parent category. An empty dictionary always gives the unknown label
+        :param labels: the list of all the labels, the samples are the positions of the labels in this list
+        :param unknown: the label of the parents without table, it must be in labels
+        The cdfs of all the parents are concatenated, the cdf of parent i being shifted by i. Sampling the children of any mix of parents is then one
+        np.searchsorted of parent + u.
+        """
+        label_index = {label: i for i, label in enumerate(labels)}
+        cdfs, codes, ends = [], [], []
+        for i, table in enumerate(tables):
+            items = [(label, probability) for label, probability in table.items() if probability > 0] or [(unknown, 1)]
+            cdf = np.cumsum([probability for _, probability in items])
+            cdf = cdf / cdf[-1]
+            cdf[-1] = 1  # u < 1, so parent + u always falls in the cdf of parent
+            cdfs.append(cdf + i)
+            codes.extend(label_index[label] for label, _ in items)
+            ends.append(len(codes) - 1)
+        self.cdf = np.concatenate(cdfs)
+        self.codes = np.array(codes, dtype=np.int16)
+        self.ends = np.array(ends)
+
+    def sample(self, parents, u):
+        """
+        :param parents: a numpy array of parent category positions
+        :param u: a numpy array of uniform random numbers in [0, 1), of the same size
+        :return: a numpy array of label positions, every one drawn from the table of its parent
+        """
+        positions = np.searchsorted(self.cdf, parents + u, side='right')
+        return self.codes[np.minimum(positions, self.ends[parents])]  # parent + u can round up to parent + 1
+
+
+class ContinuousSampler:
+    def __init__(self, result):
+        """
+        :param result: the content of a *_distribution.json file written by generate_continuous_dist, a scipy distribution or 'empirical'
+        """
+        self.name = result['distribution']
+        if self.name == 'empirical':
+            self.empirical = EmpiricalDistribution.from_dict(result['parameters'])
+        else:
+            self.dist = getattr(st, self.name)(*result['parameters'])
+
+    def sample(self, size, rng):
+        """
+        :param size: number of values to draw
+        :param rng: a numpy Generator
+        :return: a numpy array of values
+        """
+        if self.name == 'empirical':
+            return self.empirical.rvs(size, rng)
+        return self.dist.rvs(size=size, random_state=rng)
+
+
+class Simulator:
+    def __init__(self, output_dir=OUTPUT_DIR):
+        """
+        :param output_dir: directory of the distribution files. Every event is sampled in this order: provider type, provider (given the type),
+        location (given the type and the provider), duration, affect rate and impact
+        """
+        def load(name):
+            with open(os.path.join(output_dir, f'{name}_distribution.json'), 'r') as f:
+                return json.load(f)
+
+        provider_distribution = load('provider')
+        location_distribution = load('location')
+
+        # every list of labels ends with UNKNOWN, the label sampled for a parent that has no table
+        self.provider_types = list(provider_distribution) + [UNKNOWN]
+        self.providers = sorted({provider for value in provider_distribution.values() for provider in value['provider']}) + [UNKNOWN]
+        self.locations = sorted({location for providers in location_distribution.values()
+                                 for locations in providers.values() for location in locations})
+        self.locations.append(UNKNOWN)
+
+        # the parent of a provider is its type, the parent of a location is the (type, provider) pair
+        self.type_sampler = ConditionalSampler([{provider_type: value['probability'] for provider_type, value in provider_distribution.items()}],
+                                               self.provider_types)
+        self.provider_sampler = ConditionalSampler([provider_distribution.get(provider_type, {}).get('provider', {})
+                                                    for provider_type in self.provider_types], self.providers)
+        self.location_sampler = ConditionalSampler([location_distribution.get(provider_type, {}).get(provider, {})
+                                                    for provider_type in self.provider_types for provider in self.providers], self.locations)
+
+        self.duration_sampler = ContinuousSampler(load('duration'))
+        self.affect_rate_sampler = ContinuousSampler(load('affect_rate'))
+        impact_distribution = load('impact')
+        self.impacts = list(impact_distribution) + [UNKNOWN]
+        self.impact_sampler = ConditionalSampler([impact_distribution], self.impacts)
+
+    def sample(self, n, rng):
+        """
+        :param n: number of events
+        :param rng: a numpy Generator
+        :return: a dictionary of numpy arrays of n events. The categories are positions in self.provider_types, self.providers, self.locations
+        and self.impacts
+        """
+        u = rng.random((4, n))
+        zeros = np.zeros(n, dtype=np.int64)
+        provider_type = self.type_sampler.sample(zeros, u[0])
+        provider = self.provider_sampler.sample(provider_type.astype(np.int64), u[1])
+        location = self.location_sampler.sample(provider_type.astype(np.int64) * len(self.providers) + provider, u[2])
+        return {'provider_type': provider_type,
+                'provider': provider,
+                'location': location,
+                'duration': self.duration_sampler.sample(n, rng),
+                'affect_rate': np.clip(self.affect_rate_sampler.sample(n, rng), 0, 1),
+                'impact': self.impact_sampler.sample(zeros, u[3])}
+
+    def summarize(self, events):
+        """
+        :param events: a dictionary of numpy arrays returned by sample
+        :return: the aggregates of the events that we keep instead of the events themselves: the number of events per provider, location and
+        impact, the total duration and the total affected duration (duration * affect_rate) per provider
+        """
+        provider = events['provider']
+        return {'events': len(provider),
+                'provider': np.bincount(provider, minlength=len(self.providers)),
+                'location': np.bincount(events['location'], minlength=len(self.locations)),
+                'impact': np.bincount(events['impact'], minlength=len(self.impacts)),
+                'duration': np.bincount(provider, weights=events['duration'], minlength=len(self.providers)),
+                'affected_duration': np.bincount(provider, weights=events['duration'] * events['affect_rate'], minlength=len(self.providers))}
+
+    def run(self, n, seed_sequence, chunk_size=CHUNK_SIZE):
+        """
+        :param n: number of events
+        :param seed_sequence: a np.random.SeedSequence, the seed of this run
+        :param chunk_size: number of events sampled at once
+        :return: the summary of the n events, sampled chunk by chunk so that the memory does not depend on n
+        """
+        rng = np.random.default_rng(seed_sequence)
+        total = None
+        for start in range(0, n, chunk_size):
+            summary = self.summarize(self.sample(min(chunk_size, n - start), rng))
+            total = summary if total is None else merge_summaries(total, summary)
+        return total
+
+
+def merge_summaries(a, b):
+    """
+    :return: the summary of the events of both summaries
+    """
+    return {key: a[key] + b[key] for key in a}
+
+
+def run_worker(output_dir, n, seed_sequence, chunk_size):
+    """
+    :return: the summary of n events, in a worker process of simulate
+    """
+    return Simulator(output_dir).run(n, seed_sequence, chunk_size)
+
+
+def simulate(n, output_dir=OUTPUT_DIR, seed=None, workers=SIM_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    :param n: number of events
+    :param output_dir: directory of the distribution files
+    :param seed: seed of the simulation, None for a random one. The same seed and number of workers give the same result
+    :param workers: number of processes, every process gets an independent random stream spawned from the seed
+    :param chunk_size: number of events sampled at once by each process
+    :return: a dictionary of the labels and the summary of the n events, see Simulator.summarize
+
+    example:
+    input: 10 ** 8
+    output: {'events': 100000000, 'provider': {'AWS': 11298810, ...}, 'location': {...}, 'impact': {...}, 'duration': {...}, ...}
+    """
+    simulator = Simulator(output_dir)
+    seed_sequences = np.random.SeedSequence(seed).spawn(workers)
+    counts = [n // workers + (i < n % workers) for i in range(workers)]
+
+    if workers <= 1:
+        total = simulator.run(n, seed_sequences[0], chunk_size)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(run_worker, [output_dir] * workers, counts, seed_sequences, [chunk_size] * workers))
+        total = summaries[0]
+        for summary in summaries[1:]:
+            total = merge_summaries(total, summary)
+
+    labels = {'provider': simulator.providers, 'location': simulator.locations, 'impact': simulator.impacts, 'duration': simulator.providers,
+              'affected_duration': simulator.providers}
+    result = {'events': int(total['events'])}
+    for key, names in labels.items():
+        result[key] = {name: float(value) for name, value in zip(names, total[key]) if value}
+    return result
+
+
+def benchmark(n=BENCHMARK_EVENTS, output_dir=OUTPUT_DIR, chunk_size=CHUNK_SIZE):
+    """
+    :param n: number of events of each benchmark run
+    :return: log the number of events per second sampled by one process, and by all the processes
+    """
+    simulator = Simulator(output_dir)
+    started = time.perf_counter()
+    simulator.run(n, np.random.SeedSequence(0), chunk_size)
+    logger.info(f'1 process: {n / (time.perf_counter() - started):,.0f} events per second')
+
+    if SIM_WORKERS > 1:
+        started = time.perf_counter()
+        simulate(n, output_dir, seed=0, workers=SIM_WORKERS, chunk_size=chunk_size)
+        logger.info(f'{SIM_WORKERS} processes: {n / (time.perf_counter() - started):,.0f} events per second')
+
+
+if __name__ == '__main__':
+    benchmark(BENCHMARK_EVENTS)
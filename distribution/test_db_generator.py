@@ -0,0 +1,92 @@
+import json
+import sqlite3 as db
+
+import db_generator
+
+EVENTS = [
+    {'issue': 'storage17001', 'provider_type': 'INFRASTRUCTURE_SERVICE_HOSTING', 'provider': 'GCP', 'service': 'storage', 'location': [],
+     'duration': 3975, 'affect_rate': None, 'impact': 'degradation', 'cause': '', 'intensity': '', 'time': '2017-06-27 07:30'},
+    {'issue': 'x1', 'provider_type': ['SaaS', 'Email'], 'provider': 'G_Suite', 'service': ['Gmail', 'Google Drive'],
+     'location': ['Auckland, New Zealand', 'Eastern USA'], 'duration': 253, 'affect_rate': 0.5, 'impact': 'outage', 'cause': '', 'intensity': '',
+     'time': '2019-06-02 23:15'},
+    {'issue': 12, 'provider_type': 'IAAS', 'provider': 'IBM', 'service': 'dal05, sjc01', 'location': 'dal05, sjc01', 'duration': 60,
+     'affect_rate': None, 'impact': 'outage', 'cause': '', 'intensity': '', 'time': '2019-05-17 21:23'},
+    {'issue': 'short', 'provider_type': 'SaaS', 'provider': 'G_Suite', 'service': ['Gmail'], 'location': [], 'duration': 5,
+     'affect_rate': None, 'impact': 'outage', 'cause': '', 'intensity': '', 'time': '2019-05-20 16:56'},
+]
+
+
+def write_scrape_dir(tmp_path):
+    scrape_dir = tmp_path / 'data'
+    scrape_dir.mkdir()
+    with open(scrape_dir / 'test_outage.json', 'w') as f:
+        json.dump(EVENTS, f)
+    return str(scrape_dir)
+
+
+def write_v1_db(path, scrape_dir, v1_locations=None):
+    """
+    :param v1_locations: a dictionary of issue to the location stored by version 1 instead of the one in the scrape files
+    :return: an event catalog of schema version 1, built from the scrape files the way version 1 did, with the services and locations joined
+    """
+    frame = db_generator.list_to_string(db_generator.read_scrape_data(scrape_dir))
+    frame['location'] = [(v1_locations or {}).get(str(issue), cell) for issue, cell in zip(frame['issue'], frame['location'])]
+    with db.connect(path) as conn:
+        conn.execute(f"CREATE TABLE {db_generator.EVENT_CATALOG_TABLE}({', '.join(db_generator.COLUMN_ORDER)})")
+        conn.executemany(f"INSERT INTO {db_generator.EVENT_CATALOG_TABLE} VALUES ({', '.join('?' * len(db_generator.COLUMN_ORDER))})",
+                         frame[db_generator.COLUMN_ORDER].astype(object).where(frame.notna(), None).values.tolist())
+        conn.execute('CREATE TABLE temp_event(issue text)')
+    conn.close()
+
+
+def counts(conn):
+    return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in [db_generator.EVENT_CATALOG_TABLE, db_generator.SERVICE_TABLE, db_generator.LOCATION_TABLE]}
+
+
+def rows(conn, table, column):
+    return sorted(conn.execute(f'SELECT issue, {column} FROM {table}').fetchall())
+
+
+def build(path, scrape_dir):
+    conn = db.connect(path)
+    db_generator.create_schema(conn, scrape_dir)
+    db_generator.ingest_scrape_data(conn, scrape_dir)
+    return conn
+
+
+def test_migrated_db_agrees_with_fresh_db(tmp_path):
+    scrape_dir = write_scrape_dir(tmp_path)
+    write_v1_db(str(tmp_path / 'v1.db'), scrape_dir)
+    fresh = build(str(tmp_path / 'fresh.db'), scrape_dir)
+    migrated = build(str(tmp_path / 'v1.db'), scrape_dir)
+
+    assert counts(fresh) == {db_generator.EVENT_CATALOG_TABLE: 3, db_generator.SERVICE_TABLE: 5, db_generator.LOCATION_TABLE: 4}
+    assert counts(migrated) == counts(fresh)
+    for table, column in [(db_generator.SERVICE_TABLE, 'service'), (db_generator.LOCATION_TABLE, 'location')]:
+        assert rows(migrated, table, column) == rows(fresh, table, column)
+    assert ('x1', 'Auckland, New Zealand') in rows(migrated, db_generator.LOCATION_TABLE, 'location')
+    assert migrated.execute("SELECT name FROM sqlite_master WHERE name = 'temp_event'").fetchone() is None
+
+    # ingesting the same scrape files again adds nothing
+    db_generator.ingest_scrape_data(migrated, scrape_dir, full_refresh=True)
+    assert counts(migrated) == counts(fresh)
+    fresh.close()
+    migrated.close()
+
+
+def test_migration_keeps_stored_values(tmp_path):
+    scrape_dir = write_scrape_dir(tmp_path)
+    write_v1_db(str(tmp_path / 'v1.db'), scrape_dir, {'storage17001': 'us-central1'})  # the scrape file was rewritten without it since then
+    migrated = build(str(tmp_path / 'v1.db'), scrape_dir)
+
+    assert ('storage17001', 'us-central1') in rows(migrated, db_generator.LOCATION_TABLE, 'location')
+    assert counts(migrated)[db_generator.LOCATION_TABLE] == 5
+    migrated.close()
+
+
+def test_migrated_list():
+    assert db_generator.migrated_list('Auckland, New Zealand', ['Auckland, New Zealand']) == ['Auckland, New Zealand']
+    assert db_generator.migrated_list('us-central1', []) == 'us-central1'
+    assert db_generator.migrated_list('dal05, sjc01', ['dal05']) == 'dal05, sjc01'
+    assert db_generator.migrated_list('dal05, sjc01', None) == 'dal05, sjc01'
@@ -1,9 +1,9 @@
 import json
-import requests
 import re
 from datetime import datetime
 from bs4 import BeautifulSoup
 from dateutil.parser import parse
+from http_fetcher import HttpCache, HttpFetcher
 import sys
 import logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%y%m%d %H:%M:%S')
@@ -35,6 +35,8 @@ COLUMNS = ['issue', 'provider_type', 'provider', 'service', 'location', 'duratio
 PROVIDER_TYPE = 'INFRASTRUCTURE_SERVICE_HOSTING'
 PROVIDER = 'Azure'
 
+FETCHER = HttpFetcher(headers=REQUEST_HEADERS, cache=HttpCache())  # pages that did not change since the last run are not downloaded again
+
 
 class AzureScrape:
     def __init__(self):
@@ -47,28 +49,46 @@ class AzureScrape:
         :param main_page_url: The url that leads us to the main azure incident page, where we can find all the zone and service options.
         :return: When creating filter in the request, azure uses service code and zone code like 'api-management' or 'w-india', we create two
         dictionaries that the key is the service/zone code and value is the text we need, this function changes the two dictionaries.
+        If the main page did not change since the last run, the dictionaries of the last run are used.
+        """
+        services, zones = FETCHER.cached_parse(FETCHER.get(main_page_url), self.parse_services_zones, 'azure.services_zones')
+        self.services.update(services)
+        self.zones.update(zones)
+
+    @staticmethod
+    def parse_services_zones(response):
+        """
+        :param response: the response of the main azure incident page
+        :return: the dictionary of service code to service text and the dictionary of zone code to zone text
         """
-        html = requests.get(main_page_url, headers=REQUEST_HEADERS)
-        soup = BeautifulSoup(html.content, 'html.parser')
+        services = {}
+        zones = {}
+        soup = BeautifulSoup(response.content, 'html.parser')
         options = soup.find(id='wa-dropdown-service').find_all('option')
         for option in options:
             # Create a map of service code to service text
-            self.services[option['value']] = option.text
+            services[option['value']] = option.text
 
         options = soup.find(id='wa-dropdown-history-region').find_all('option')
         for option in options:
             # Create a map of zone code to zone text.
-            self.zones[option['value']] = option.text
+            zones[option['value']] = option.text
+        return services, zones
 
-    @staticmethod
-    def get_incidents(link):
+    def get_incidents(self, link):
         """
         :param link: Link to a page that has all the incidents of a given filters (selected zones and services)
-        :return: A list of html tag object of incident
+        :return: A list of incident dictionaries, see parse_incident. A page that did not change since the last run is not parsed again
         """
-        html = requests.get(link, headers=REQUEST_HEADERS)
-        soup = BeautifulSoup(html.content, 'html.parser')
-        return soup.find_all('div', attrs={'class': 'column small-11'})
+        return FETCHER.cached_parse(FETCHER.get(link), self.parse_incidents, 'azure.incidents')
+
+    def parse_incidents(self, response):
+        """
+        :param response: the response of a page of incidents
+        :return: A list of incident dictionaries, one for each incident paragraph of the page
+        """
+        soup = BeautifulSoup(response.content, 'html.parser')
+        return [self.parse_incident(incident) for incident in soup.find_all('div', attrs={'class': 'column small-11'})]
 
     @staticmethod
     def get_impact(text):
@@ -106,14 +126,12 @@ class AzureScrape:
             if self.zones[zone] not in self.events[issue]["location"]:
                 self.events[issue]["location"].append(self.zones[zone])
 
-    def scrape_new_incident(self, incident, service, zone):
+    def parse_incident(self, incident):
         """
-        :param incident: The  paragraph of the current incident
-        :param service: The current service that the incident belongs to, in code form, not final text we need
-        :param zone: The current Zone that the incident belongs to, in code form, not final text we need
-        :return: Create a new row in the event catalog with duration and impact
+        :param incident: The html tag object of the paragraph of an incident
+        :return: A dictionary of the issue, the duration, the start time and the impact of the incident, they do not depend on the service and the
+        zone of the page
         """
-
         issue = incident.find('h3').text  # header for each events, we use it as a unique name to represent the incident
 
         target_paragraph = incident.find_all(lambda tag: tag.name == 'p' and 'Summary' in tag.text[0:21])
@@ -140,10 +158,19 @@ class AzureScrape:
             duration = int((datetimes[1] - datetimes[0]).total_seconds() / 60)
             starttime = datetime.strftime(datetimes[0], '%Y-%m-%d %H:%M')
 
-        impact = self.get_impact(summary)
+        return {"issue": issue, "duration": duration, "time": starttime, "impact": self.get_impact(summary)}
+
+    def scrape_new_incident(self, incident, service, zone):
+        """
+        :param incident: The dictionary of the current incident, see parse_incident
+        :param service: The current service that the incident belongs to, in code form, not final text we need
+        :param zone: The current Zone that the incident belongs to, in code form, not final text we need
+        :return: Create a new row in the event catalog with duration and impact
+        """
+        issue = incident["issue"]
         cause = None
-        event = {"provider_type": PROVIDER_TYPE, "provider": PROVIDER, "service": [self.services[service]], "duration": duration, "affect_rate": 0.5,
-                 "impact": impact, "cause": cause, "intensity": None, "time": starttime}
+        event = {"provider_type": PROVIDER_TYPE, "provider": PROVIDER, "service": [self.services[service]], "duration": incident["duration"],
+                 "affect_rate": 0.5, "impact": incident["impact"], "cause": cause, "intensity": None, "time": incident["time"]}
 
         event["location"] = ['Global'] if zone == 'global' else [self.zones[zone]]
 
@@ -152,13 +179,13 @@ class AzureScrape:
 
     def scrape_incidents(self, incidents, service, zone):
         """
-        :param incidents: The list of html tag object that contains information for all data
+        :param incidents: The list of incident dictionaries of a page, see parse_incident
         :param service: The current service that the incident belongs to, in code form, not final text we need
         :param zone: The current Zone that the incident belongs to, in code form, not final text we need
         :return: It handles existed incident or new incident by calling different function that will further change the self event catalog.
         """
         for incident in incidents:
-            issue = incident.find('h3').text  # header for each events, we use it as a unique name to represent the incident
+            issue = incident["issue"]
             if issue in self.events:
                 self.scrape_existed_incident(issue, service, zone)
             else:
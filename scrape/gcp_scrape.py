@@ -1,10 +1,10 @@
-import requests
 import lxml.html
 import os
 import re
 from datetime import datetime
-import json
 import sys
+from http_fetcher import HttpCache, HttpFetcher
+from watermark import Watermark, merge_events
 import logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%y%m%d %H:%M:%S')
 logger = logging.getLogger()
@@ -25,6 +25,10 @@ REQUEST_HEADERS = {  # to pretend to be a browser
 
 DOMAIN = 'https://status.cloud.google.com/incident/'
 
+# pages that link every incident, a source can also be the path of a saved copy
+INDEX_SOURCES = ['https://status.cloud.google.com/summary', 'https://status.cloud.google.com/incidents.json']
+INCIDENT_LINK_REGEX = re.compile(r'/incident/([a-z0-9-]+)/(\d{5})\b')  # '/incident/compute/19005', the year and the number of the year
+
 SERVICES = ['appengine', 'compute', 'storage', 'bigquery', 'cloud-ddatastore', 'cloud-dev-tools', 'cloud-functions',
             'cloud-iam', 'cloud-ml', 'cloud-networking', 'cloud-pubsub', 'cloud-sql', 'cloud-dataflow',
             'container-engine', 'google-stackdriver', 'developers-console', 'support']
@@ -36,7 +40,8 @@ ZONES = ['asia-east1', 'asia-east2', 'asia-northeast1', 'asia-south1', 'asia-sou
 COUNTRIES = ['Asia', 'North America', 'South America', 'Europe', 'US multi-region', 'US multi region', 'European multi-region',
              'Canada']
 
-YEARS = ['15', '16', '17', '18', '19']
+FIRST_YEAR = 2015
+YEARS = [f'{year % 100:02d}' for year in range(FIRST_YEAR, datetime.now().year + 1)]  # only used when the index cannot be read
 
 ISSUES = ['001', '002', '003', '004', '005', '006', '007', '008', '009', '010', '011', '012', '013', '014',
           '015', '016', '017', '018', '019', '020', '021', '022', '023', '024', '025', '026', '027', '028', '029',
@@ -53,6 +58,8 @@ PROVIDER = 'GCP'
 
 events = []  # list to store event catalog
 
+FETCHER = HttpFetcher(headers=REQUEST_HEADERS, cache=HttpCache())  # incident pages that did not change are not downloaded and parsed again
+
 
 def get_impact(doc):
     """
@@ -163,58 +170,180 @@ def calculate_affect_rate(numbers):
     return round(avg, 3)
 
 
+def parse_incident(response, service, issue):
+    """
+    :param response: the response of an incident page
+    :param service: the service of the incident
+    :param issue: the unique name of the incident, the service followed by the year and the number
+    :return: the row of the incident in the event catalog (None if the impact or the duration of the incident is unclear), and whether the page
+    is final. A page that shows no impact is final, a page we cannot parse (like an on-going incident without end time) is not
+
+    example:
+    output: {"issue": 'compute19005', ...}, True
+    """
+    lxml_doc = lxml.html.fromstring(response.content)
+    try:
+        impact = get_impact(doc=lxml_doc)
+    except Exception:
+        logger.exception(f"Fail to get impact of {response.request_url}")
+        return None, False
+    if not impact:
+        return None, True
+
+    # Google sometime forget to follow up an event
+    try:
+        duration, starttime = get_duration_and_starttime(lxml_doc)
+    except Exception:
+        logger.exception(f"Fail to get duration of {response.request_url}")
+        return None, False
+
+    location, percentage = get_location_and_percentage(lxml_doc)
+
+    affect_rate = calculate_affect_rate(percentage)
+
+    return {"issue": issue,
+            "provider_type": PROVIDER_TYPE,
+            "provider": PROVIDER,
+            "service": service,
+            "location": location,
+            "duration": duration,
+            "affect_rate": affect_rate,
+            "impact": impact,
+            "cause": None, "intensity": None,
+            "time": starttime}, True
+
+
 def write_json():
     """
-    :return: Take the global events and write to json file
+    :return: Take the global events and merge them into the json file, the events of the previous runs are kept
     """
-    with open(RESULT_PATH, 'w') as f:
-        json.dump(events, f)
+    merge_events(RESULT_PATH, events)
     logger.info(f'json file at: {RESULT_PATH}')
 
 
-def scrape():
+def service_watermark(watermark, service):
+    """
+    :param watermark: the Watermark of GCP
+    :param service: the service of the incidents, like 'compute'
+    :return: the latest issue of the service we already scraped, from the watermark of the service or else from the known issues, or None
+
+    example:
+    input: watermark, 'compute'
+    output: 'compute19005'
+    """
+    if watermark.full_scrape:
+        return None
+    if watermark.issue(service):  # it stays before the incidents we could not parse, while a later known issue may be after them
+        return watermark.issue(service)
+    issues = [issue for issue in watermark.known_issues
+              if issue.startswith(service) and len(issue) == len(service) + len(YEARS[0] + ISSUES[0]) and issue[len(service):].isdigit()]
+    return max(issues, default=None)
+
+
+def find_incidents(text):
+    """
+    :param text: the content of an index page (html or json)
+    :return: the sorted list of the (service, number) of the incidents linked in the page
+
+    example:
+    input: a page with the links '/incident/compute/19005' and '/incident/cloud-sql/18002'
+    output: [['cloud-sql', '18002'], ['compute', '19005']]
+    """
+    text = text.replace('\\/', '/')  # json escapes the slashes
+    return sorted([service, number] for service, number in set(INCIDENT_LINK_REGEX.findall(text)))
+
+
+def discover_incidents(sources=INDEX_SOURCES):
+    """
+    :param sources: a list of urls or paths of saved copies of the index pages
+    :return: the sorted list of the (service, number) of all the incidents linked in the sources, an index that cannot be read is skipped
     """
-    :return: Iterate through all the SERVICES, YEARS and ISSUES, get all the information and store to json file
+    incidents = set()
+    for source in sources:
+        if os.path.exists(source):
+            with open(source, 'r') as f:
+                incidents.update(map(tuple, find_incidents(f.read())))
+            continue
+        try:
+            response = FETCHER.get(source)
+        except Exception:
+            logger.exception(f'Fail to read the index {source}')
+            continue
+        if not response.ok:
+            logger.warning(f'Fail to read the index {source}: {response.status_code}')
+            continue
+        incidents.update(map(tuple, FETCHER.cached_parse(response, lambda r: find_incidents(r.text), 'gcp.index')))
+    logger.info(f'Discovered {len(incidents)} {PROVIDER} incidents')
+    return sorted(incidents)
+
+
+def discovered_pages(incidents):
+    """
+    :param incidents: a list of (service, number) of incidents
+    :return: a generator of (service, number, response) of the incident pages, all the pages are fetched concurrently
+    """
+    urls = [f'{DOMAIN}{service}/{number}' for service, number in incidents]
+    FETCHER.prefetch(urls)
+    for (service, number), url in zip(incidents, urls):
+        response = FETCHER.get(url)
+        FETCHER.discard([url])
+        if not response.ok:
+            logger.warning(f'Fail to get {url}: {response.status_code}')
+            continue
+        yield service, number, response
+
+
+def enumerated_pages(watermark):
+    """
+    :param watermark: the Watermark of GCP
+    :return: a generator of (service, number, response) of the incident pages, found by trying every SERVICES, YEARS and ISSUES after the
+    watermark of the service until a page is missing. This is how we find the incidents when no index can be read
     """
     for SERVICE in SERVICES:
+        latest = service_watermark(watermark, SERVICE)
         for YEAR in YEARS:
             for ISSUE in ISSUES:
+                if latest and f'{SERVICE}{YEAR}{ISSUE}' <= latest:  # the year and the number have a fixed width, so the order is the string order
+                    continue
                 logger.info(f'Now scraping {PROVIDER} {SERVICE + YEAR + ISSUE}')
-                parsed_link = f'{DOMAIN}{SERVICE}/{YEAR}{ISSUE}'
-
-                html = requests.get(parsed_link, headers=REQUEST_HEADERS)
-
+                html = FETCHER.get(f'{DOMAIN}{SERVICE}/{YEAR}{ISSUE}')
                 if not html.ok:
                     break
+                yield SERVICE, f'{YEAR}{ISSUE}', html
 
-                lxml_doc = lxml.html.fromstring(html.content)
-                impact = get_impact(doc=lxml_doc)
-                if not impact:
-                    continue
-
-                # Google sometime forget to follow up an event
-                try:
-                    duration, starttime = get_duration_and_starttime(lxml_doc)
-                except Exception:
-                    logger.exception(f"Fail to get duration of {parsed_link}")
-                    continue
 
-                location, percentage = get_location_and_percentage(lxml_doc)
+def scrape(watermark=None, sources=INDEX_SOURCES):
+    """
+    :param watermark: the Watermark of GCP, None to read it from the event catalog and the json file
+    :param sources: the urls or saved copies of the index pages that link the incidents
+    :return: Get all the information of the incidents linked in the index pages and store to json file. The incidents of a service up to its
+    watermark are known, so they are not requested again. If no incident is found in the index, we try every SERVICES, YEARS and ISSUES instead
+    """
+    watermark = watermark or Watermark(PROVIDER, result_path=RESULT_PATH)
+    incidents = discover_incidents(sources)
+    if incidents:
+        latest = {service: service_watermark(watermark, service) for service in {service for service, _ in incidents}}
+        incidents = [(service, number) for service, number in incidents if not latest[service] or f'{service}{number}' > latest[service]]
+        logger.info(f'{len(incidents)} {PROVIDER} incidents after the watermarks')
+        pages = discovered_pages(incidents)
+    else:
+        logger.warning(f'No {PROVIDER} incident found in the index, try every incident url instead')
+        pages = enumerated_pages(watermark)
 
-                affect_rate = calculate_affect_rate(percentage)
+    unfinished = set()  # services with an incident we could not parse, their watermark stays before it so it is requested again next time
+    for service, number, html in pages:
+        issue = f'{service}{number}'
+        row, final = FETCHER.cached_parse(html, lambda response: parse_incident(response, service, issue), 'gcp.incident_page')
+        if not final:
+            unfinished.add(service)
+        elif service not in unfinished:
+            watermark.update(issue, scope=service)  # the pages that show no impact count too, they are not requested again
 
-                row = {"issue": f'{SERVICE}{YEAR}{ISSUE}',
-                       "provider_type": PROVIDER_TYPE,
-                       "provider": PROVIDER,
-                       "service": SERVICE,
-                       "location": location,
-                       "duration": duration,
-                       "affect_rate": affect_rate,
-                       "impact": impact,
-                       "cause": None, "intensity": None,
-                       "time": starttime}
+        if row is None:
+            continue
 
-                events.append(row)
+        events.append(row)
 
     logger.info('Done scraping.')
     write_json()
+    watermark.save()
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+logger = logging.getLogger()
+
+MAX_WORKERS = 16  # number of requests in flight over all the hosts
+PER_HOST_LIMIT = 4  # number of requests in flight to the same host, to stay polite with the status pages
+REQUEST_TIMEOUT = 30  # seconds
+RETRIES = 3
+HTTP_CACHE_DIR = 'cache/http'  # bodies, validators and parse results of the pages we fetched
+
+
+class HttpCache:
+    def __init__(self, directory=HTTP_CACHE_DIR):
+        """
+        :param directory: the directory the cache is stored in, it is created if not exist. For every url we keep its body, its validators (ETag,
+        Last-Modified) and the sha256 of the body, and for every parser the result of parsing that body
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+    def write(self, path, content):
+        """
+        :return: write content (bytes) to path atomically, a reader never sees a half written file
+        """
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def load_meta(self, url):
+        """
+        :param url: a full url
+        :return: the stored validators of the url {'etag': ..., 'last_modified': ..., 'sha256': ..., 'encoding': ...}, or None
+        """
+        try:
+            with open(self.path(url, '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_body(self, url):
+        """
+        :param url: a full url
+        :return: the stored body of the url, or None
+        """
+        try:
+            with open(self.path(url, '.body'), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store(self, url, response):
+        """
+        :param url: a full url
+        :param response: a successful response of the url, its body and validators are stored
+        """
+        self.write(self.path(url, '.body'), response.content)
+        meta = {'url': url, 'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                'sha256': hashlib.sha256(response.content).hexdigest(), 'encoding': response.encoding, 'fetched_at': time.time()}
+        self.write(self.path(url, '.json'), json.dumps(meta).encode())
+
+    def load_parsed(self, namespace, url, content_hash):
+        """
+        :param namespace: the name of the parser
+        :param url: a full url
+        :param content_hash: the sha256 of the body we want to parse
+        :return: (True, the stored result) if the parser already parsed this body, (False, None) otherwise
+        """
+        try:
+            with open(self.path(f'{namespace} {url}', '.parsed.json'), 'r') as f:
+                parsed = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+        if parsed['sha256'] != content_hash:
+            return False, None
+        return True, parsed['value']
+
+    def store_parsed(self, namespace, url, content_hash, value):
+        """
+        :param namespace: the name of the parser
+        :param url: a full url
+        :param content_hash: the sha256 of the body that was parsed
+        :param value: the result of the parser, it should be json serializable
+        """
+        self.write(self.path(f'{namespace} {url}', '.parsed.json'), json.dumps({'sha256': content_hash, 'value': value}).encode())
+
+    def to_response(self, url, meta, body):
+        """
+        :return: a requests.Response of the stored body of the url, to answer a 304 Not Modified
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = body
+        response.encoding = meta.get('encoding')
+        if meta.get('etag'):
+            response.headers['ETag'] = meta['etag']
+        if meta.get('last_modified'):
+            response.headers['Last-Modified'] = meta['last_modified']
+        return response
+
+
+class HttpFetcher:
+    def __init__(self, headers=None, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT, timeout=REQUEST_TIMEOUT, retries=RETRIES,
+                 cache=None):
+        """
+        :param headers: headers sent with every request
+        :param max_workers: number of requests in flight over all the hosts
+        :param per_host_limit: number of requests in flight to the same host
+        :param timeout: seconds before a request is abandoned
+        :param retries: number of retries of a request that failed to connect or got a 429 or 5xx status
+        :param cache: an HttpCache. With a cache, a url we fetched before is requested with If-None-Match / If-Modified-Since, and on 304 the
+        stored body is used
+        All the requests share one keep-alive session, so the connection to a host is opened once.
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers,
+                              max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self.timeout = timeout
+        self.cache = cache
+        self.per_host_limit = per_host_limit
+        self.host_semaphores = defaultdict(lambda: threading.Semaphore(self.per_host_limit))
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = {}  # url: future of a prefetched request
+
+    def fetch(self, url):
+        """
+        :param url: a full url
+        :return: the response of the url, once a slot of its host is free. The response has three more attributes: request_url (the url we asked
+        for), from_cache (True if the server answered 304 and the stored body is used) and content_hash (the sha256 of the body)
+        """
+        meta = self.cache.load_meta(url) if self.cache is not None else None
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        with self.lock:
+            semaphore = self.host_semaphores[urlsplit(url).netloc]
+        with semaphore:
+            response = self.session.get(url, timeout=self.timeout, headers=headers)
+
+        from_cache = False
+        if response.status_code == 304 and meta:
+            body = self.cache.load_body(url)
+            if body is None:  # the body was deleted, ask again without validators
+                with semaphore:
+                    response = self.session.get(url, timeout=self.timeout)
+            else:
+                response = self.cache.to_response(url, meta, body)
+                from_cache = True
+        if self.cache is not None and response.ok and not from_cache:
+            self.cache.store(url, response)
+
+        response.request_url = url
+        response.from_cache = from_cache
+        response.content_hash = hashlib.sha256(response.content).hexdigest()
+        return response
+
+    def prefetch(self, urls):
+        """
+        :param urls: a list of urls that we are going to get. They are fetched in the background, a later get of the same url waits for the result
+        instead of sending another request
+        """
+        with self.lock:
+            for url in urls:
+                if url not in self.pending:
+                    self.pending[url] = self.executor.submit(self.fetch, url)
+
+    def get(self, url):
+        """
+        :param url: a full url
+        :return: the response of the url, from a prefetched request if there is one
+        """
+        with self.lock:
+            future = self.pending.get(url)
+        if future is None:
+            return self.fetch(url)
+        return future.result()
+
+    def get_many(self, urls):
+        """
+        :param urls: a list of urls
+        :return: the list of their responses in the same order, fetched concurrently
+        """
+        self.prefetch(urls)
+        return [self.get(url) for url in urls]
+
+    def cached_parse(self, response, parse, namespace):
+        """
+        :param response: a response returned by get
+        :param parse: a function that takes the response and returns a json serializable result
+        :param namespace: the name of the parser, so that two parsers of the same url do not share their results
+        :return: the result of parse(response). If the body has the same content hash as the last time this parser parsed this url, the stored
+        result is returned without parsing again
+        """
+        if self.cache is None:
+            return parse(response)
+        found, value = self.cache.load_parsed(namespace, response.request_url, response.content_hash)
+        if found:
+            return value
+        value = parse(response)
+        self.cache.store_parsed(namespace, response.request_url, response.content_hash, value)
+        return value
+
+    def discard(self, urls):
+        """
+        :param urls: the prefetched urls we do not need anymore, their responses are released
+        """
+        with self.lock:
+            for url in urls:
+                self.pending.pop(url, None)
@@ -1,5 +1,5 @@
-import requests
 from bs4 import BeautifulSoup
+from http_fetcher import HttpCache, HttpFetcher
 from datetime import datetime
 import json
 import re
@@ -24,16 +24,25 @@ START_TIME_REGEX = re.compile(r'Outage Start:(.*?) {2}')
 END_TIME_REGEX = re.compile(r'Outage End:(.*?) {2}')
 events = []
 
+FETCHER = HttpFetcher(cache=HttpCache())  # the feed is downloaded and parsed again only when it changed
+
 
 def get_incidents(link):
     """
     :param link: The link of the IBM incident page
-    :return: A list of html element object, each of them is called 'item', we will use soup.find_all on this 'item' later.
+    :return: A list of the description texts of the 'item' elements of the feed. If the feed did not change since the last run, the descriptions
+    of the last run are returned without parsing the feed again
     """
-    html = requests.get(link)
-    soup = BeautifulSoup(html.content, 'lxml')
-    result = soup.find_all('item')
-    return result
+    return FETCHER.cached_parse(FETCHER.get(link), parse_descriptions, 'ibm.feed')
+
+
+def parse_descriptions(response):
+    """
+    :param response: the response of the IBM feed
+    :return: A list of the description texts of the 'item' elements of the feed
+    """
+    soup = BeautifulSoup(response.content, 'lxml')
+    return [item.find('description').text for item in soup.find_all('item')]
 
 
 def get_issue(text):
@@ -120,10 +129,9 @@ def write_json():
 
 
 if __name__ == '__main__':
-    incidents = get_incidents(URL)
+    descriptions = get_incidents(URL)
     logger.info(f'Now scraping {PROVIDER}')
-    for incident in incidents:
-        description = incident.find('description').text
+    for description in descriptions:
         incident_type = re.findall(r'Type:(.*?) {2}', description)[0].strip()
 
         # Exclude 'maintenance'
@@ -1,8 +1,11 @@
+import hashlib
+import io
 import json
 from abc import ABCMeta, abstractmethod
-import requests
 from bs4 import BeautifulSoup
-from datetime import datetime
+from http_fetcher import HttpCache, HttpFetcher
+from watermark import Watermark, is_over, merge_events
+from datetime import datetime, timezone
 import re
 import sys
 import logging
@@ -10,9 +13,15 @@ import logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%y%m%d %H:%M:%S')
 logger = logging.getLogger()
 
+try:
+    import ijson  # decodes the incidents one by one instead of loading the whole page
+except ImportError:
+    ijson = None
+
 UNWANT_IMPACT = ['maintenance']  # , 'none']
 PAGE_RANGE = range(1, 41)
 BLANK_COUNTER_LIMIT = 3
+PAGE_PREFETCH = 4  # number of history pages fetched ahead of the one we parse
 REQUEST_HEADERS = {  # to pretend to be a browser
     'Cache-Control': 'max-age=0',
     'Upgrade-Insecure-Requests': '1',
@@ -25,27 +34,102 @@ REQUEST_HEADERS = {  # to pretend to be a browser
 }
 
 
+FETCHER = HttpFetcher(headers=REQUEST_HEADERS, cache=HttpCache())  # shared by all the scrapers, so they share the connections and the cache
+
+
+def iter_api_incidents(stream):
+    """
+    :param stream: a binary file object of a statuspage api payload, {"page": {...}, "incidents": [...]}
+    :return: a generator of the incident dictionaries of the payload. With ijson the payload is decoded incident by incident
+    """
+    if ijson is not None:
+        yield from ijson.items(stream, 'incidents.item', use_float=True)
+    else:
+        yield from json.load(stream).get('incidents', [])
+
+
+def parse_api_time(text):
+    """
+    :param text: an ISO 8601 time of the statuspage api, or None
+    :return: the time as a datetime in UTC, or None
+
+    example:
+    input: '2019-06-27T06:13:00.000-07:00'
+    output: datetime(2019, 6, 27, 13, 13, tzinfo=timezone.utc)
+    """
+    if not text:
+        return None
+    return datetime.fromisoformat(text.replace('Z', '+00:00')).astimezone(timezone.utc)
+
+
+def get_group_names(components):
+    """
+    :param components: the component dictionaries of a statuspage components.json (or summary.json) payload
+    :return: a dictionary of the id of every group component to its name
+    """
+    return {component['id']: component['name'] for component in components if component.get('group')}
+
+
+def affected_components_text(components, group_names):
+    """
+    :param components: the component dictionaries of an incident of the statuspage api
+    :param group_names: a dictionary of group id to group name, see get_group_names
+    :return: the text of the affected components the way the incident page shows it, the components of a group in brackets after the group name
+
+    example:
+    input: [{'name': 'Paris', 'group_id': 'g1'}, {'name': 'London', 'group_id': 'g1'}, {'name': 'API'}], {'g1': 'Europe'}
+    output: 'This incident affected: Europe (Paris, London) and API'
+    """
+    groups = {}  # group name (None for the components without group): component names, in the order of the incident
+    for component in components:
+        if component.get('group') and component['id'] in group_names:  # a group itself, it shows through its components
+            groups.setdefault(component['name'], [])
+            continue
+        groups.setdefault(group_names.get(component.get('group_id')), []).append(component['name'])
+
+    parts = [f'{group} ({", ".join(names)})' if group and names else group or ', '.join(names) for group, names in groups.items()]
+    text = ' and '.join(parts) if len(parts) <= 2 else f'{", ".join(parts[:-1])}, and {parts[-1]}'
+    return f'This incident affected: {text}'
+
+
 class StatusPageScraper(metaclass=ABCMeta):
-    def __init__(self, name):
+    def __init__(self, name, fetcher=None):
         self.provider = name
+        self.fetcher = fetcher or FETCHER
         self.result_path = f'data/{name.lower()}_outage.json'
         self.events = []
+        self.group_names = {}  # group id: group name, for the components of the api incidents
+        self.watermark = Watermark(name, result_path=self.result_path)  # the incidents we already have, paging stops when we reach them
 
         # if get_incidents returns a few 'none' in a row, then we conclude that there is no more information from this page on.
         self.blank_counter = 0
         self.time_redundant = ['UTC', 'PST', 'PDT', 'th', 'TH', '(', ')']  # in the time text, there are some redundant word that needs to be delete
 
-    @staticmethod
-    def get_incidents_and_year(link):
+    def get(self, link):
+        """
+        :param link: a full url
+        :return: the response of the url. All the requests of the scrapers go through the fetcher, the pages that were prefetched are not requested
+        again
+        """
+        return self.fetcher.get(link)
+
+    def get_incidents_and_year(self, link):
         """
         :param link: a full url that lead to a history page of the provider using statuspage.
         :return: this function accesses the link and retrieve the incident dictionaries, put them in a list, return the list along with the
-        year(string) if the page has zero incident, return None
+        year(string) if the page has zero incident, return None. A page that did not change since the last run is not parsed again
+        """
+        return tuple(self.fetcher.cached_parse(self.get(link), self.parse_history_page, 'statuspage.history'))
+
+    @staticmethod
+    def parse_history_page(response):
+        """
+        :param response: the response of a history page
+        :return: the incident dictionaries of the page, the year(string) and a flag telling if the page has even one incident
         """
         incident_flag = False  # a flag to check if this page has even one incident, if so, it will be set to True
         result_incidents = []
-        html = requests.get(link, headers=REQUEST_HEADERS)
-        soup = BeautifulSoup(html.content, 'html.parser')
+        soup = BeautifulSoup(response.content, 'html.parser')
         div = soup.find('div', {'data-react-class': 'HistoryIndex'})
 
         data_react_props = div.get('data-react-props')
@@ -119,16 +203,30 @@ class StatusPageScraper(metaclass=ABCMeta):
                 logger.info(f'No more information since page {page - (BLANK_COUNTER_LIMIT + 1)}')
                 break
 
+            # fetch the next history pages in the background while we parse this one
+            self.fetcher.prefetch([f"{self.history_page_head}{next_page}" for next_page in PAGE_RANGE
+                                   if page <= next_page < page + self.page_prefetch])
+
             url = f"{self.history_page_head}{page}"
             incidents, year, incident_flag = self.get_incidents_and_year(url)
+            self.fetcher.discard([url])
 
             # Update blank counter. If we get a non-empty page, we reset the counter. If we get an empty page, add 1.
             self.blank_counter = 0 if incident_flag else self.blank_counter + 1
 
+            # the incidents we already have (and are over) are not scraped again, once we meet one the older pages are known territory
+            reached = any(self.watermark.is_known(incident['code']) for incident in incidents)
+            incidents = [incident for incident in incidents if not self.watermark.is_known(incident['code'])]
+
+            # fetch the detail pages of all the incidents of the page at the same time
+            incident_urls = [f"{self.incident_page_head}{incident['code']}" for incident in incidents]
+            self.fetcher.prefetch(incident_urls)
+
             for incident in incidents:
                 logger.info(f'Now scraping incident: {incident["code"]}')
                 # get duration and start time
                 duration, starttime = self.get_duration_and_starttime(incident=incident, year=year)
+                reached = self.watermark.reached(incident['code'], starttime) or reached
 
                 impact = self.get_impact(incident=incident)
 
@@ -138,13 +236,145 @@ class StatusPageScraper(metaclass=ABCMeta):
                          "duration": duration, "affect_rate": None, "impact": impact, "cause": None, "intensity": None, "time": starttime}
 
                 self.events.append(event)
+                if is_over(event):  # an on-going incident does not move the watermark, it is scraped again next time
+                    self.watermark.update(incident['code'], starttime)
+
+            self.fetcher.discard(incident_urls)
+            if reached:
+                logger.info(f'Reached the watermark of {self.provider} on page {page}')
+                break
+
+    def get_api_duration_and_starttime(self, incident):
+        """
+        :param incident: an incident dictionary of the statuspage api
+        :return: the duration in minutes and the start time in UTC in a fixed format (string). An on-going incident has no resolved_at, like on
+        the history page we return 0 and None
+        """
+        start_time = parse_api_time(incident.get('started_at') or incident.get('created_at'))
+        end_time = parse_api_time(incident.get('resolved_at'))
+        if start_time is None or end_time is None:
+            logger.warning(f'Investagating incident: {self.provider} {incident["id"]}')
+            return 0, None
+        return (end_time - start_time).total_seconds() / 60, datetime.strftime(start_time, '%Y-%m-%d %H:%M')
+
+    def get_api_location_service_and_provider_type(self, incident):
+        """
+        :param incident: an incident dictionary of the statuspage api
+        :return: the same as get_location_service_and_provider_type, but from the components of the incident instead of its page. The component
+        names are joined under the names of their groups the way the incident page shows them, so that the same parse_affected_components is used
+        """
+        names = [component['name'] for component in incident.get('components') or []]
+        if not names:
+            logger.warning(f'No location and service in incident: {self.provider} {incident["id"]}')
+            return [], None, self.default_provider_type
+        return self.parse_affected_components(affected_components_text(incident['components'], self.group_names))
+
+    def get_api_group_names(self, source=None):
+        """
+        :param source: path of a saved components.json payload, None to request it
+        :return: the dictionary of group id to group name of the page, empty if the components cannot be read (the components are then listed
+        without their groups)
+        """
+        if source is not None:
+            with open(source, 'rb') as f:
+                return get_group_names(json.load(f).get('components', []))
+
+        response = self.get(self.api_components_url)
+        if not response.ok:
+            logger.warning(f'Fail to get the components of {self.provider}: {response.status_code}')
+            return {}
+        return self.fetcher.cached_parse(response, lambda r: get_group_names(json.loads(r.content).get('components', [])), 'statuspage.groups')
+
+    def get_api_pages(self, sources=None):
+        """
+        :param sources: a list of paths of saved api payloads, None to request the pages of the api until a page has no new incident
+        :return: a generator of the list of incidents of every page, without the incidents of the previous pages. The api answers a page past the
+        last one with the last page again, so a page without new incident ends the paging
+        """
+        seen = set()
+        for page, incidents in enumerate(self.iter_api_payloads(sources), 1):
+            new_incidents = [incident for incident in incidents if incident['id'] not in seen]
+            if not new_incidents:
+                logger.info(f'No more information since page {page - 1}')
+                return
+            seen.update(incident['id'] for incident in new_incidents)
+            yield new_incidents
+
+    def iter_api_payloads(self, sources=None):
+        """
+        :param sources: a list of paths of saved api payloads, None to request the pages of the api
+        :return: a generator of the list of incidents of every payload
+        """
+        if sources is not None:
+            for path in sources:
+                with open(path, 'rb') as f:
+                    yield list(iter_api_incidents(f))
+            return
+
+        for page in PAGE_RANGE:
+            self.fetcher.prefetch([f"{self.api_page_head}{next_page}" for next_page in PAGE_RANGE
+                                   if page <= next_page < page + self.page_prefetch])
+            url = f"{self.api_page_head}{page}"
+            incidents = self.fetcher.cached_parse(self.get(url), lambda response: list(iter_api_incidents(io.BytesIO(response.content))),
+                                                  'statuspage.api')
+            self.fetcher.discard([url])
+            yield incidents
+
+    def scrape_api(self, sources=None, components_source=None):
+        """
+        :param sources: a list of paths of saved api payloads (like incidents.json?page=1), None to request the api
+        :param components_source: path of a saved components.json payload, None to request it. It gives the names of the component groups
+        :return: Iterate all pages of the statuspage json api and append a dictionary to self.events for every incident. Unlike scrape, no page is
+        parsed as html, the fields are mapped from the api payload. Like scrape, the paging stops at the page where we reach the watermark
+        """
+        self.group_names = self.get_api_group_names(components_source)
+        for incidents in self.get_api_pages(sources):
+            reached = False
+            for incident in incidents:
+                if self.watermark.is_known(incident['id']):
+                    reached = True
+                    continue
+                if incident.get('impact') in UNWANT_IMPACT:
+                    continue
+                duration, starttime = self.get_api_duration_and_starttime(incident)
+                reached = self.watermark.reached(incident['id'], starttime) or reached
+
+                impact = self.get_impact(incident=incident)
+
+                location, service, provider_type = self.get_api_location_service_and_provider_type(incident)
+
+                event = {'issue': incident['id'], "provider_type": provider_type, "provider": self.provider, "service": None, "location": location,
+                         "duration": duration, "affect_rate": None, "impact": impact, "cause": None, "intensity": None, "time": starttime}
+
+                self.events.append(event)
+                if is_over(event):  # an on-going incident does not move the watermark, it is scraped again next time
+                    self.watermark.update(incident['id'], starttime)
+
+            if reached:
+                logger.info(f'Reached the watermark of {self.provider}')
+                break
+
+    @property
+    def page_prefetch(self):
+        """
+        :return: number of pages fetched ahead. When we have a watermark, an incremental run needs a page or two, so we do not fetch ahead
+        """
+        return PAGE_PREFETCH if self.watermark.time() is None else 1
+
+    @property
+    def api_page_head(self):
+        return self.history_page_head.replace('/history?page=', '/api/v2/incidents.json?page=')
+
+    @property
+    def api_components_url(self):
+        return self.history_page_head.replace('/history?page=', '/api/v2/components.json')
 
     def write_json(self):
         """
-        :return: Takes the list events and output it as a json file
+        :return: Merge the list events into the json file and save the watermark, so the next run starts from here
         """
-        with open(self.result_path, 'w') as f:
-            json.dump(self.events, f)
+        merge_events(self.result_path, self.events)
+        self.watermark.save()
 
     @property
     @abstractmethod
@@ -156,8 +386,28 @@ class StatusPageScraper(metaclass=ABCMeta):
     def incident_page_head(self):
         pass
 
-    @abstractmethod
     def get_location_service_and_provider_type(self, hash_code):
+        """
+        :param hash_code: a string that represents an incident, we use it to generate the url of the incident page
+        :return: the locations (list of string), the service and the provider type of the incident, see parse_incident_page. An incident page
+        that did not change since the last run is not parsed again
+        """
+        response = self.get(f"{self.incident_page_head}{hash_code}")
+        return tuple(self.fetcher.cached_parse(response, lambda r: self.parse_incident_page(r, hash_code), self.incident_namespace))
+
+    @property
+    def incident_namespace(self):
+        """
+        :return: the name of parse_incident_page in the parse cache, it should change with anything besides the page that the result depends on
+        """
+        return f'{self.provider}.incident'
+
+    @abstractmethod
+    def parse_incident_page(self, response, hash_code):
+        pass
+
+    @abstractmethod
+    def parse_affected_components(self, text):
         pass
 
 
@@ -165,28 +415,35 @@ class CloudflareScraper(StatusPageScraper):
     history_page_head = 'https://www.cloudflarestatus.com/history?page='
     incident_page_head = 'https://www.cloudflarestatus.com/incidents/'
     location_regex = re.compile(r'[,(](.*?) - \([A-Z]+\)')
+    default_provider_type = 'INFRASTRUCTURE_SERVICE_DNS'
 
-    def get_location_service_and_provider_type(self, hash_code):
+    def parse_incident_page(self, response, hash_code):
         """
-        :param hash_code: a string that represents a Cloudflare incident, we use it to generate the url of the incident page
-        :return: This function access the incident page, retrieve the location affected and check if 'CDN' in the text (to decide provider_type).
+        :param response: the response of the incident page
+        :param hash_code: a string that represents a Cloudflare incident, we use it in the warnings
+        :return: This function parses the incident page, retrieve the location affected and check if 'CDN' in the text (to decide provider_type).
         We return the locations as a list of string and a string of provider_type
         """
-        link = f"{self.incident_page_head}{hash_code}"
-        response = requests.get(link, headers=REQUEST_HEADERS)
         soup = BeautifulSoup(response.content, 'html.parser')
 
         affected_component = soup.find('div', {'class': "components-affected font-small color-secondary border-color"})
         if not affected_component:
             logger.warning(f'No location and service in incident: {self.provider} {hash_code}')
-            return [], None, 'INFRASTRUCTURE_SERVICE_DNS'
+            return [], None, self.default_provider_type
+
+        return self.parse_affected_components(affected_component.text)
 
-        if 'CDN' in affected_component.text:
+    def parse_affected_components(self, text):
+        """
+        :param text: the text of the affected components of an incident
+        :return: the locations as a list of string, no service, and the provider_type (CDN if 'CDN' is in the text)
+        """
+        if 'CDN' in text:
             result_provider_type = 'INFRASTRUCTURE_SERVICE_CONTENT_DELIVERY_NETWORK'
         else:
             result_provider_type = 'INFRASTRUCTURE_SERVICE_DNS'
 
-        result_location = self.location_regex.findall(affected_component.text)
+        result_location = self.location_regex.findall(text)
         result_location = [place.strip() for place in result_location]
 
         return result_location, None, result_provider_type
@@ -196,15 +453,23 @@ class SAPScraper(StatusPageScraper):
     history_page_head = 'https://sapcp.statuspage.io/history?page='
     incident_page_head = 'https://sapcp.statuspage.io/incidents/'
     redundant_service_regex = re.compile(r'\[.*?\]')  # in service, there are some redundant text that needs to be substitute
+    default_provider_type = 'INFRASTRUCTURE_SERVICE_HOSTING'
+
+    def __init__(self, name, fetcher=None):
+        super().__init__(name, fetcher)
+        self.component_sets = {}  # link: the location set and service set of the history page, it is the same for every incident
 
     def get_location_set_and_service_set(self, link):
         """
         :param link: Link to the SAP history page, where we can find the filter options and generate location set and service set
         :return: Two set
         """
+        if link in self.component_sets:
+            return self.component_sets[link]
+
         result_location_set = []
         result_service_set = []
-        html = requests.get(link, headers=REQUEST_HEADERS)
+        html = self.get(link)
         soup = BeautifulSoup(html.content, 'html.parser')
         div = soup.find('div', {'data-react-class': 'HistoryIndex'})
         data_react_props = div.get('data-react-props')
@@ -221,31 +486,49 @@ class SAPScraper(StatusPageScraper):
             # The following line handles redundant text in the service text, i.e "App Engine [India] - Asia" --> "App Engine"
             result_service_set = [self.redundant_service_regex.sub('', service).split('-')[0].strip() for service in result_service_set]
 
-        return set(result_location_set), set(result_service_set)
+        self.component_sets[link] = set(result_location_set), set(result_service_set)
+        return self.component_sets[link]
 
-    def get_location_service_and_provider_type(self, hash_code):
+    @property
+    def incident_namespace(self):
+        """
+        :return: the name of parse_incident_page in the parse cache, with the hash of the location set and the service set it matches the page
+        against, so an incident page is parsed again when the components of the history page change
         """
+        location_set, service_set = self.get_location_set_and_service_set(f'{self.history_page_head}1')
+        digest = hashlib.sha1(json.dumps([sorted(location_set), sorted(service_set)]).encode()).hexdigest()
+        return f'{self.provider}.incident.{digest}'
+
+    def parse_incident_page(self, response, hash_code):
+        """
+        :param response: the response of the incident page
         :param hash_code: The hash code leading to the incident detail page
         :return: A list of location and a list of service
         """
-        location_set, service_set = self.get_location_set_and_service_set(f'{self.history_page_head}1')
-        result_location = []
-        result_service = []
-        link = f"{self.incident_page_head}{hash_code}"
-        response = requests.get(link, headers=REQUEST_HEADERS)
         soup = BeautifulSoup(response.content, 'html.parser')
 
         affected_component = soup.find('div', {'class': "components-affected font-small color-secondary border-color"})
         if not affected_component:
             logger.warning(f'No location and service in incident: {self.provider} {hash_code}')
-            return result_location, result_service, "INFRASTRUCTURE_SERVICE_HOSTING"
+            return [], [], self.default_provider_type
+
+        return self.parse_affected_components(affected_component.text)
+
+    def parse_affected_components(self, text):
+        """
+        :param text: the text of the affected components of an incident
+        :return: A list of location and a list of service, the ones of the history page that appear in the text
+        """
+        location_set, service_set = self.get_location_set_and_service_set(f'{self.history_page_head}1')
+        result_location = []
+        result_service = []
 
         for location in location_set:
-            if location in affected_component.text:
+            if location in text:
                 result_location.append(location)
 
         for service in service_set:
-            if service in affected_component.text:
+            if service in text:
                 result_service.append(service)
 
         return result_location, result_service, "INFRASTRUCTURE_SERVICE_HOSTING"
@@ -256,6 +539,7 @@ class OracleScraper(StatusPageScraper):
     incident_page_head = 'https://ocistatus.oraclecloud.com/incidents/'
     start_time_regex = re.compile(r'start time: (.*?)utc')
     end_time_regex = re.compile(r'end time: (.*?)utc')
+    default_provider_type = 'INFRASTRUCTURE_SERVICE_HOSTING'
 
     @staticmethod
     def get_impact(incident):
@@ -279,17 +563,49 @@ class OracleScraper(StatusPageScraper):
         if result_duration > 0:
             return result_duration, result_starttime
 
-        link = f"{self.incident_page_head}{incident['code']}"
-        response = requests.get(link, headers=REQUEST_HEADERS)
+        response = self.get(f"{self.incident_page_head}{incident['code']}")
+        return tuple(self.fetcher.cached_parse(response, lambda r: self.parse_incident_duration(r, incident['code']), f'{self.provider}.duration'))
+
+    def parse_incident_duration(self, response, hash_code):
+        """
+        :param response: the response of the incident page
+        :param hash_code: the code of the incident
+        :return: the duration and the starttime written in the update that has the start time and the end time, or -1 and None
+        """
         soup = BeautifulSoup(response.content, 'html.parser')
         textblock = soup.find(lambda tag: tag.name == 'div' and 'start time' in tag.text.lower(), attrs={'class': "update-body font-regular"})
         if not textblock:
-            logger.warning(f'No duration in incident: {self.provider} {incident["code"]}')
+            logger.warning(f'No duration in incident: {self.provider} {hash_code}')
             return -1, None
 
-        # If we can find a textblock, proceed, but Oracle staff has no consistency regarding upper or lower case
-        start_time = self.start_time_regex.findall(textblock.text.lower())
-        end_time = self.end_time_regex.findall(textblock.text.lower())
+        return self.parse_duration_and_starttime(textblock.text, hash_code)
+
+    def get_api_duration_and_starttime(self, incident):
+        """
+        :param incident: an incident dictionary of the statuspage api
+        :return: the same as get_duration_and_starttime: if the duration from the api times is 0, we read the start and end time in the first
+        update that has them, like parse_incident_duration
+        """
+        result_duration, result_starttime = super().get_api_duration_and_starttime(incident)
+        if result_duration > 0:
+            return result_duration, result_starttime
+
+        textblock = next((body for body in self.get_api_update_bodies(incident) if 'start time' in body.lower()), None)
+        if not textblock:
+            logger.warning(f'No duration in incident: {self.provider} {incident["id"]}')
+            return -1, None
+
+        return self.parse_duration_and_starttime(textblock, incident['id'])
+
+    def parse_duration_and_starttime(self, text, code):
+        """
+        :param text: the text of an update that contains the start time and the end time of an incident
+        :param code: the code of the incident
+        :return: a duration in minutes and a starttime
+        """
+        # Oracle staff has no consistency regarding upper or lower case
+        start_time = self.start_time_regex.findall(text.lower())
+        end_time = self.end_time_regex.findall(text.lower())
 
         # if both regex findall functions get their own string, proceed to calculate duration
         if start_time and end_time:
@@ -302,7 +618,7 @@ class OracleScraper(StatusPageScraper):
             start_time = start_time[0].strip()
 
         else:
-            logger.warning(f'No duration in incident {self.provider} {incident["code"]}')
+            logger.warning(f'No duration in incident {self.provider} {code}')
             return -1, None
 
         for word in self.time_redundant:
@@ -319,46 +635,97 @@ class OracleScraper(StatusPageScraper):
 
         return result, datetime.strftime(start_time, '%Y-%m-%d %H:%M')
 
-    def get_location_service_and_provider_type(self, hash_code):
+    def parse_incident_page(self, response, hash_code):
         """
-        :param hash_code: a string that represents a Oracle incident, we use it to generate the url of the incident page
-        :return: This function access the incident page, retrieve the service and location affected, get the provider type. We return three variates,
+        :param response: the response of the incident page
+        :param hash_code: a string that represents a Oracle incident, we use it in the warnings
+        :return: This function parses the incident page, retrieve the service and location affected, get the provider type. We return three variates,
         result_service(string) and result_location(list of string), and result_provider_type(string)
         """
-        link = f"{self.incident_page_head}{hash_code}"
-        response = requests.get(link, headers=REQUEST_HEADERS)
         soup = BeautifulSoup(response.content, 'html.parser')
 
         affected_component = soup.find('div', {'class': "components-affected font-small color-secondary border-color"})
 
         if affected_component:
-            result_service = re.findall(r':(.*)\(', affected_component.text)[0].strip()
-            result_location = re.findall(r'\((.*)\)', affected_component.text)[0].split('(')[-1].replace('region', '').split(',')
-            result_location = [place.strip() for place in result_location]
+            return self.parse_affected_components(affected_component.text)
+
+        textblock = soup.find(lambda tag: tag.name == 'div' and 'service' in tag.text.lower() and 'region' in tag.text.lower(),
+                              attrs={'class': "update-body font-regular"})
+        if not textblock:
+            logger.warning(f'No location and service in incident: {self.provider} {hash_code}')
+            return [], None, self.default_provider_type
+
+        return self.parse_update_text(textblock.text, hash_code)
+
+    def get_api_location_service_and_provider_type(self, incident):
+        """
+        :param incident: an incident dictionary of the statuspage api
+        :return: the same as get_location_service_and_provider_type, like parse_incident_page from the components of the incident or else from
+        its updates
+        """
+        if incident.get('components'):
+            return super().get_api_location_service_and_provider_type(incident)
+
+        textblock = next((body for body in self.get_api_update_bodies(incident) if 'service' in body.lower() and 'region' in body.lower()), None)
+        if not textblock:
+            logger.warning(f'No location and service in incident: {self.provider} {incident["id"]}')
+            return [], None, self.default_provider_type
+
+        return self.parse_update_text(textblock, incident['id'])
 
+    @staticmethod
+    def get_api_update_bodies(incident):
+        """
+        :param incident: an incident dictionary of the statuspage api
+        :return: the texts of the updates of the incident, newest first, the order of the incident page
+        """
+        return [update.get('body') or '' for update in incident.get('incident_updates') or []]
+
+    def parse_affected_components(self, text):
+        """
+        :param text: the text of the affected components of an incident
+        :return: the locations, the service and the provider type
+        """
+        result_service = re.findall(r':(.*)\(', text)
+        result_location = re.findall(r'\((.*)\)', text)
+        if not result_service or not result_location:
+            logger.warning(f'Cannot parse the affected components of {self.provider}: {text}')
+            return [], None, self.default_provider_type
+
+        result_service = result_service[0].strip()
+        result_location = result_location[0].split('(')[-1].replace('region', '').split(',')
+        result_location = [place.strip() for place in result_location]
+        return self.to_result(result_location, result_service)
+
+    def parse_update_text(self, text, hash_code):
+        """
+        :param text: the text of an update that lists the services and the regions of an incident
+        :param hash_code: the code of the incident
+        :return: the locations, the service and the provider type
+        """
+        result_service = re.findall(r'services?\(?s?\)?: (.*?)region', text.lower())
+        if result_service:
+            result_service = result_service[0].strip()
         else:
-            textblock = soup.find(lambda tag: tag.name == 'div' and 'service' in tag.text.lower() and 'region' in tag.text.lower(),
-                                  attrs={'class': "update-body font-regular"})
-            if not textblock:
-                logger.warning(f'No location and service in incident: {self.provider} {hash_code}')
-                return [], None, 'INFRASTRUCTURE_SERVICE_HOSTING'
-
-            result_service = re.findall(r'services?\(?s?\)?: (.*?)region', textblock.text.lower())
-            if result_service:
-                result_service = result_service[0].strip()
-            else:
-                result_service = None
-                logger.warning(f"No service in incident {self.provider} {hash_code}")
+            result_service = None
+            logger.warning(f"No service in incident {self.provider} {hash_code}")
 
-            result_location = re.findall(r'[Rr][Ee][Gg][Ii][Oo][Nn]S?\(?S?\)?: (.*?)[B-Z]', textblock.text)  # in case "region: All", 'A' is not end.
-            if result_location:
-                result_location = result_location[0].split(',')
-                result_location = [place.strip() for place in result_location]
+        result_location = re.findall(r'[Rr][Ee][Gg][Ii][Oo][Nn]S?\(?S?\)?: (.*?)[B-Z]', text)  # in case "region: All", 'A' is not end.
+        if result_location:
+            result_location = result_location[0].split(',')
+            result_location = [place.strip() for place in result_location]
 
-            else:
-                result_location = []
-                logger.info(f"No location in incident {self.provider} {hash_code}")
+        else:
+            result_location = []
+            logger.info(f"No location in incident {self.provider} {hash_code}")
 
+        return self.to_result(result_location, result_service)
+
+    @staticmethod
+    def to_result(result_location, result_service):
+        """
+        :return: the locations, the service and the provider type, which is DNS if the service is a DNS service
+        """
         result_provider_type = 'INFRASTRUCTURE_SERVICE_DNS' if result_service and 'DNS' in result_service else 'INFRASTRUCTURE_SERVICE_HOSTING'
         return result_location, result_service, result_provider_type
 
@@ -368,6 +735,7 @@ if __name__ == '__main__':
     sap_scraper = SAPScraper(name='SAP')
     oracle_scraper = OracleScraper(name='Oracle')
 
-    cloudflare_scraper.scrape()
-    sap_scraper.scrape()
-    oracle_scraper.scrape()
+    # the json api of statuspage, no html page is parsed (except the SAP history page that lists its locations and services)
+    for scraper in [cloudflare_scraper, sap_scraper, oracle_scraper]:
+        scraper.scrape_api()
+        scraper.write_json()
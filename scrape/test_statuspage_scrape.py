@@ -0,0 +1,82 @@
+import html
+import json
+from types import SimpleNamespace
+
+import statuspage_scrape
+from watermark import Watermark
+
+START_UPDATE = 'Start time: June 27, 2019 13:13 UTC End time: June 27, 2019 14:30 UTC'  # the newest update, first on the page
+EARLY_START_UPDATE = 'Start time: June 27, 2019 13:13 UTC End time: June 27, 2019 13:40 UTC'
+REGION_UPDATE = 'Service: Networking Region: us-ashburn-1 Impact: none'
+EARLY_REGION_UPDATE = 'Service: Compute Region: us-phoenix-1 Impact: none'
+
+INCIDENTS = [  # an incident with components and one without, both with the same start and end time in the api
+    {'id': 'abc123', 'impact': 'minor', 'created_at': '2019-06-27T13:13:00.000Z', 'resolved_at': '2019-06-27T13:13:00.000Z',
+     'components': [{'id': 'c1', 'name': 'us-ashburn-1 region', 'group_id': 'g1'}, {'id': 'c2', 'name': 'us-phoenix-1 region', 'group_id': 'g1'}],
+     'incident_updates': [{'body': f'{START_UPDATE} {REGION_UPDATE}'}, {'body': f'{EARLY_START_UPDATE} {EARLY_REGION_UPDATE}'}]},
+    {'id': 'def456', 'impact': 'none', 'created_at': '2019-06-26T08:00:00.000Z', 'resolved_at': '2019-06-26T08:00:00.000Z', 'components': [],
+     'incident_updates': [{'body': f'{START_UPDATE} {REGION_UPDATE}'}, {'body': f'{EARLY_START_UPDATE} {EARLY_REGION_UPDATE}'}]},
+]
+COMPONENTS = [{'id': 'g1', 'name': 'Compute', 'group': True}, {'id': 'c1', 'name': 'us-ashburn-1 region', 'group_id': 'g1'},
+              {'id': 'c2', 'name': 'us-phoenix-1 region', 'group_id': 'g1'}]
+TIMESTAMPS = {'abc123': 'Jun <var data-var="date">27</var>, <var data-var="time">13:13</var> - <var data-var="time">13:13</var> UTC',
+              'def456': 'Jun <var data-var="date">26</var>, <var data-var="time">08:00</var> - <var data-var="time">08:00</var> UTC'}
+
+
+def history_page(incidents):
+    props = {'months': [{'year': 2019, 'incidents': [{'code': incident['id'], 'impact': incident['impact'], 'timestamp': TIMESTAMPS[incident['id']]}
+                                                     for incident in incidents]}]}
+    return f'<div data-react-class="HistoryIndex" data-react-props="{html.escape(json.dumps(props))}"></div>'
+
+
+def incident_page(incident):
+    page = ''
+    if incident['components']:
+        page += ('<div class="components-affected font-small color-secondary border-color">'
+                 f'{statuspage_scrape.affected_components_text(incident["components"], {"g1": "Compute"})}</div>')
+    for update in incident['incident_updates']:
+        page += f'<div class="update-body font-regular">{update["body"]}</div>'
+    return page
+
+
+class FakeFetcher:
+    """
+    A fetcher that answers the pages from a dictionary of url to html, every other history page is empty
+    """
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url):
+        return SimpleNamespace(content=self.pages.get(url, history_page([])).encode(), ok=True, status_code=200)
+
+    @staticmethod
+    def cached_parse(response, parse, namespace):
+        return parse(response)
+
+    def prefetch(self, urls):
+        pass
+
+    def discard(self, urls):
+        pass
+
+
+def test_oracle_html_and_api_agree(tmp_path, monkeypatch):
+    monkeypatch.setattr(statuspage_scrape, 'Watermark', lambda name, result_path: Watermark(name, path=str(tmp_path / 'none.db')))
+    head = statuspage_scrape.OracleScraper.history_page_head
+    pages = {f'{head}1': history_page(INCIDENTS)}
+    pages.update({f'{statuspage_scrape.OracleScraper.incident_page_head}{incident["id"]}': incident_page(incident) for incident in INCIDENTS})
+
+    html_scraper = statuspage_scrape.OracleScraper('Oracle', fetcher=FakeFetcher(pages))
+    html_scraper.scrape()
+
+    api_path = tmp_path / 'incidents.json'
+    api_path.write_text(json.dumps({'page': {}, 'incidents': INCIDENTS}))
+    components_path = tmp_path / 'components.json'
+    components_path.write_text(json.dumps({'components': COMPONENTS}))
+    api_scraper = statuspage_scrape.OracleScraper('Oracle', fetcher=FakeFetcher({}))
+    api_scraper.scrape_api(sources=[str(api_path)], components_source=str(components_path))
+
+    assert api_scraper.events == html_scraper.events
+    # the components come before the updates, and the newest update comes first
+    assert [(event['issue'], event['location'], event['duration'], event['time']) for event in api_scraper.events] == [
+        ('abc123', ['us-ashburn-1', 'us-phoenix-1'], 77, '2019-06-27 13:13'), ('def456', ['us-ashburn-1'], 77, '2019-06-27 13:13')]
@@ -0,0 +1,188 @@
+import calendar
+import json
+import os
+import sqlite3 as db
+import time
+from datetime import datetime
+import logging
+logger = logging.getLogger()
+
+WATERMARK_DB_PATH = '../distribution/db/event_catalog.db'  # the event catalog written by distribution/db_generator.py
+EVENT_CATALOG_TABLE = 'event_catalog'
+WATERMARK_TABLE = 'scrape_watermark'  # latest issue and time scraped per provider and scope, including the events too short for the catalog
+TIME_FORMAT = '%Y-%m-%d %H:%M'  # format of the time the scrapers write
+OVERLAP = 2 * 24 * 3600  # seconds, incidents that started less than this before the watermark are scraped again, they may have been on-going
+FULL_SCRAPE = False  # if True, ignore the watermarks and scrape every page
+
+
+def to_epoch(time_text):
+    """
+    :param time_text: a start time in TIME_FORMAT, or None
+    :return: the number of seconds since 1970-01-01, or None
+
+    example:
+    input: '2019-06-02 23:15'
+    output: 1559517300
+    """
+    if not isinstance(time_text, str) or not time_text:
+        return None
+    return calendar.timegm(datetime.strptime(time_text, TIME_FORMAT).timetuple())
+
+
+def read_events(result_path):
+    """
+    :param result_path: path of the json file of a scraper
+    :return: the list of events in the file, an empty list if the file does not exist
+    """
+    if not os.path.exists(result_path):
+        return []
+    with open(result_path, 'r') as f:
+        return json.load(f)
+
+
+def is_over(event):
+    """
+    :param event: an event of a scraper
+    :return: True if the event has a start time and a positive duration. The scrapers save an on-going event with a duration of 0 (or -1 when
+    the duration cannot be read) and no start time
+    """
+    return bool(event.get('time')) and (event.get('duration') or 0) > 0
+
+
+def merge_events(result_path, events):
+    """
+    :param result_path: path of the json file of a scraper
+    :param events: the events of this run
+    :return: write the events of the file merged with the events of this run. An event of this run replaces the event of the file with the same
+    issue (it may have been on-going), the other events of the file are kept, so an incremental run does not lose the history
+    """
+    new_issues = {event['issue'] for event in events}
+    result = [event for event in read_events(result_path) if event['issue'] not in new_issues] + events
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+    logger.info(f'{len(events)} events merged into {result_path}, {len(result)} events in total')
+
+
+class Watermark:
+    def __init__(self, provider, path=WATERMARK_DB_PATH, result_path=None, full_scrape=FULL_SCRAPE):
+        """
+        :param provider: the provider name, as in the provider column of the event catalog
+        :param path: path of the event catalog db, the watermarks are stored in it
+        :param result_path: path of the json file of the scraper, its events count as known too (they may not be ingested in the db yet). The
+        on-going events (saved without start time or with a duration of 0 or less) are not known, so they are scraped again until they are over
+        :param full_scrape: if True, nothing is known and every page is scraped, the watermarks are still saved
+        The watermark of a scope (a service for GCP, '' for the whole provider) is the latest issue and start time scraped. It is read from the
+        watermark table, and else from the latest event of the event catalog and of the json file.
+        """
+        self.provider = provider
+        self.path = path
+        self.full_scrape = full_scrape
+        self.known_issues = set()
+        self.times = {}  # scope: latest start time (epoch)
+        self.issues = {}  # scope: latest issue
+        self.changed = set()  # scopes updated in this run
+
+        if os.path.exists(path):
+            with db.connect(path) as conn:
+                conn.execute(sql_command_create_watermark_table(WATERMARK_TABLE))
+                for scope, issue, start_time in conn.execute(f'SELECT scope, issue, time FROM {WATERMARK_TABLE} WHERE provider = ?', (provider,)):
+                    self.issues[scope] = issue
+                    self.times[scope] = start_time
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (EVENT_CATALOG_TABLE,)).fetchone():
+                    for issue, start_time in conn.execute(f'SELECT issue, time FROM {EVENT_CATALOG_TABLE} WHERE provider = ? AND time IS NOT NULL',
+                                                          (provider,)):
+                        self.known_issues.add(issue)
+                        self.advance_time('', start_time)
+
+        if result_path is not None:
+            for event in read_events(result_path):
+                if not is_over(event):
+                    continue
+                self.known_issues.add(str(event['issue']))
+                self.advance_time('', to_epoch(event.get('time')))
+
+    def advance_time(self, scope, start_time):
+        if start_time is not None and (self.times.get(scope) is None or start_time > self.times[scope]):
+            self.times[scope] = start_time
+
+    def time(self, scope=''):
+        """
+        :return: the latest start time (epoch) scraped in the scope, None if nothing is known
+        """
+        return None if self.full_scrape else self.times.get(scope)
+
+    def issue(self, scope=''):
+        """
+        :return: the latest issue scraped in the scope, None if nothing is known
+        """
+        return None if self.full_scrape else self.issues.get(scope)
+
+    def is_known(self, issue):
+        """
+        :return: True if the issue is already in the event catalog or in the json file, and is over
+        """
+        return not self.full_scrape and str(issue) in self.known_issues
+
+    def reached(self, issue, time_text, scope=''):
+        """
+        :param issue: an issue of the page being scraped
+        :param time_text: its start time in TIME_FORMAT, or None
+        :return: True if the issue is known or started more than OVERLAP before the watermark, so the older pages are known territory
+        """
+        if self.is_known(issue):
+            return True
+        start_time = to_epoch(time_text)
+        watermark = self.time(scope)
+        return start_time is not None and watermark is not None and start_time < watermark - OVERLAP
+
+    def update(self, issue, time_text=None, scope=''):
+        """
+        :param issue: an issue scraped in this run
+        :param time_text: its start time in TIME_FORMAT, or None
+        :return: move the watermark of the scope to this issue if it is the latest one. Without start time, the issue is compared as a string
+        (the GCP issues, like 'compute19005', are ordered that way)
+        """
+        start_time = to_epoch(time_text)
+        if start_time is not None:
+            if self.times.get(scope) is not None and start_time <= self.times[scope]:
+                return
+        elif self.issues.get(scope) is not None and str(issue) <= self.issues[scope]:
+            return
+        self.issues[scope] = str(issue)
+        self.advance_time(scope, start_time)
+        self.changed.add(scope)
+
+    def save(self):
+        """
+        :return: persist the watermarks updated in this run, in one transaction
+        """
+        if not self.changed:
+            return
+        try:
+            with db.connect(self.path) as conn:
+                conn.execute(sql_command_create_watermark_table(WATERMARK_TABLE))
+                conn.executemany(f"""INSERT INTO {WATERMARK_TABLE}(provider, scope, issue, time, updated_at) VALUES (?, ?, ?, ?, ?)
+                                     ON CONFLICT(provider, scope) DO UPDATE SET issue = excluded.issue, time = excluded.time,
+                                     updated_at = excluded.updated_at""",
+                                 [(self.provider, scope, self.issues.get(scope), self.times.get(scope), int(time.time())) for scope in self.changed])
+        except db.Error:
+            logger.exception(f'Fail to save the watermark of {self.provider} in {self.path}')
+            return
+        logger.info(f'Saved the watermark of {self.provider}: {[(scope, self.issues.get(scope)) for scope in sorted(self.changed)]}')
+        self.changed.clear()
+
+
+def sql_command_create_watermark_table(table_name):
+    """
+    :param table_name: A string of the table name that we want to create
+    :return: A string of sql command that creates the table of the latest issue and start time (epoch) scraped per provider and scope
+    """
+    sql_command = f"""CREATE TABLE IF NOT EXISTS {table_name}(
+                       provider text,
+                       scope text,
+                       issue text,
+                       time integer,
+                       updated_at integer,
+                       PRIMARY KEY(provider, scope)
+                       )"""
+    return sql_command
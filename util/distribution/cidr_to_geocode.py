@@ -1,10 +1,22 @@
 from netaddr import IPNetwork
 import netaddr
-import requests
 import random
+import os
+import sys
 import csv
 import json
+import hashlib
+import time
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from geoip_index import GeoIPIndex
+from geocode_lookup import compile_table
+from json_stream import iter_array_items
+from geolocation_client import GeolocationClient, TokenBucket, RATE_LIMIT
+from location_records import LocationRecords
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../distribution'))
+from provider_catalog import load_provider_catalog
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%y%m%d %H:%M:%S')
 logger = logging.getLogger()
@@ -15,12 +27,21 @@ with open('input/us_state_abbreviations.json', 'r') as f:
 with open('input/server_to_region.json', 'r') as f:
     SERVER_TO_REGION = json.load(f)
 
-with open('input/geocode.json') as f:
+GEOCODE_PATH = 'input/geocode.json'
+with open(GEOCODE_PATH) as f:
     GEOCODE = json.load(f)
 
 IPWHOIS_URL = 'https://pro.ipwhois.io/json'
 IPWHOIS_KEY = 'WD2SYIax4wvAVvY3'
+IPWHOIS_CACHE_PATH = 'cache/ip_location.db'
+GEOIP_CSV_PATH = 'input/geoip.csv'  # optional local GeoIP dump, ip not found in it will be queried from IPWHOIS_URL
 SAMPLE_NUMBER = 20
+IP_RANGES_PATH = 'input/ip_ranges.csv'
+FEED_PATHS = {'amazon': 'input/amazon_ip_ranges.json', 'microsoft': 'input/microsoft_ip_ranges.json'}
+CHECKPOINT_DIR = 'cache/checkpoint'  # finished partitions are saved here so that a restarted run resumes where it stopped
+PARTITION_SIZE = 500  # rows of ip_ranges.csv in one partition
+PIPELINE_WORKERS = os.cpu_count() or 1
+PROGRESS_INTERVAL = 10  # seconds between two progress log lines of the amazon and microsoft feeds
 REQUEST_HEADERS = {  # to pretend to be a browser
     'Cache-Control': 'max-age=0',
     'Upgrade-Insecure-Requests': '1',
@@ -32,33 +53,46 @@ REQUEST_HEADERS = {  # to pretend to be a browser
     'Accept-Language': 'en-US,en;q=0.8,he;q=0.6',
 }
 
+GEOLOCATION_CLIENT = GeolocationClient(url=IPWHOIS_URL, key=IPWHOIS_KEY, cache_path=IPWHOIS_CACHE_PATH, headers=REQUEST_HEADERS)
+
 cidr_to_geocode_map = defaultdict(dict)
-counters = defaultdict(lambda: defaultdict(int))  # to record distribution
+records = LocationRecords()  # to record distribution, one (company, geocode, ip_count, weight) record per located range
 detect = {}  # to record non-ip cidr-to-region map
 
 
 # When trying to get state code from a private ip that we know it is in the US, we will assign a random state code to it based on option
 def generate_location_option():
     """
-    :return: This function reads from the provider_catalog.csv file and use the location columns in it to generate location option for future use. It
-    returns a dictionary
+    :return: This function uses the location columns of the provider_catalog.csv file to generate location option for future use. It returns a
+    dictionary of company to a list of geocodes. The catalog is parsed and indexed only once, and again only if the file changes.
     """
-    result = defaultdict(dict)
     provider_catalog_path = '../../distribution/input/provider_catalog.csv'
+    return load_provider_catalog(provider_catalog_path).company_geocodes(GEOCODE_PATH)
 
-    with open(provider_catalog_path, 'r', encoding='utf-8-sig') as f:
-        provider_catalog = [row for row in csv.DictReader(f)]
 
-    for row in provider_catalog:
-        company = row['company']
-        location = row['location']
+def to_geocode(country_code, region):
+    """
+    :param country_code: 2 digit country code
+    :param region: the region name, only used when the country_code is 'US'
+    :return: 2 digit country code or US +'_'+ 2 digit state code. Raise KeyError if the US region is unknown
 
-        for place in location.replace('.', ',').split(','):
-            place = place.strip()
+    example:
+    input: 'US', 'Arizona'
+    output: 'US_AZ'
+    """
+    if country_code == 'US':
+        return f'US_{US_STATE_ABBREVIATIONS[region]}'
+    return country_code
 
-            result[company][GEOCODE[place]] = 0
 
-    return result
+@lru_cache(maxsize=None)
+def get_geoip_index():
+    """
+    :return: a GeoIPIndex built from the local GeoIP dump at GEOIP_CSV_PATH, or None if there is no such file. The index is built only once.
+    """
+    if not os.path.exists(GEOIP_CSV_PATH):
+        return None
+    return GeoIPIndex.from_csv(GEOIP_CSV_PATH, to_geocode)
 
 
 def get_country_code_from_ip(ip):
@@ -70,50 +104,102 @@ def get_country_code_from_ip(ip):
     input: '192.169.128.0'
     output: 'US_AZ'
     """
-    try:
-        query_url = f'{IPWHOIS_URL}/{ip}?key={IPWHOIS_KEY}'
+    return get_country_codes_from_ips([ip])[0]
+
+
+def get_country_codes_from_ips(ips):
+    """
+    :param ips: a list of ips we want to get country_code from
+    :return: a list of country codes in the same order as ips, empty string for the ip we could not locate. The ips are first looked up in the
+    local GeoIP index, the ones it misses are queried in parallel through GEOLOCATION_CLIENT (which also caches them).
+
+    example:
+    input: ['192.169.128.0', '159.8.198.0']
+    output: ['US_AZ', 'NL']
+    """
+    ips = [str(ip) for ip in ips]
+    geoip_index = get_geoip_index()
+    result = geoip_index.lookup_many(ips) if geoip_index else [''] * len(ips)
+
+    missing = [i for i, country_code in enumerate(result) if not country_code]
+    if not missing:
+        return result
+
+    for i, res_json in zip(missing, GEOLOCATION_CLIENT.query_many([ips[i] for i in missing])):
+        try:
+            if res_json is None:
+                raise Exception('Bad response from ipwhois api')
+
+            result[i] = to_geocode(res_json['country_code'], res_json.get('region'))
+
+        except Exception:
+            logger.warning(f'Could not get location for ip {ips[i]}')
+
+    return result
+
+
+def parse_cidr(cidr):
+    """
+    :param cidr: The cidr text we read from the ip_ranges.csv. It can be a single cidr, several cidrs separated by ',' or a dash ip range
+    :return: a list of IPNetwork objects covering the cidr text. Only the boundaries are parsed, no ip address is enumerated.
 
-        response = requests.get(query_url)
-        res_json = response.json()
-        if not res_json.get('success', False):
-            msg = res_json.get('message', 'Bad response from ipwhois api')
-            raise Exception(msg)
+    example:
+    input: '10.0.0.0 - 10.0.0.255'
+    output: [IPNetwork('10.0.0.0/24')]
+    """
+    if '-' in cidr:
+        # handle the dash ip range issue by converting it to multi-cidr
+        ip_start, ip_end = cidr.split('-', 1)
+        return netaddr.iprange_to_cidrs(ip_start.strip(), ip_end.strip())
 
-        country_code = res_json['country_code']
-        if country_code == 'US':
-            state = US_STATE_ABBREVIATIONS[res_json['region']]
-            country_code = f'US_{state}'
+    # handle the multi-cidr issue by split(',')
+    return [IPNetwork(c.strip()) for c in cidr.split(',')]
 
-        return country_code
 
-    except Exception:
-        logger.warning(f'Could not get location for ip {ip}')
-        return ""
+def count_ip(ipnetworks):
+    """
+    :param ipnetworks: a list of IPNetwork objects
+    :return: the number of ip addresses in all the networks, computed from the prefix length of each network
+    """
+    return sum(ipnetwork.size for ipnetwork in ipnetworks)
 
 
-def get_ip_sample(all_ip, n=SAMPLE_NUMBER):
+def get_ip_at(ipnetworks, offset):
     """
-    :param all_ip: a list of ip addresses that we will sample from
-    :param n: the length of the output sample list of ip addresses, n will be set to 200 if all_ip size is larger than 100000
-    :return: a n-size list of ip addresses.
+    :param ipnetworks: a list of IPNetwork objects, treated as one continuous range of ip addresses
+    :param offset: the position of the ip address we want in that continuous range, starting from 0
+    :return: the ip address (string) at that position
 
     example:
-    input: all_ip = [0,2,3,...,99] n = 10
-    output: [0, 10, 20, 30,...,90]
+    input: [IPNetwork('10.0.0.0/24'), IPNetwork('10.0.2.0/24')], 300
+    output: '10.0.2.44'
     """
-    length = len(all_ip)
+    for ipnetwork in ipnetworks:
+        if offset < ipnetwork.size:
+            return str(netaddr.IPAddress(ipnetwork.first + offset, ipnetwork.version))
+        offset -= ipnetwork.size
+
+    raise IndexError('ip offset out of range')
+
+
+def get_ip_sample(ipnetworks, n=SAMPLE_NUMBER):
+    """
+    :param ipnetworks: a list of IPNetwork objects that we will sample from
+    :param n: the length of the output sample list of ip addresses, n will be set to 200 if the ip count is larger than 100000
+    :return: a n-size list of ip addresses. The samples are picked by offset (first + k * interval), so the networks are never enumerated.
+
+    example:
+    input: ipnetworks = [IPNetwork('10.0.0.0/24')] n = 4
+    output: ['10.0.0.0', '10.0.0.64', '10.0.0.128', '10.0.0.192']
+    """
+    length = count_ip(ipnetworks)
     if length > 100000:
         n = 200
     interval = int(length/n)
     if interval < 1:
-        return all_ip
-    ipsamples = []
-    index = 0
-    while len(ipsamples) < n:
-        ipsamples.append(all_ip[index])
-        index += interval
+        return [get_ip_at(ipnetworks, index) for index in range(length)]
 
-    return ipsamples
+    return [get_ip_at(ipnetworks, k * interval) for k in range(n)]
 
 
 def process_no_country_code(cidr, company):
@@ -122,31 +208,15 @@ def process_no_country_code(cidr, company):
     :param cidr: The cidr we read from the ip_ranges.csv. We will try to get state code and count ip number from this cidr
     :param company: The company that the cidr(s) belong to
     :return: We count the ip number in the cidr(s), sample 10 ip from the cidr to see whether they contain different location, if unified location,
-    we only add it to the global counters, if not, we have to split the ip number according to sample ratio and add them to counters
+    we only add it to the global records, if not, we have to split the ip number according to sample ratio and add them to records
     """
-    if '-' in cidr:
-        # handle the dash ip range issue by converting it to multi-cidr
-        ip, ip_end = cidr.split('-', 1)
-        ip = ip.strip()
-        ip_end = ip_end.strip()
-        ipnetworks = netaddr.iprange_to_cidrs(ip, ip_end)
-
-        ips = [str(ip) for ipnetwork in ipnetworks for ip in ipnetwork]  # all the ip
-        count = len(ips)
-
-    else:
-        # handle the multi-cidr issue by split(',')
-        ipnetworks = [IPNetwork(c.strip()) for c in cidr.split(',')]
-
-        ips = [str(ip) for ipnetwork in ipnetworks for ip in ipnetwork]  # all the ip
-        count = len(ips)
+    ipnetworks = parse_cidr(cidr)
+    count = count_ip(ipnetworks)
 
     # sample from the all the ip to see if they belong to one region, if so, add on the counter, if not, move on to status-check
-    ipsamples = get_ip_sample(ips, SAMPLE_NUMBER)
+    ipsamples = get_ip_sample(ipnetworks, SAMPLE_NUMBER)
 
-    country_code_samples = []
-    for ipsample in ipsamples:
-        country_code_samples.append(get_country_code_from_ip(ipsample))
+    country_code_samples = get_country_codes_from_ips(ipsamples)
 
     # empty code samples, continue to the next cidr
     if len(set(country_code_samples)) == 0:
@@ -157,7 +227,7 @@ def process_no_country_code(cidr, company):
     elif len(set(country_code_samples)) == 1:
         for country_code_sample in country_code_samples:
             if country_code_sample:
-                counters[company][country_code_sample] += count
+                records.add(company, country_code_sample, count)
                 for ipnetwork in ipnetworks:
                     cidr_to_geocode_map[company][str(ipnetwork)] = {country_code_sample: 1}
                 break
@@ -168,7 +238,7 @@ def process_no_country_code(cidr, company):
         total = len(country_code_samples)
         ratio = Counter(country_code_samples)
         for country_code_sample, appearance in ratio.items():
-            counters[company][country_code_sample] += count * appearance / total
+            records.add(company, country_code_sample, count, appearance / total)
         for ipnetwork in ipnetworks:
             cidr_to_geocode_map[company][str(ipnetwork)] = {country_code_sample: appearance / total
                                                             for country_code_sample, appearance in ratio.items()}
@@ -179,36 +249,24 @@ def process_us_country_code(cidr, company):
     :param cidr: The cidr we read from the ip_ranges.csv. We will try to get state code and count ip number from this cidr
     :param company: The company that the cidr(s) belong to
     :return: We try to get the state code by the WHOIS service, if the cidr is private, then randomly assign a state code from the option and record.
-    Finally, we add on the global counters the country_code(state code) and the ip number.
+    Finally, we add on the global records the country_code(state code) and the ip number.
     """
-    if '-' in cidr:
-        # handle the dash ip range case
-        ip_start, ip_end = cidr.split('-', 1)
-        ip_start = ip_start.strip()
-        ip_end = ip_end.strip()
-
-        ipnetworks = netaddr.iprange_to_cidrs(ip_start, ip_end)
-        count = sum([len(ipnetwork) for ipnetwork in ipnetworks])
-
-    else:
-        # handle the multi-cidr case by split(',')
-        ipnetworks = [IPNetwork(c.strip()) for c in cidr.split(',')]
-        count = sum([len(ipnetwork) for ipnetwork in ipnetworks])
-        ip_start = ipnetworks[0][0]
+    ipnetworks = parse_cidr(cidr)
+    count = count_ip(ipnetworks)
+    ip_start = get_ip_at(ipnetworks, 0)
 
     country_code = get_country_code_from_ip(ip_start)
 
-    option = generate_location_option()
-
     # if the cidr is private, then randomly assign a state code from the option and record.
     if not country_code:
+        option = generate_location_option()
         country_code = random.choice([country_code_option for country_code_option in option[company] if 'US' in country_code_option])
 
         # Here we get a code without using ip, so we have to record this in a map called detect
         for ipnetwork in ipnetworks:
             detect[str(ipnetwork)] = country_code
 
-    counters[company][country_code] += count
+    records.add(company, country_code, count)
     for ipnetwork in ipnetworks:
 
         cidr_to_geocode_map[company][str(ipnetwork)] = {country_code: 1}
@@ -219,124 +277,132 @@ def process_non_us_country_code(cidr, company, country_code):
     :param cidr: The cidr we read from the ip_ranges.csv. We will try to count ip number from this cidr
     :param company: The company that the cidr(s) belong to
     :param country_code: The native country_code in the ip_ranges.csv file
-    :return: We count the ip number and then add it to the gloabl counters
+    :return: We count the ip number and then add it to the gloabl records
     """
-    if '-' in cidr:
-        # handle the dash ip range case
-        ip_start, ip_end = cidr.split('-', 1)
-        ip_start = ip_start.strip()
-        ip_end = ip_end.strip()
+    ipnetworks = parse_cidr(cidr)
+    count = count_ip(ipnetworks)
 
-        ipnetworks = netaddr.iprange_to_cidrs(ip_start, ip_end)
-        count = sum([len(ipnetwork) for ipnetwork in ipnetworks])
-
-    else:
-        # handle the multi-cidr case by split(',')
-        ipnetworks = [IPNetwork(c.strip()) for c in cidr.split(',')]
-        count = sum([len(ipnetwork) for ipnetwork in ipnetworks])
-
-    counters[company][country_code] += count
+    records.add(company, country_code, count)
     for ipnetwork in ipnetworks:
         cidr_to_geocode_map[company][str(ipnetwork)] = {country_code: 1}
 
 
+class ProgressLogger:
+    def __init__(self, name, interval=PROGRESS_INTERVAL):
+        """
+        :param name: the name of the job shown in the log
+        :param interval: minimum number of seconds between two log lines
+        """
+        self.name = name
+        self.interval = interval
+        self.last = time.monotonic()
+        self.count = 0
+
+    def update(self, item):
+        """
+        :param item: the item that is being processed, it is shown in the log line if enough time passed since the previous one
+        """
+        self.count += 1
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            logger.info(f'Processing {self.name}: {self.count} done, now at {item}')
+            self.last = now
+
+    def done(self):
+        logger.info(f'Done processing {self.name}: {self.count} in total')
+
+
 def process_amazon():
     """
-    :return: This function reads in the amazon_ip_ranges and count the country_code appearance by either SERVER_TO_REGION or ip detection and add it
-    to the counter.
+    :return: This function streams the prefixes (ipv4 and ipv6) of the amazon_ip_ranges and count the country_code appearance by either
+    SERVER_TO_REGION or ip detection and add it to the counter. Ipv6 prefixes are recorded in the cidr_to_geocode_map and the detect map, but not
+    counted, as a single ipv6 prefix holds more addresses than the whole ipv4 space.
     """
-    amazon_ip_ranges_path = 'input/amazon_ip_ranges.json'
-    with open(amazon_ip_ranges_path, 'r') as f:
-        prefixes = json.load(f)['prefixes']
+    progress = ProgressLogger('Amazon')
 
-    for i, prefix in enumerate(prefixes):
-        cidr = prefix["ip_prefix"]
+    for key, prefix in iter_array_items(FEED_PATHS['amazon'], ['prefixes', 'ipv6_prefixes']):
+        cidr = prefix["ip_prefix"] if key == 'prefixes' else prefix["ipv6_prefix"]
 
         server = prefix["region"]
 
-        logger.info(f'Processing Amazon: {i} {cidr}')
+        progress.update(cidr)
 
-        # Skip ipv 6 address
-        if ':' in cidr:
-            continue
-
-        service_ip_addresses = IPNetwork(cidr)
-        count = len(service_ip_addresses)
+        ipnetworks = parse_cidr(cidr)
+        count = count_ip(ipnetworks) if key == 'prefixes' else 0
 
         # get code if not in SERVER_TO_REGION
         if server not in SERVER_TO_REGION['AWS']:
-            ip = service_ip_addresses[0]
+            ip = get_ip_at(ipnetworks, 0)
 
             country_code = get_country_code_from_ip(ip)
             logger.info(f'New found server at {country_code} for {cidr}')
 
-            counters["Amazon"][country_code] += count
+            records.add("Amazon", country_code, count)
             cidr_to_geocode_map['Amazon'][cidr] = {country_code: 1}
         # get code from SERVER_TO_REGION and GEOCODE and record it to the detect map
         else:
             country_code = GEOCODE[SERVER_TO_REGION['AWS'][server].lower()]
-            counters["Amazon"][country_code] += count
+            records.add("Amazon", country_code, count)
             cidr_to_geocode_map['Amazon'][cidr] = {country_code: 1}
             detect[cidr] = country_code  # record to detection map because we get the country_code by SERVER_TO_REGION methods, not ip.
 
+    progress.done()
+
 
 def process_microsoft():
     """
-    :return: This function reads in the microsoft_ip_ranges and count the country_code appearance by either SERVER_TO_REGION or ip detection and add it
-    to the counter.
+    :return: This function streams the regions of the microsoft_ip_ranges and count the country_code appearance by either SERVER_TO_REGION or ip
+    detection and add it to the counter. Ipv6 subnets are recorded in the cidr_to_geocode_map and the detect map, but not counted.
     """
-    with open('input/microsoft_ip_ranges.json', 'r') as f:
-        lines = json.load(f)['Region']
-
     # change the key of Azure SERVER_TO_REGION to the same format as it appears in the ip_ranges file. (West Europe 2 -> westeurope2)
     temp_dict = {}
     for server, region in SERVER_TO_REGION['Azure'].items():
         temp_dict[server.lower().replace(' ', '')] = region
     SERVER_TO_REGION['Azure'] = temp_dict
 
-    for i, line in enumerate(lines):
+    progress = ProgressLogger('Microsoft')
+
+    for _, line in iter_array_items(FEED_PATHS['microsoft'], ['Region']):
         if 'IpRange' not in line:
             continue
         server = line["@Name"]
         cidrs = [iprange_data["@Subnet"] for iprange_data in line["IpRange"]]
 
-        logger.info(f'Processing Microsoft: {i} {cidrs}')
+        progress.update(server)
 
-        ipnetworks = [IPNetwork(cidr.strip()) for cidr in cidrs]
-        count = sum([len(ipnetwork) for ipnetwork in ipnetworks])
+        ipnetworks = parse_cidr(','.join(cidrs))
+        count = count_ip([ipnetwork for ipnetwork in ipnetworks if ipnetwork.version == 4])
 
         # server not in SERVER_TO_REGION, use first ip to detect region code
         if server not in SERVER_TO_REGION:
-            ip = ipnetworks[0][0]
+            ip = get_ip_at(ipnetworks, 0)
             country_code = get_country_code_from_ip(ip)
-            logger.info(f'New found server at {country_code} for {cidrs}')
-            counters["Microsoft"][country_code] += count
+            logger.info(f'New found server at {country_code} for {server}')
+            records.add("Microsoft", country_code, count)
             for ipnetwork in ipnetworks:
                 cidr_to_geocode_map['Microsoft'][str(ipnetwork)] = {country_code: 1}
 
         # get code from SERVER_TO_REGION and GEOCODE, and write the relationship in the detect map
         else:
             country_code = GEOCODE[SERVER_TO_REGION['Azure'][server].lower()]
-            counters["Microsoft"][country_code] += count
+            records.add("Microsoft", country_code, count)
             for ipnetwork in ipnetworks:
                 cidr_to_geocode_map['Microsoft'][str(ipnetwork)] = {country_code: 1}
                 detect[str(ipnetwork)] = country_code  # record to detection map because we get the country_code by SERVER_TO_REGION methods, not ip.
 
+    progress.done()
+
 
 def write_json():
     """
-    :return:This function takes the global counters and converts its value from appearance to frequency, and finally dump the counters and detect to
-    json file
+    :return:This function aggregates the global records into the frequency of each location for each company with one group-by, and finally dump
+    the frequencies and detect to json file, save a parquet snapshot of the records for later diffing, and compile the cidr_to_geocode_map into a
+    prefix table for later lookup
     """
-    # convert appearance to frequency
-    result = defaultdict(dict)
-    for company, location_distribution in counters.items():
-        total = sum(location_distribution.values())
-        for country_code, appearance in location_distribution.items():
-            result[company][country_code] = appearance / total
-
     with open('../../distribution/input/company_location_distribution.json', 'w') as f:
-        json.dump(result, f)
+        json.dump(records.distribution(), f)
+
+    records.write_parquet('output/location_records.parquet')
 
     with open('output/detect.json', 'w') as f:
         json.dump(detect, f)
@@ -344,38 +410,183 @@ def write_json():
     with open('output/cidr_to_geocode_map.json', 'w') as f:
         json.dump(cidr_to_geocode_map, f)
 
+    # compile the map into the binary prefix table used by geocode_lookup.GeocodeLookup
+    compile_table('output/cidr_to_geocode_map.json')
 
-if __name__ == '__main__':
 
-    with open('input/ip_ranges.csv', 'r', encoding='utf-8-sig') as f:
+def process_row(row):
+    """
+    :param row: a row (dictionary) of the ip_ranges.csv
+    :return: Process the cidr of the row according to its country code, the result is added to the global records
+    """
+    row_company = row['service_name'].strip()
+    row_cidr = row['identifier']
+    row_country_code = row['country']
+
+    logger.info(f'Now at row {row["id"]}, {row_cidr}')
+
+    # Skip ipv 6 address
+    if ':' in row_cidr:
+        return
+
+    # no region code, sampling to check if this cidr belongs to one location, if so, add to counter, else split it by sample ratio
+    if not row_country_code:
+        process_no_country_code(cidr=row_cidr, company=row_company)
+
+    # With US code, assume all the ip addresses in this Cidr belong to one location, so only one request to check out state, then overwrite it
+    elif row_country_code == 'US':
+        process_us_country_code(cidr=row_cidr, company=row_company)
+
+    # Easiest case, with non-US code. Count the length and add to the counter of that company
+    else:
+        process_non_us_country_code(cidr=row_cidr, company=row_company, country_code=row_country_code)
+
+
+def reset_state():
+    """
+    :return: Empty the global records, detect and cidr_to_geocode_map, so that a worker process starts every task from nothing
+    """
+    records.clear()
+    detect.clear()
+    cidr_to_geocode_map.clear()
+
+
+def collect_state():
+    """
+    :return: A json serializable dictionary of the global records, detect and cidr_to_geocode_map
+    """
+    return {'records': records.to_dict(),
+            'detect': dict(detect),
+            'cidr_to_geocode_map': dict(cidr_to_geocode_map)}
+
+
+def merge_state(state):
+    """
+    :param state: a dictionary returned by collect_state, usually from a worker process or a checkpoint
+    :return: Append the partial records to the global records and update the global detect and cidr_to_geocode_map with it
+    """
+    records.extend(state['records'])
+    detect.update(state['detect'])
+    for company, cidrs in state['cidr_to_geocode_map'].items():
+        cidr_to_geocode_map[company].update(cidrs)
+
+
+def init_worker(workers):
+    """
+    :param workers: number of worker processes
+    :return: Share the ipwhois rate limit between the worker processes, each of them has its own token bucket
+    """
+    GEOLOCATION_CLIENT.bucket = TokenBucket(RATE_LIMIT / workers)
+
+
+def process_partition(rows):
+    """
+    :param rows: a list of rows of the ip_ranges.csv
+    :return: the collect_state of the rows, computed from empty records
+    """
+    reset_state()
+    for row in rows:
+        process_row(row)
+    return collect_state()
+
+
+def process_feed(feed):
+    """
+    :param feed: 'amazon' or 'microsoft'
+    :return: the collect_state of the feed, computed from empty records
+    """
+    reset_state()
+    if feed == 'amazon':
+        process_amazon()
+    else:
+        process_microsoft()
+    return collect_state()
+
+
+def read_checkpoint(path):
+    """
+    :param path: path of a checkpoint file
+    :return: the state saved in the checkpoint, or None if the partition has not been finished yet
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, state):
+    """
+    :param path: path of a checkpoint file
+    :param state: the state of a finished partition. It is written to a temporary file first, so a crash never leaves half a checkpoint.
+    """
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def file_hash(path):
+    """
+    :param path: Path of a file
+    :return: The sha1 of the file content
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def run_pipeline(ip_ranges_path=IP_RANGES_PATH, workers=PIPELINE_WORKERS, partition_size=PARTITION_SIZE):
+    """
+    :param ip_ranges_path: path of the ip_ranges.csv
+    :param workers: number of worker processes
+    :param partition_size: number of rows in one partition
+    :return: Split the ip_ranges.csv into partitions and process them in a process pool, together with the amazon and microsoft feeds. Each task
+    returns partial records that are merged into the global records in a fixed order. Finished tasks are checkpointed under a directory named
+    after the content of the csv, so a restart only processes the tasks that were not finished, and a changed csv starts from scratch. The task of
+    a feed is named after the content of the feed file, so a changed feed is processed again. Return the checkpoint directory, to be removed with
+    clear_checkpoints once the results are written.
+    """
+    checkpoint_dir = os.path.join(CHECKPOINT_DIR, f'{file_hash(ip_ranges_path)}_{partition_size}')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    with open(ip_ranges_path, 'r', encoding='utf-8-sig') as f:
         ip_ranges = [row for row in csv.DictReader(f)]
 
-    for i, row in enumerate(ip_ranges):
+    tasks = {f'partition_{i // partition_size:05d}': (process_partition, ip_ranges[i:i + partition_size])
+             for i in range(0, len(ip_ranges), partition_size)}
+    tasks.update({f'{feed}_{file_hash(path)}': (process_feed, feed) for feed, path in FEED_PATHS.items()})
 
-        row_company = row['service_name'].strip()
-        row_cidr = row['identifier']
-        row_country_code = row['country']
+    states = {name: read_checkpoint(os.path.join(checkpoint_dir, f'{name}.json')) for name in tasks}
+    todo = [name for name, state in states.items() if state is None]
+    logger.info(f'{len(tasks) - len(todo)} of {len(tasks)} tasks restored from {checkpoint_dir}')
 
-        logger.info(f'Now at row {i}, {row_cidr}')
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(workers,)) as executor:
+        futures = {executor.submit(*tasks[name]): name for name in todo}
+        for future in as_completed(futures):
+            name = futures[future]
+            states[name] = future.result()
+            write_checkpoint(os.path.join(checkpoint_dir, f'{name}.json'), states[name])
+            logger.info(f'Finished {name}')
 
-        # Skip ipv 6 address
-        if ':' in row_cidr:
-            continue
+    # the partitions first and the feeds last, the same order as processing the rows one by one
+    for name in sorted(states, key=lambda task: (not task.startswith('partition'), task)):
+        merge_state(states[name])
+    return checkpoint_dir
 
-        # no region code, sampling to check if this cidr belongs to one location, if so, add to counter, else split it by sample ratio
-        if not row_country_code:
-            process_no_country_code(cidr=row_cidr, company=row_company)
 
-        # With US code, assume all the ip addresses in this Cidr belong to one location, so only one request to check out state, then overwrite it
-        elif row_country_code == 'US':
-            process_us_country_code(cidr=row_cidr, company=row_company)
+def clear_checkpoints(checkpoint_dir):
+    """
+    :param checkpoint_dir: the checkpoint directory of a finished run
+    :return: Remove the checkpoints, so the next run processes everything again (and refreshes the geolocation results past their TTL) instead of
+    replaying this run
+    """
+    for name in os.listdir(checkpoint_dir):
+        os.remove(os.path.join(checkpoint_dir, name))
+    os.rmdir(checkpoint_dir)
 
-        # Easiest case, with non-US code. Count the length and add to the counter of that company
-        else:
-            process_non_us_country_code(cidr=row_cidr, company=row_company, country_code=row_country_code)
 
-    process_amazon()
+if __name__ == '__main__':
+
+    checkpoint_dir = run_pipeline()
 
-    process_microsoft()
+    write_json()
 
-    output()
+    clear_checkpoints(checkpoint_dir)
@@ -0,0 +1,144 @@
+import json
+import os
+import numpy as np
+import netaddr
+from geoip_index import flatten_ranges, ip_to_int
+import logging
+logger = logging.getLogger()
+
+CIDR_TO_GEOCODE_MAP_PATH = 'output/cidr_to_geocode_map.json'
+TABLE_DIR = 'output/cidr_to_geocode_table'
+ARRAYS = ['starts', 'ends', 'entries', 'offsets', 'codes', 'weights']
+
+
+def compile_table(json_path=CIDR_TO_GEOCODE_MAP_PATH, table_dir=TABLE_DIR):
+    """
+    :param json_path: path of the cidr_to_geocode_map.json written by cidr_to_geocode.write_json
+    :param table_dir: directory we write the binary prefix table to
+    :return: This function flattens all the cidrs of all the companies into non-overlapping integer ranges (the most specific cidr wins) and
+    writes them as .npy files that can be memory-mapped:
+    starts, ends: the first and last ip of every range
+    entries: for every range, the index of its {geocode: weight} entry. Identical entries (like {'NL': 1}) are stored once
+    offsets: entry i owns codes[offsets[i]:offsets[i + 1]] and weights[offsets[i]:offsets[i + 1]]
+    codes, weights: the index of the geocode in meta.json and its weight
+    """
+    with open(json_path, 'r') as f:
+        cidr_to_geocode_map = json.load(f)
+
+    entry_index = {}  # {((geocode, weight), ...): entry number}
+    ranges = []
+    for company, cidrs in cidr_to_geocode_map.items():
+        for cidr, geocode_weights in cidrs.items():
+            if ':' in cidr:  # the table only holds ipv4
+                continue
+            entry = tuple(sorted(geocode_weights.items()))
+            ipnetwork = netaddr.IPNetwork(cidr)
+            ranges.append((ipnetwork.first, ipnetwork.last, entry_index.setdefault(entry, len(entry_index))))
+    ranges = flatten_ranges(ranges)
+
+    geocodes = sorted({geocode for entry in entry_index for geocode, _ in entry})
+    geocode_index = {geocode: i for i, geocode in enumerate(geocodes)}
+    entries = sorted(entry_index, key=entry_index.get)
+
+    arrays = {'starts': np.array([start for start, _, _ in ranges], dtype=np.uint32),
+              'ends': np.array([end for _, end, _ in ranges], dtype=np.uint32),
+              'entries': np.array([entry for _, _, entry in ranges], dtype=np.int32),
+              'offsets': np.cumsum([0] + [len(entry) for entry in entries]).astype(np.int32),
+              'codes': np.array([geocode_index[geocode] for entry in entries for geocode, _ in entry], dtype=np.int16),
+              'weights': np.array([weight for entry in entries for _, weight in entry], dtype=np.float32)}
+
+    os.makedirs(table_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(table_dir, f'{name}.npy'), arrays[name])
+
+    stat = os.stat(json_path)
+    with open(os.path.join(table_dir, 'meta.json'), 'w') as f:
+        json.dump({'geocodes': geocodes, 'source_mtime': stat.st_mtime_ns, 'source_size': stat.st_size}, f)
+
+    logger.info(f'Compiled {len(ranges)} ranges and {len(entries)} entries from {json_path} to {table_dir}')
+
+
+def is_stale(json_path=CIDR_TO_GEOCODE_MAP_PATH, table_dir=TABLE_DIR):
+    """
+    :return: True if the table in table_dir does not exist or was compiled from another version of json_path
+    """
+    meta_path = os.path.join(table_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return True
+
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    stat = os.stat(json_path)
+    return meta['source_mtime'] != stat.st_mtime_ns or meta['source_size'] != stat.st_size
+
+
+class GeocodeLookup:
+    def __init__(self, table_dir=TABLE_DIR):
+        """
+        :param table_dir: directory of a table written by compile_table. The arrays are memory-mapped, so opening the table costs almost nothing
+        and several processes share the same pages.
+        """
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(table_dir, f'{name}.npy'), mmap_mode='r'))
+        with open(os.path.join(table_dir, 'meta.json'), 'r') as f:
+            self.geocodes = json.load(f)['geocodes']
+        self.entry_cache = {}
+
+    @classmethod
+    def from_json(cls, json_path=CIDR_TO_GEOCODE_MAP_PATH, table_dir=TABLE_DIR):
+        """
+        :return: a GeocodeLookup of json_path, compiling the table first if it is missing or out of date
+        """
+        if is_stale(json_path, table_dir):
+            compile_table(json_path, table_dir)
+        return cls(table_dir)
+
+    def get_entry(self, entry):
+        """
+        :param entry: an entry number
+        :return: the {geocode: weight} dictionary of the entry, a copy of the cached one so the caller can change it
+        """
+        if entry not in self.entry_cache:
+            start, end = self.offsets[entry], self.offsets[entry + 1]
+            self.entry_cache[entry] = {self.geocodes[code]: float(weight) for code, weight in zip(self.codes[start:end], self.weights[start:end])}
+        return dict(self.entry_cache[entry])
+
+    def lookup_entries(self, ips):
+        """
+        :param ips: a numpy array of integer ip addresses
+        :return: a numpy array of the entry number of each ip, -1 if the ip is not in any cidr
+        """
+        ips = np.asarray(ips, dtype=np.uint32)
+        if len(self.entries) == 0:  # an empty table, nothing is found
+            return np.full(len(ips), -1, dtype=self.entries.dtype)
+        positions = np.searchsorted(self.starts, ips, side='right') - 1
+        found = positions >= 0
+        found[found] = ips[found] <= self.ends[positions[found]]
+        return np.where(found, self.entries[np.maximum(positions, 0)], -1)
+
+    def lookup_many(self, ips):
+        """
+        :param ips: a numpy array of integer ip addresses, or a list of ip addresses
+        :return: a list of {geocode: weight} dictionaries in the same order as ips, an empty dictionary for the ip that is not in any cidr. The
+        table only holds ipv4, so ipv6 addresses are never found.
+        """
+        if isinstance(ips, np.ndarray):
+            return [self.get_entry(entry) if entry >= 0 else {} for entry in self.lookup_entries(ips)]
+
+        result = [{} for _ in ips]
+        ipv4 = [i for i, ip in enumerate(ips) if ':' not in str(ip)]
+        for i, entry in zip(ipv4, self.lookup_entries(np.array([ip_to_int(ips[i]) for i in ipv4], dtype=np.uint32))):
+            if entry >= 0:
+                result[i] = self.get_entry(entry)
+        return result
+
+    def lookup(self, ip):
+        """
+        :param ip: an ip address
+        :return: the {geocode: weight} dictionary of the most specific cidr that contains ip, or an empty dictionary
+
+        example:
+        input: '159.8.198.10'
+        output: {'NL': 1.0}
+        """
+        return self.lookup_many([ip])[0]
@@ -0,0 +1,145 @@
+import csv
+import numpy as np
+import netaddr
+import logging
+logger = logging.getLogger()
+
+
+def ip_to_int(ip):
+    """
+    :param ip: an ip address, either a string (dotted, or the integer value in decimal like the ip_from / ip_to columns of some databases), a
+    netaddr.IPAddress or already an integer
+    :return: the integer value of the ip address
+
+    example:
+    input: '10.0.0.1' or '167772161'
+    output: 167772161
+    """
+    if isinstance(ip, (int, np.integer)):
+        return int(ip)
+    ip = str(ip).strip()
+    if ip.isdigit():  # netaddr 1.x does not parse a decimal string as an address
+        return int(ip)
+    return int(netaddr.IPAddress(ip))
+
+
+def flatten_ranges(ranges):
+    """
+    :param ranges: a list of (start, end, value) tuples of integer ip ranges, end included. Ranges can be nested in each other (like a /16 that
+    contains a /24) or disjoint.
+    :return: a sorted list of non-overlapping (start, end, value) tuples. Where ranges are nested, the most specific (innermost) range wins, which
+    gives the same answer as a longest-prefix-match.
+
+    example:
+    input: [(0, 255, 'A'), (16, 31, 'B')]
+    output: [(0, 15, 'A'), (16, 31, 'B'), (32, 255, 'A')]
+    """
+    result = []
+    stack = []  # the ranges containing the current position, innermost on top
+    cursor = 0  # the first position that is not written to result yet
+
+    for start, end, value in sorted(ranges, key=lambda item: (item[0], -item[1])):
+        # close the ranges that end before this one starts
+        while stack and stack[-1][0] < start:
+            top_end, top_value = stack.pop()
+            if cursor <= top_end:
+                result.append((cursor, top_end, top_value))
+                cursor = top_end + 1
+
+        # the enclosing range covers the gap up to this range
+        if stack and cursor < start:
+            result.append((cursor, start - 1, stack[-1][1]))
+
+        stack.append((end, value))
+        cursor = start
+
+    while stack:
+        top_end, top_value = stack.pop()
+        if cursor <= top_end:
+            result.append((cursor, top_end, top_value))
+            cursor = top_end + 1
+
+    return result
+
+
+class GeoIPIndex:
+    def __init__(self, ranges):
+        """
+        :param ranges: a list of (start, end, value) tuples of integer ip ranges. Overlapping ranges are resolved with flatten_ranges, and the result
+        is stored in sorted numpy arrays so that a lookup is a binary search (np.searchsorted).
+        """
+        ranges = flatten_ranges(ranges)
+        self.values = sorted({value for _, _, value in ranges})
+        value_index = {value: i for i, value in enumerate(self.values)}
+
+        self.starts = np.array([start for start, _, _ in ranges], dtype=np.uint64)
+        self.ends = np.array([end for _, end, _ in ranges], dtype=np.uint64)
+        self.labels = np.array([value_index[value] for _, _, value in ranges], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_csv(cls, path, to_value):
+        """
+        :param path: path of a GeoIP-style csv dump. The header should contain either a 'network' column (cidr) or 'ip_from' and 'ip_to' columns
+        (dotted ip or integer), as well as 'country_code' and an optional 'region' (or 'region_name') column.
+        :param to_value: a function that takes (country_code, region) and returns the value we store for the range. If it raises KeyError, the row
+        is skipped.
+        :return: a GeoIPIndex object. IPv6 rows are skipped.
+        """
+        ranges = []
+        skipped = 0
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                if 'network' in row:
+                    if ':' in row['network']:
+                        continue
+                    ipnetwork = netaddr.IPNetwork(row['network'].strip())
+                    start, end = ipnetwork.first, ipnetwork.last
+                else:
+                    if ':' in row['ip_from']:
+                        continue
+                    start, end = ip_to_int(row['ip_from'].strip()), ip_to_int(row['ip_to'].strip())
+
+                try:
+                    value = to_value(row['country_code'].strip(), (row.get('region') or row.get('region_name') or '').strip())
+                except KeyError:
+                    skipped += 1
+                    continue
+                if value:
+                    ranges.append((start, end, value))
+
+        logger.info(f'Loaded {len(ranges)} ranges from {path}, skipped {skipped} rows')
+        return cls(ranges)
+
+    def lookup_ints(self, ips):
+        """
+        :param ips: a numpy array (or a list) of integer ip addresses
+        :return: a numpy array of the position of the range each ip belongs to, -1 if the ip is not in any range
+        """
+        ips = np.asarray(ips, dtype=np.uint64)
+        positions = np.searchsorted(self.starts, ips, side='right') - 1
+        found = positions >= 0
+        found[found] = ips[found] <= self.ends[positions[found]]
+        return np.where(found, positions, -1)
+
+    def lookup_many(self, ips):
+        """
+        :param ips: a list of ip addresses
+        :return: a list of values in the same order as ips, empty string for the ip that is not in any range. The index only holds ipv4, so ipv6
+        addresses are never found.
+        """
+        result = [''] * len(ips)
+        ipv4 = [i for i, ip in enumerate(ips) if ':' not in str(ip)]
+        for i, position in zip(ipv4, self.lookup_ints([ip_to_int(ips[i]) for i in ipv4])):
+            if position >= 0:
+                result[i] = self.values[self.labels[position]]
+        return result
+
+    def lookup(self, ip):
+        """
+        :param ip: an ip address
+        :return: the value of the range that contains ip, or empty string
+        """
+        return self.lookup_many([ip])[0]
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import logging
+logger = logging.getLogger()
+
+CACHE_TTL = 30 * 24 * 3600  # seconds before a cached location is queried again
+NEGATIVE_TTL = 7 * 24 * 3600  # seconds before a cached definitive failure (like a reserved range) is queried again
+DEFINITIVE_FAILURES = ['reserved range', 'private range', 'invalid ip address']  # messages of the api that querying again will not change
+RATE_LIMIT = 10  # requests per second
+MAX_WORKERS = 8
+REQUEST_TIMEOUT = 10  # seconds
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: number of tokens added to the bucket per second
+        :param capacity: maximum number of tokens the bucket can hold, which is the largest burst we allow. Default to rate (at least 1).
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until one token is available and take it. It is safe to call from several threads.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GeolocationCache:
+    def __init__(self, path, ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL):
+        """
+        :param path: path of the sqlite file that stores the responses, it is created if not exist
+        :param ttl: number of seconds a cached response stays valid
+        :param negative_ttl: number of seconds a cached unsuccessful response stays valid
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.pid = None
+        self.conn = None
+        self.connect()
+
+    def connect(self):
+        """
+        Open the sqlite connection and create the table if not exist. A connection cannot be shared with a forked process, so the connection is
+        opened again when we are in another process than the one that opened it.
+        """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS ip_location(
+                             ip text PRIMARY KEY,
+                             response text,
+                             fetched_at real
+                             )""")
+        self.conn.commit()
+
+    def get_many(self, ips):
+        """
+        :param ips: a list of ip strings
+        :return: a dictionary of ip to the cached response (dictionary) for every ip that has a non-expired entry. An unsuccessful response expires
+        after negative_ttl instead of ttl
+        """
+        self.connect()
+        result = {}
+        now = time.time()
+        unique_ips = list(set(ips))
+        for i in range(0, len(unique_ips), 500):  # stay under the sqlite variable limit
+            chunk = unique_ips[i:i + 500]
+            rows = self.conn.execute(f"""SELECT ip, response, fetched_at FROM ip_location
+                                         WHERE fetched_at >= ? AND ip IN ({','.join('?' * len(chunk))})""",
+                                     [now - max(self.ttl, self.negative_ttl)] + chunk)
+            for ip, response, fetched_at in rows:
+                response = json.loads(response)
+                if fetched_at >= now - (self.ttl if response.get('success', False) else self.negative_ttl):
+                    result[ip] = response
+        return result
+
+    def put_many(self, responses):
+        """
+        :param responses: a dictionary of ip to response (dictionary) that we want to store
+        """
+        self.connect()
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO ip_location(ip, response, fetched_at) VALUES (?, ?, ?)",
+                                  [(ip, json.dumps(response), now) for ip, response in responses.items()])
+
+
+class GeolocationClient:
+    def __init__(self, url, key, cache_path, ttl=CACHE_TTL, rate=RATE_LIMIT, max_workers=MAX_WORKERS, headers=None, negative_ttl=NEGATIVE_TTL):
+        """
+        :param url: the base url of the ipwhois api, the query url is '{url}/{ip}?key={key}'
+        :param key: the api key
+        :param cache_path: path of the sqlite cache file
+        :param ttl: number of seconds a cached response stays valid
+        :param rate: maximum number of requests per second sent to the api
+        :param max_workers: number of requests that can be in flight at the same time
+        :param headers: headers sent with every request
+        :param negative_ttl: number of seconds a cached definitive failure stays valid
+        """
+        self.url = url
+        self.key = key
+        self.cache = GeolocationCache(cache_path, ttl=ttl, negative_ttl=negative_ttl)
+        self.bucket = TokenBucket(rate)
+        self.max_workers = max_workers
+
+        # one keep-alive session shared by all the workers, with a connection pool as large as the worker pool
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def fetch(self, ip):
+        """
+        :param ip: an ip string
+        :return: the json response of the api as a dictionary if the query succeeded or failed definitively (its 'success' is False, like for a
+        reserved range), None if it failed for a transient reason (network, rate limit, bad response)
+        """
+        self.bucket.acquire()
+        try:
+            response = self.session.get(f'{self.url}/{ip}?key={self.key}', timeout=REQUEST_TIMEOUT)
+            res_json = response.json()
+        except Exception:
+            logger.warning(f'Request to ipwhois failed for ip {ip}')
+            return None
+
+        if not res_json.get('success', False):
+            message = res_json.get('message', 'Bad response from ipwhois api')
+            logger.warning(f'{message} for ip {ip}')
+            if any(failure in str(message).lower() for failure in DEFINITIVE_FAILURES):
+                return res_json
+            return None
+
+        return res_json
+
+    def query_many(self, ips):
+        """
+        :param ips: a list of ip addresses
+        :return: a list of responses in the same order as ips, None for the ip that we could not locate. Cached ips cost no request, the others
+        are sent in parallel and the successful responses and the definitive failures are written to the cache, only the transient failures are
+        queried again next time.
+        """
+        ips = [str(ip) for ip in ips]
+        responses = self.cache.get_many(ips)
+        missing = list(dict.fromkeys(ip for ip in ips if ip not in responses))
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                fetched = dict(zip(missing, executor.map(self.fetch, missing)))
+            fetched = {ip: res_json for ip, res_json in fetched.items() if res_json is not None}
+            self.cache.put_many(fetched)
+            responses.update(fetched)
+
+        return [responses[ip] if ip in responses and responses[ip].get('success', False) else None for ip in ips]
+
+    def query(self, ip):
+        """
+        :param ip: an ip address
+        :return: the response of the api as a dictionary, or None if we could not locate the ip
+        """
+        return self.query_many([ip])[0]
@@ -0,0 +1,128 @@
+import json
+
+CHUNK_SIZE = 65536  # characters read from the file at a time
+WHITESPACE = ' \t\n\r'
+DELIMITERS = ',]}' + WHITESPACE  # the characters that can follow a complete number
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class JSONStream:
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        """
+        :param f: a text file object
+        :param chunk_size: number of characters read from f at a time. Only the unparsed part of the file is kept in memory.
+        """
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Drop the parsed part of the buffer and append the next chunk of the file to it
+        """
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """
+        :return: the next non-whitespace character, without consuming it. Empty string at the end of the file.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, char):
+        """
+        :param char: the character that must come next (whitespace skipped), it is consumed
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} but found {found!r} in json stream')
+        self.pos += 1
+
+    def decode_value(self):
+        """
+        :return: the next json value (string, number, object, ...) decoded as a python object
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+
+            # a number not followed by a delimiter may continue in the next chunk, like '1.' or '1e' that decode as 1
+            if is_number(value) and not self.eof and (end == len(self.buffer) or self.buffer[end] not in DELIMITERS):
+                self.fill()
+                continue
+
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """
+        :return: a generator of the items of the json array that comes next, decoded one at a time
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.decode_value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f'Expected "," or "]" but found {separator!r} in json stream')
+
+
+def iter_array_items(path, keys):
+    """
+    :param path: path of a json file whose top level is an object
+    :param keys: the top level keys of the arrays we want to read
+    :return: a generator of (key, item) for every item of the arrays under keys, in file order. Arrays under other keys are skipped item by item,
+    so the memory used does not depend on the size of the file.
+
+    example:
+    input: amazon_ip_ranges.json, ['prefixes', 'ipv6_prefixes']
+    output: ('prefixes', {'ip_prefix': '18.208.0.0/13', 'region': 'us-east-1', 'service': 'AMAZON'}), ...
+    """
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        stream = JSONStream(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+
+        while True:
+            key = stream.decode_value()
+            stream.expect(':')
+            if stream.peek() == '[':
+                for item in stream.iter_array():
+                    if key in keys:
+                        yield key, item
+            else:
+                stream.decode_value()
+
+            separator = stream.peek()
+            stream.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f'Expected "," or "}}" but found {separator!r} in json stream')
@@ -0,0 +1,87 @@
+import pandas as pd
+import logging
+logger = logging.getLogger()
+
+COLUMNS = ['company', 'geocode', 'ip_count', 'weight']
+
+
+class LocationRecords:
+    def __init__(self):
+        """
+        A columnar batch of location records. Every record says that weight * ip_count ip addresses of company are located at geocode. The records
+        are only appended while processing, the aggregation is done once at the end with a pandas group-by.
+        """
+        self.columns = {column: [] for column in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['company'])
+
+    def add(self, company, geocode, ip_count, weight=1):
+        """
+        :param company: the company that the ip addresses belong to
+        :param geocode: 2 digit country code or US +'_'+ 2 digit state code
+        :param ip_count: number of ip addresses of the range
+        :param weight: the share of the range located at geocode, 1 if the whole range is there
+        """
+        self.columns['company'].append(company)
+        self.columns['geocode'].append(geocode)
+        self.columns['ip_count'].append(ip_count)
+        self.columns['weight'].append(weight)
+
+    def extend(self, columns):
+        """
+        :param columns: a dictionary of column name to list, as returned by to_dict (from another process or a checkpoint)
+        """
+        for column in COLUMNS:
+            self.columns[column].extend(columns[column])
+
+    def clear(self):
+        for column in COLUMNS:
+            self.columns[column].clear()
+
+    def to_dict(self):
+        """
+        :return: a json serializable dictionary of column name to list
+        """
+        return {column: list(values) for column, values in self.columns.items()}
+
+    def to_frame(self):
+        """
+        :return: a pandas DataFrame of the records
+        """
+        return pd.DataFrame({'company': pd.Series(self.columns['company'], dtype='category'),
+                             'geocode': pd.Series(self.columns['geocode'], dtype='category'),
+                             'ip_count': pd.Series(self.columns['ip_count'], dtype='float64'),
+                             'weight': pd.Series(self.columns['weight'], dtype='float64')})
+
+    def aggregate(self):
+        """
+        :return: a pandas DataFrame of company, geocode, ip_count (the weighted sum of ip addresses) and frequency (the share of the company's ip
+        addresses located at geocode)
+        """
+        data = self.to_frame()
+        data['ip_count'] = data['ip_count'] * data['weight']
+        result = data.groupby(['company', 'geocode'], observed=True, sort=False)['ip_count'].sum().reset_index()
+        result['frequency'] = result['ip_count'] / result.groupby('company', observed=True)['ip_count'].transform('sum')
+        return result
+
+    def distribution(self):
+        """
+        :return: a dictionary of company to {geocode: frequency}, the format of company_location_distribution.json
+
+        example:
+        output: {'IBM': {'NL': 0.05, 'US_TX': 0.3, ...}, ...}
+        """
+        result = {}
+        for row in self.aggregate().itertuples(index=False):
+            result.setdefault(row.company, {})[row.geocode] = row.frequency
+        return result
+
+    def write_parquet(self, path):
+        """
+        :param path: path of the parquet snapshot of the records. It needs pyarrow (or fastparquet), if none is installed we only log a warning.
+        """
+        try:
+            self.to_frame().to_parquet(path, index=False)
+        except ImportError:
+            logger.warning(f'No parquet engine installed, {path} is not written')
@@ -0,0 +1,55 @@
+import io
+import json
+
+from json_stream import JSONStream, iter_array_items
+
+TEXT = '{"syncToken": "1559770389", "prefixes": [{"ip_prefix": "18.208.0.0/13", "region": "us-east-1"}, -12, 1.5e-3, 0.25, 7E+2, true, ' \
+       'null, "a,b]", [1, [2.0]], {"x": -0.5}], "count": 123.5, "ipv6_prefixes": [], "tail": [false, 10]}'
+
+
+class SplitReader:
+    """
+    A text file object that returns the text in two reads, cut at offset
+    """
+    def __init__(self, text, offset):
+        self.parts = [text[:offset], text[offset:]]
+
+    def read(self, size=-1):
+        while self.parts:
+            part = self.parts.pop(0)
+            if part:
+                return part
+        return ''
+
+
+def read_object(stream):
+    """
+    :return: the top level object of the stream, with its arrays read item by item
+    """
+    result = {}
+    stream.expect('{')
+    while stream.peek() != '}':
+        key = stream.decode_value()
+        stream.expect(':')
+        result[key] = list(stream.iter_array()) if stream.peek() == '[' else stream.decode_value()
+        if stream.peek() == ',':
+            stream.pos += 1
+    return result
+
+
+def test_every_cut_offset():
+    expected = json.loads(TEXT)
+    for offset in range(len(TEXT) + 1):
+        assert read_object(JSONStream(SplitReader(TEXT, offset))) == expected, offset
+
+
+def test_one_character_chunks():
+    assert read_object(JSONStream(io.StringIO(TEXT), chunk_size=1)) == json.loads(TEXT)
+
+
+def test_iter_array_items(tmp_path):
+    path = tmp_path / 'ip_ranges.json'
+    path.write_text(TEXT, encoding='utf-8')
+    expected = json.loads(TEXT)
+    assert list(iter_array_items(str(path), ['prefixes', 'tail'])) == [('prefixes', item) for item in expected['prefixes']] + \
+        [('tail', item) for item in expected['tail']]